@@ -0,0 +1,91 @@
+"""
+运行全部基准测试, 以 JSON 格式输出结果, 便于比较不同版本.
+
+    python -m benchmarks [--quick] [--heights 100 1000] [--output results.json]
+
+区块链写在一个临时目录中, 不会影响当前目录下的 db.sqlite3.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("--heights", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--wallets", type=int, default=20)
+    parser.add_argument("--target-bits", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--quick", action="store_true", help="Small sizes for a smoke test.")
+    parser.add_argument("--output", help="Write JSON to this file instead of stdout.")
+    args = parser.parse_args()
+
+    options = dict(
+        heights=args.heights,
+        n_wallets=args.wallets,
+        target_bits=args.target_bits,
+        repeat=args.repeat,
+        seed=args.seed,
+    )
+    if args.quick:
+        options.update(
+            heights=[20, 50],
+            n_wallets=5,
+            target_bits=12,
+            pow_rounds=3,
+            inputs=(1, 10),
+            apply_txs=20,
+            frame_bytes=256 * 1024,
+            frames=3,
+            repeat=2,
+        )
+
+    output = Path(args.output).resolve() if args.output else None
+    revision = git_revision()
+    with tempfile.TemporaryDirectory() as workdir:
+        # storage 在导入时打开当前目录下的数据库
+        os.chdir(workdir)
+        from benchmarks import suite
+
+        start = time.time()
+        results = suite.run(**options)
+
+    report = {
+        "meta": {
+            "revision": revision,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "started_at": start,
+            "options": options,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if output:
+        output.write_text(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+比较各个选币策略: 在随机生成的 UTXO 集合上支付随机金额, 统计输入数量, 不需要找零的比例,
+选币耗时以及签名和验证生成的交易的耗时.
+
+    python -m benchmarks.coinselect [--utxos 200] [--payments 100] [--seed 0]
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from bitcoin_in_python.coinselect import STRATEGIES, select_coins, units
+from bitcoin_in_python.transaction import Transaction, TXInput, TXOutput
+from bitcoin_in_python.wallet import Wallet
+
+
+def make_utxos(n: int, address: str) -> list[tuple[str, int, TXOutput]]:
+    """大部分是小额的找零, 少数是大额的收入, 金额保留两位小数."""
+    utxos = []
+    for i in range(n):
+        value = random.choice([random.uniform(0.01, 1), random.uniform(1, 50)])
+        utxos.append((f"{i:064x}", 0, TXOutput(round(value, 2), address)))
+    return utxos
+
+
+def build(wallet: Wallet, selected, total: float, amount: float) -> Transaction:
+    pubkey = wallet.export_public_key()
+    inputs = [TXInput(txid, index, b"", pubkey) for txid, index, _ in selected]
+    outputs = [TXOutput(amount, "receiver")]
+    if units(total) > units(amount):
+        outputs.append(TXOutput(total - amount, wallet.get_address()))
+    return Transaction("", inputs, outputs)
+
+
+def run(strategy: str, wallet: Wallet, utxos, amounts: list[float]) -> dict:
+    inputs = []
+    exact = 0
+    select_seconds = sign_seconds = verify_seconds = 0.0
+    for amount in amounts:
+        start = time.perf_counter()
+        selected, total = select_coins(utxos, amount, strategy)
+        select_seconds += time.perf_counter() - start
+
+        tx = build(wallet, selected, total, amount)
+        start = time.perf_counter()
+        tx.sign(wallet)
+        sign_seconds += time.perf_counter() - start
+        tx.hash()
+        start = time.perf_counter()
+        assert tx.verify()
+        verify_seconds += time.perf_counter() - start
+
+        inputs.append(len(selected))
+        exact += len(tx.vout) == 1
+    n = len(amounts)
+    return {
+        "mean_inputs": statistics.mean(inputs),
+        "max_inputs": max(inputs),
+        "no_change": exact / n,
+        "select_ms": select_seconds / n * 1000,
+        "sign_ms": sign_seconds / n * 1000,
+        "verify_ms": verify_seconds / n * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--utxos", type=int, default=200)
+    parser.add_argument("--payments", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    wallet = Wallet.new_wallet()
+    utxos = make_utxos(args.utxos, wallet.get_address())
+    random.shuffle(utxos)
+    # 一半是随机金额, 一半恰好是某几个 UTXO 的和 (例如把收到的钱原样转出)
+    amounts = [round(random.uniform(0.5, 100), 2) for _ in range(args.payments // 2)]
+    amounts += [
+        round(sum(u[2].value for u in random.sample(utxos, random.randint(1, 3))), 2)
+        for _ in range(args.payments - len(amounts))
+    ]
+    # bnb 只接受恰好相等的组合, 随机金额大多找不到, 所以只比较其余的策略
+    for strategy in [name for name in STRATEGIES if name != "bnb"]:
+        result = run(strategy, wallet, utxos, amounts)
+        print(
+            f"{strategy:>13}: {result['mean_inputs']:6.2f} inputs (max {result['max_inputs']:3}), "
+            f"no change {result['no_change']:4.0%}, select {result['select_ms']:6.2f} ms, "
+            f"sign {result['sign_ms']:7.2f} ms, verify {result['verify_ms']:7.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
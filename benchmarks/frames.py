@@ -0,0 +1,83 @@
+"""
+通过本机回环地址发送多个数 MB 的 frame, 测量 recv_data 的吞吐量.
+
+    python -m benchmarks.frames [--size-mb 8] [--count 20]
+"""
+
+import argparse
+import socket
+import threading
+import time
+
+from bitcoin_in_python.protocol import FrameReader, recv_data, send_data
+
+
+def bench_frames(size: int, count: int) -> dict:
+    server = socket.create_server(('localhost', 0))
+    port = server.getsockname()[1]
+    payload = b'\x42' * size
+
+    def sender():
+        conn, _ = server.accept()
+        with conn:
+            for _ in range(count):
+                send_data('reply', payload, conn)
+
+    t = threading.Thread(target=sender)
+    t.start()
+    with socket.create_connection(('localhost', port)) as s:
+        start = time.perf_counter()
+        for _ in range(count):
+            _, data = recv_data(s)
+            assert len(data) == size
+        elapsed = time.perf_counter() - start
+    t.join()
+    server.close()
+    return {
+        "frame_bytes": size,
+        "frames": count,
+        "seconds": elapsed,
+        "mb_per_s": size * count / elapsed / 1e6,
+    }
+
+
+def bench_stream(size: int, count: int) -> dict:
+    """用 iter_payload 分块读取同样的数据, 内存占用只有一个块的大小."""
+    a, b = socket.socketpair()
+    payload = b'\x42' * size
+
+    def sender():
+        for _ in range(count):
+            send_data('reply', payload, a)
+
+    t = threading.Thread(target=sender)
+    t.start()
+    reader = FrameReader(b)
+    start = time.perf_counter()
+    for _ in range(count):
+        _, length = reader.read_header()
+        assert sum(len(chunk) for chunk in reader.iter_payload(length)) == size
+    elapsed = time.perf_counter() - start
+    t.join()
+    a.close()
+    b.close()
+    return {
+        "frame_bytes": size,
+        "frames": count,
+        "seconds": elapsed,
+        "mb_per_s": size * count / elapsed / 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=float, default=8)
+    parser.add_argument("--count", type=int, default=20)
+    args = parser.parse_args()
+    size = int(args.size_mb * 1024 * 1024)
+    print("recv_data over TCP loopback:", bench_frames(size, args.count))
+    print("iter_payload over socketpair:", bench_stream(size, args.count))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+为基准测试生成钱包和区块链.
+
+生成的区块默认难度为 0, 不需要真正挖矿, 只有数据的形状 (区块数, 每个区块的交易数) 与真实的链相同.
+"""
+
+import random
+import time
+
+from bitcoin_in_python.block import Block, BlockChain
+from bitcoin_in_python.miner import mine
+from bitcoin_in_python.transaction import Transaction
+from bitcoin_in_python.wallet import Wallet
+
+GENESIS_PREV_HASH = "0" * 64
+
+
+def make_wallets(n: int) -> list[Wallet]:
+    return [Wallet.new_wallet() for _ in range(n)]
+
+
+def build_block(txs: list[Transaction], prev_block_hash: str, target_bits: int = 0) -> Block:
+    block = Block(int(time.time()), txs, prev_block_hash, target_bits=target_bits)
+    result = mine(block.prepare_prefix(), target_bits)
+    assert result is not None  # 没有传入 stop, 不会被中止
+    block.nonce, block.hash = result.nonce, result.hash
+    return block
+
+
+def make_transfers(chain: BlockChain, wallets: list[Wallet], n: int) -> list[Transaction]:
+    """n 笔转账, 每笔的付款方不同, 所以它们可以放在同一个区块中."""
+    txs = []
+    senders = random.sample(range(len(wallets)), min(n, len(wallets)))
+    for i in senders:
+        sender, receiver = wallets[i], wallets[(i + 1) % len(wallets)]
+        if chain.get_balance(sender.get_address()) >= 1:
+            txs.append(Transaction.new_transaction(sender, receiver.get_address(), 0.5, chain))
+    return txs
+
+
+def grow_chain(
+    chain: BlockChain,
+    wallets: list[Wallet],
+    height: int,
+    transfers_per_block: int = 1,
+    target_bits: int = 0,
+) -> tuple[int, int, float]:
+    """
+    在链顶之后添加区块, 直到链的高度为 height. 每个区块的 coinbase 轮流奖励给各个钱包.
+    返回 (新增的区块数, 新增的交易数, 花在 add_block 上的秒数).
+    """
+    blocks = txs = 0
+    elapsed = 0.0
+    while len(chain) < height:
+        prev_hash = chain.block_at(len(chain) - 1).hash if len(chain) else GENESIS_PREV_HASH
+        miner = wallets[len(chain) % len(wallets)]
+        block_txs = [Transaction.new_coinbase_transaction(miner.get_address())]
+        if len(chain):
+            block_txs += make_transfers(chain, wallets, transfers_per_block)
+        block = build_block(block_txs, prev_hash, target_bits)
+
+        start = time.perf_counter()
+        chain.add_block(block)
+        elapsed += time.perf_counter() - start
+        blocks += 1
+        txs += len(block_txs)
+    return blocks, txs, elapsed
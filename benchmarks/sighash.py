@@ -0,0 +1,63 @@
+"""
+对输入数量不同的交易计算全部签名摘要, 比较逐个构造交易副本的旧做法和 Transaction.sighashes.
+
+    python -m benchmarks.sighash [--inputs 1 10 100 1000] [--repeat 3]
+"""
+
+import argparse
+import time
+from hashlib import sha256
+
+from bitcoin_in_python.transaction import Transaction, TXInput, TXOutput
+
+PUBKEY = "-----BEGIN PUBLIC KEY-----\n" + "A" * 120 + "\n-----END PUBLIC KEY-----"
+
+
+def make_transaction(n_inputs: int) -> Transaction:
+    inputs = [TXInput(f"{i:064x}", i % 4, b"", PUBKEY) for i in range(n_inputs)]
+    tx = Transaction("", inputs, [TXOutput(1, "receiver"), TXOutput(0.5, "change")])
+    tx.hash()
+    return tx
+
+
+def quadratic_sighashes(tx: Transaction) -> list[bytes]:
+    """旧的做法: 每个 input 都构造一个交易副本并重新计算所有哈希."""
+    digests = []
+    for index, vin in enumerate(tx.vin):
+        tx_copy = tx.trimmed_copy()
+        tx_copy.vin[index].pubkey = vin.pubkey
+        digests.append(sha256(tx_copy.compute_id().encode()).digest())
+    return digests
+
+
+def linear_sighashes(tx: Transaction) -> list[bytes]:
+    return tx.sighashes([vin.pubkey for vin in tx.vin])
+
+
+def best_of(func, tx: Transaction, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(tx)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--inputs", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    for n in args.inputs:
+        tx = make_transaction(n)
+        assert quadratic_sighashes(tx) == linear_sighashes(tx)
+        old = best_of(quadratic_sighashes, tx, args.repeat)
+        new = best_of(linear_sighashes, tx, args.repeat)
+        print(
+            f"{n:>5} inputs: per-input copy {old * 1000:9.2f} ms, "
+            f"sighashes {new * 1000:7.2f} ms, {old / new:6.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+比较新节点到达链顶状态的两种方式: 加载 UTXO 快照, 以及逐个区块 add_block 重放整条链.
+
+    python -m benchmarks.snapshot [--height 1000] [--wallets 20]
+
+在临时目录中运行, 源节点和新节点分别使用一个数据库文件.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+
+
+def switch_db(path: Path) -> None:
+    """数据库连接是在第一次访问时打开的, 换掉路径就切换到另一个数据库."""
+    from bitcoin_in_python.storage import chain_db, db
+
+    if db._connection is not None:
+        db._connection.close()
+    db._connection = None
+    db.path = path
+    chain_db.clear_cache()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--height", type=int, default=1000)
+    parser.add_argument("--wallets", type=int, default=20)
+    parser.add_argument("--transfers", type=int, default=5, help="Transfers per block.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        from benchmarks.generate import grow_chain, make_wallets
+        from bitcoin_in_python.block import BlockChain
+        from bitcoin_in_python.snapshot import dump_utxo, load_utxo
+        from bitcoin_in_python.storage import utxo_db
+
+        chain = BlockChain()
+        wallets = make_wallets(args.wallets)
+        blocks, txs, replay = grow_chain(chain, wallets, args.height, args.transfers)
+        snapshot = Path(workdir) / "utxo.snapshot"
+
+        start = time.perf_counter()
+        count = dump_utxo(snapshot)
+        dump = time.perf_counter() - start
+
+        switch_db(Path(workdir) / "node.sqlite3")
+        start = time.perf_counter()
+        load_utxo(snapshot)
+        load = time.perf_counter() - start
+        assert len(utxo_db) == count
+        size = snapshot.stat().st_size
+
+    print(
+        f"height {args.height}, {txs} transactions, {count} unspent outputs, "
+        f"snapshot {size} bytes"
+    )
+    print(f"replay with add_block: {replay:7.3f}s")
+    print(f"dumputxo:              {dump:7.3f}s")
+    print(f"loadutxo:              {load:7.3f}s ({replay / load:.0f}x faster than replay)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+测量每个子命令从启动到退出的时间, 并与预算比较. 超出预算时以非零状态退出.
+
+    python -m benchmarks.startup [--repeat 5] [--output startup.json]
+
+在临时目录中创建钱包和区块链, 并在 4000 端口启动一个节点, 用来测量需要连接节点的命令.
+预算是整个进程的耗时 (包括解释器自身的启动), 单位为毫秒, 结果中同时给出空解释器的耗时作为参照.
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+PORT = 4000
+
+# 子命令 -> 预算 (毫秒)
+BUDGETS = {
+    "--help": 150,
+    "createwallet": 350,
+    "listwallets": 300,
+    "createchain": 600,
+    "getbalance": 450,
+    "printchain": 500,
+    "mempool": 200,
+    "stats": 200,
+}
+
+COMMANDS = {
+    "createwallet": ["createwallet", "--name", "{i}"],
+    "listwallets": ["listwallets"],
+    "getbalance": ["getbalance", "--wallet", "miner"],
+    "printchain": ["printchain"],
+    "mempool": ["mempool"],
+    "stats": ["stats"],
+}
+
+
+def run(args: list[str], cwd: str) -> float:
+    env = dict(os.environ, PYTHONPATH=str(ROOT))
+    start = time.perf_counter()
+    subprocess.run(args, cwd=cwd, env=env, check=True, stdout=subprocess.DEVNULL)
+    return (time.perf_counter() - start) * 1000
+
+
+def cli(*args: str) -> list[str]:
+    return [sys.executable, "-m", "bitcoin_in_python", *args]
+
+
+def wait_for_port(port: int, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("localhost", port)).close()
+            return
+        except ConnectionRefusedError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Node did not start listening on port {port}")
+
+
+def measure(repeat: int) -> dict:
+    times: dict[str, list[float]] = {name: [] for name in ["python", *BUDGETS]}
+    with tempfile.TemporaryDirectory() as workdir:
+        for i in range(repeat):
+            times["python"].append(run([sys.executable, "-c", "pass"], workdir))
+            times["--help"].append(run(cli("--help"), workdir))
+        run(cli("createwallet", "--name", "miner"), workdir)
+        times["createchain"].append(run(cli("createchain", "--wallet", "miner"), workdir))
+
+        node = subprocess.Popen(
+            cli("startserver", "--wallet", "miner", "--workers", "1"),
+            cwd=workdir,
+            env=dict(os.environ, PYTHONPATH=str(ROOT)),
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            wait_for_port(PORT)
+            for i in range(repeat):
+                for name, args in COMMANDS.items():
+                    args = [arg.format(i=f"w{i}") for arg in args]
+                    times[name].append(run(cli(*args), workdir))
+        finally:
+            node.terminate()
+            node.wait()
+
+    return {name: statistics.median(values) for name, values in times.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write JSON to this file instead of stdout.")
+    args = parser.parse_args()
+
+    medians = measure(args.repeat)
+    report = {
+        "python_ms": medians.pop("python"),
+        "commands": {
+            name: {"ms": ms, "budget_ms": BUDGETS[name], "ok": ms <= BUDGETS[name]}
+            for name, ms in medians.items()
+        },
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    else:
+        print(text)
+    over = [name for name, result in report["commands"].items() if not result["ok"]]
+    if over:
+        print(f"Over budget: {', '.join(over)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
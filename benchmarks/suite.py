@@ -0,0 +1,143 @@
+"""
+共识和存储热点路径的基准测试. 每一项返回一个 dict, 由 benchmarks.__main__ 汇总为 JSON.
+
+会读写当前目录下的 db.sqlite3, 所以要在空目录中运行, benchmarks.__main__ 会切换到临时目录.
+"""
+
+import random
+import time
+
+from benchmarks.frames import bench_frames
+from benchmarks.generate import grow_chain, make_transfers, make_wallets
+from bitcoin_in_python.block import BlockChain
+from bitcoin_in_python.miner import mine
+from bitcoin_in_python.storage import chain_db
+from bitcoin_in_python.transaction import Transaction, TXInput, TXOutput
+from bitcoin_in_python.wallet import Wallet
+
+
+def best_of(func, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_pow(target_bits: int, rounds: int) -> dict:
+    """固定难度下单进程挖矿的哈希率."""
+    hashes = 0
+    start = time.perf_counter()
+    for i in range(rounds):
+        result = mine(f"benchmark{i}", target_bits)
+        assert result is not None  # 没有传入 stop, 不会被中止
+        hashes += result.hashes
+    elapsed = time.perf_counter() - start
+    return {
+        "target_bits": target_bits,
+        "blocks": rounds,
+        "hashes": hashes,
+        "seconds": elapsed,
+        "hashes_per_s": hashes / elapsed,
+    }
+
+
+def bench_signatures(n_inputs: int, repeat: int) -> dict:
+    """签名和验证一笔有 n_inputs 个输入的交易, 折算为每个输入的耗时."""
+    wallet = Wallet.new_wallet()
+    pubkey = wallet.export_public_key()
+    inputs = [TXInput(f"{i:064x}", 0, b"", pubkey) for i in range(n_inputs)]
+    tx = Transaction("", inputs, [TXOutput(1, wallet.get_address())])
+    tx.sign(wallet)
+    tx.hash()
+    assert tx.verify()
+    sign = best_of(lambda: tx.sign(wallet), repeat)
+    verify = best_of(tx.verify, repeat)
+    return {
+        "inputs": n_inputs,
+        "sign_us_per_input": sign / n_inputs * 1e6,
+        "verify_us_per_input": verify / n_inputs * 1e6,
+    }
+
+
+def iterate_cold(chain: BlockChain) -> int:
+    """清空区块缓存后遍历整条链."""
+    chain_db.clear_cache()
+    return sum(1 for _ in iter(chain))
+
+
+def reindex_and_disconnect(chain: BlockChain) -> dict:
+    """重建整个 UTXO 集合, 然后撤销链顶的区块再加回去."""
+    start = time.perf_counter()
+    chain.reindex()
+    reindex = time.perf_counter() - start
+    start = time.perf_counter()
+    block = chain.disconnect_tip()
+    disconnect = time.perf_counter() - start
+    chain.add_block(block)
+    return {
+        "reindex_blocks_per_s": len(chain) / reindex,
+        "disconnect_tip_ms": disconnect * 1000,
+    }
+
+
+def bench_chain(chain: BlockChain, wallets: list[Wallet], height: int, repeat: int) -> dict:
+    """把链增长到 height, 测量 add_block 的吞吐量以及该高度下的各种查询."""
+    blocks, txs, elapsed = grow_chain(chain, wallets, height)
+    addresses = [wallet.get_address() for wallet in wallets]
+    lookups = best_of(lambda: [chain.get_balance(address) for address in addresses], repeat)
+    return {
+        "height": len(chain),
+        "added_blocks": blocks,
+        "add_block_per_s": blocks / elapsed if elapsed else None,
+        "add_block_txs_per_s": txs / elapsed if elapsed else None,
+        "len_us": best_of(lambda: len(chain), repeat) * 1e6,
+        "top_10_blocks_ms": best_of(lambda: chain.top_n_blocks(min(10, len(chain))), repeat)
+        * 1000,
+        "iterate_chain_ms": best_of(lambda: sum(1 for _ in iter(chain)), repeat) * 1000,
+        "iterate_chain_cold_ms": best_of(lambda: iterate_cold(chain), repeat) * 1000,
+        "balance_lookup_us": lookups / len(addresses) * 1e6,
+        **reindex_and_disconnect(chain),
+    }
+
+
+def bench_apply_transactions(chain: BlockChain, wallets: list[Wallet], n: int) -> dict:
+    """逐笔调用 update_unspent_txs_set, 和客户端提交交易时一样每笔单独提交."""
+    elapsed = 0.0
+    applied = 0
+    while applied < n:
+        txs = make_transfers(chain, wallets, len(wallets))
+        if not txs:
+            break
+        for tx in txs[: n - applied]:
+            start = time.perf_counter()
+            chain.update_unspent_txs_set(tx)
+            elapsed += time.perf_counter() - start
+            applied += 1
+    return {"transactions": applied, "txs_per_s": applied / elapsed if elapsed else None}
+
+
+def run(
+    heights: list[int],
+    n_wallets: int = 20,
+    target_bits: int = 16,
+    pow_rounds: int = 20,
+    inputs: tuple[int, ...] = (1, 10, 100),
+    apply_txs: int = 200,
+    frame_bytes: int = 4 * 1024 * 1024,
+    frames: int = 10,
+    repeat: int = 5,
+    seed: int = 0,
+) -> dict:
+    random.seed(seed)
+    wallets = make_wallets(n_wallets)
+    chain = BlockChain()
+    return {
+        "proof_of_work": bench_pow(target_bits, pow_rounds),
+        "signatures": [bench_signatures(n, repeat) for n in inputs],
+        "chain": [bench_chain(chain, wallets, height, repeat) for height in sorted(heights)],
+        # 最后运行, 它会在链外修改 UTXO 集合
+        "update_unspent_txs_set": bench_apply_transactions(chain, wallets, apply_txs),
+        "frames": bench_frames(frame_bytes, frames),
+    }
@@ -0,0 +1,93 @@
+"""
+比较逐批 下载 -> 检查 -> 写入 的同步方式和 sync_chain 的流水线.
+
+    python -m benchmarks.sync [--height 300] [--transfers 10] [--latency-ms 5] [--workers N]
+
+在临时目录中生成一条带签名交易的链, 然后用内存中的 request 函数同步到另一个数据库,
+每次请求等待 latency 毫秒来模拟网络.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--height", type=int, default=300)
+    parser.add_argument("--wallets", type=int, default=20)
+    parser.add_argument("--transfers", type=int, default=10, help="Transfers per block.")
+    parser.add_argument("--latency-ms", type=float, default=5)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        from benchmarks.generate import grow_chain, make_wallets
+        from benchmarks.snapshot import switch_db
+        from bitcoin_in_python import sync
+        from bitcoin_in_python.block import MIN_TARGET_BITS, BlockChain
+        from bitcoin_in_python.serialization import (
+            decode_blocks,
+            encode_blocks,
+            encode_headers,
+        )
+
+        chain = BlockChain()
+        wallets = make_wallets(args.wallets)
+        # 同步时会检查工作量证明, 所以要按最低难度挖矿
+        _, txs, _ = grow_chain(chain, wallets, args.height, args.transfers, MIN_TARGET_BITS)
+        blocks = chain.blocks_at(range(len(chain)))
+
+        def request(command: str, data: bytes) -> tuple[str, bytes]:
+            time.sleep(args.latency_ms / 1000)
+            start, count = sync.decode_range(data)
+            if command == 'getheaders':
+                return 'headers', encode_headers([b.header() for b in blocks[start:][:count]])
+            return 'blocks', encode_blocks(blocks[start:][:count])
+
+        def sequential(chain: BlockChain) -> None:
+            """没有流水线时的做法: 每批区块下载, 检查, 写入依次进行."""
+            height = 0
+            while height < len(blocks):
+                headers = sync.decode_headers(
+                    request('getheaders', sync.encode_range(height, sync.HEADERS_PER_REQUEST))[
+                        1
+                    ]
+                )
+                for i in range(0, len(headers), sync.BLOCKS_PER_REQUEST):
+                    batch = headers[i : i + sync.BLOCKS_PER_REQUEST]
+                    _, data = request(
+                        'getblocks', sync.encode_range(batch[0].height, len(batch))
+                    )
+                    received = decode_blocks(data)
+                    sync.check_blocks(received, batch, args.workers)
+                    with sync.db.transaction():
+                        for block in received:
+                            chain.add_block(block)
+                height += len(headers)
+
+        results = {}
+        for name, run in [
+            ("sequential", sequential),
+            ("pipelined", lambda chain: sync.sync_chain(request, chain, args.workers)),
+        ]:
+            switch_db(Path(workdir) / f"{name}.sqlite3")
+            chain = BlockChain()
+            start = time.perf_counter()
+            run(chain)
+            results[name] = time.perf_counter() - start
+            assert len(chain) == len(blocks)
+
+    print(
+        f"{len(blocks)} blocks, {txs} transactions, {args.workers} worker(s), "
+        f"{args.latency_ms} ms per request"
+    )
+    for name, seconds in results.items():
+        print(f"{name:>10}: {seconds:7.2f}s, {len(blocks) / seconds:7.1f} blocks/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,20 @@
+"""
+命令行入口.
+
+各个子命令需要的模块 (pycryptodome, asyncio, 数据库等) 在子命令中才导入,
+--help 和不需要区块链的命令不必为它们付出启动时间. 各命令的启动时间见 benchmarks/startup.py.
+"""
+
 import argparse
-import pickle
-from dataclasses import dataclass
-from pprint import pp
+import json
+import os
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Optional
 
-from bitcoin_in_python.block import BlockChain, blockchain
 from bitcoin_in_python.exception import BitcoinException
-from bitcoin_in_python.server import (
-    Version,
-    create_client_socket,
-    create_server,
-    recv_data,
-    send_data,
-)
-from bitcoin_in_python.storage import unspent_txs_db
-from bitcoin_in_python.transaction import Transaction
-from bitcoin_in_python.wallet import Wallet
+
+if TYPE_CHECKING:
+    from bitcoin_in_python.peers import PeerManager
 
 
 def main():
@@ -29,17 +29,39 @@ def main():
 @dataclass
 class Cli:
     port: int = 4000
+    # 与各个节点的连接, 在一次运行中的多条命令之间复用
+    peers: Optional["PeerManager"] = field(default=None, init=False, repr=False)
+    peer_addresses: list[str] = field(default_factory=list, init=False, repr=False)
 
     def run(self):
         parser = argparse.ArgumentParser(
             description="Manage a simple blockchain.", prog="bitcoin_in_python"
         )
+        parser.add_argument(
+            "--peer",
+            action="append",
+            dest="peers",
+            metavar="HOST:PORT",
+            help="A node to talk to. Can be given several times to download blocks "
+            "from all of them in parallel. Defaults to localhost:4000.",
+        )
         subparsers = parser.add_subparsers()
 
         parser_send = subparsers.add_parser("send", help="Send bitcoin to someone.")
         parser_send.add_argument("--wallet", required=True)
         parser_send.add_argument("--to", required=True, help="Address of the recipient.")
         parser_send.add_argument("--amount", required=True, type=float)
+        parser_send.add_argument(
+            "--coin-selection",
+            default="default",
+            choices=["default", "bnb", "largest-first", "first-fit"],
+            help="How to choose the outputs to spend.",
+        )
+        parser_send.add_argument(
+            "--wait",
+            action="store_true",
+            help="Wait until the transaction is included in a block.",
+        )
         parser_send.set_defaults(func=self.send)
 
         parser_createchain = subparsers.add_parser(
@@ -67,94 +89,345 @@ class Cli:
         parser_createwallet.add_argument("--name", required=True)
         parser_createwallet.set_defaults(func=self.create_wallet)
 
+        parser_listwallets = subparsers.add_parser(
+            "listwallets", help="List the wallets in the wallet file and their addresses."
+        )
+        parser_listwallets.set_defaults(func=self.list_wallets)
+
         parser_startserver = subparsers.add_parser(
             "startserver", help="Start a server as a mining node."
         )
         parser_startserver.add_argument(
             "--wallet", help="The account who receives the mining rewards.", required=True
         )
+        parser_startserver.add_argument(
+            "--port", type=int, default=self.port, help="Port to listen on."
+        )
+        parser_startserver.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Number of processes used for mining. Defaults to the number of CPUs.",
+        )
+        parser_startserver.add_argument(
+            "--min-block-txs",
+            type=int,
+            default=2,
+            help="Start mining once the mempool holds this many transactions.",
+        )
+        parser_startserver.add_argument(
+            "--max-block-txs", type=int, default=1000, help="Transactions per block."
+        )
+        parser_startserver.add_argument(
+            "--max-block-bytes", type=int, default=1024 * 1024, help="Bytes per block."
+        )
+        parser_startserver.add_argument(
+            "--mempool-txs",
+            type=int,
+            help="Transactions kept in the mempool before the oldest are evicted.",
+        )
+        parser_startserver.add_argument(
+            "--metrics",
+            action=argparse.BooleanOptionalAction,
+            default=False,
+            help="Collect metrics for the stats command (off by default).",
+        )
         parser_startserver.set_defaults(func=self.start_server)
 
+        parser_verifytx = subparsers.add_parser(
+            "verifytx",
+            help="Check that a transaction is in the chain using a merkle proof, "
+            "without downloading blocks.",
+        )
+        parser_verifytx.add_argument("--txid", required=True)
+        parser_verifytx.set_defaults(func=self.verify_tx)
+
+        parser_mempool = subparsers.add_parser(
+            "mempool", help="Show pending transactions of the mining node."
+        )
+        parser_mempool.set_defaults(func=self.show_mempool)
+
+        parser_stats = subparsers.add_parser(
+            "stats", help="Show metrics collected by the mining node."
+        )
+        parser_stats.add_argument("--json", action="store_true", help="Print raw JSON.")
+        parser_stats.set_defaults(func=self.show_stats)
+
+        parser_reindex = subparsers.add_parser(
+            "reindex",
+            help="Rebuild the unspent outputs set and indexes from the stored blocks.",
+        )
+        parser_reindex.add_argument(
+            "--batch", type=int, default=500, help="Blocks committed per transaction."
+        )
+        parser_reindex.set_defaults(func=self.reindex)
+
+        parser_disconnect = subparsers.add_parser(
+            "disconnect", help="Remove blocks from the top of the local chain."
+        )
+        parser_disconnect.add_argument("--blocks", type=int, default=1)
+        parser_disconnect.set_defaults(func=self.disconnect)
+
+        parser_importblocks = subparsers.add_parser(
+            "importblocks",
+            help="Copy blocks stored in the database by older versions into the block files.",
+        )
+        parser_importblocks.set_defaults(func=self.import_blocks)
+
+        parser_dumputxo = subparsers.add_parser(
+            "dumputxo", help="Write the unspent outputs set and chain tip to a snapshot file."
+        )
+        parser_dumputxo.add_argument("--file", required=True)
+        parser_dumputxo.set_defaults(func=self.dump_utxo)
+
+        parser_loadutxo = subparsers.add_parser(
+            "loadutxo",
+            help="Start a new node from a snapshot file, "
+            "then only the blocks after it need to be synced.",
+        )
+        parser_loadutxo.add_argument("--file", required=True)
+        parser_loadutxo.set_defaults(func=self.load_utxo)
+
         args = parser.parse_args()
-        if vars(args):
-            args.func(args)
+        if hasattr(args, "func"):
+            self.peer_addresses = args.peers or [f"localhost:{self.port}"]
+            try:
+                args.func(args)
+            finally:
+                if self.peers is not None:
+                    self.peers.close()
         else:
             parser.print_help()
 
+    def _peers(self) -> "PeerManager":
+        from bitcoin_in_python.peers import PeerManager
+
+        if self.peers is None:
+            self.peers = PeerManager(self.peer_addresses)
+        return self.peers
+
+    def _request(self, command: str, data: bytes) -> tuple[str, bytes]:
+        return self._peers().request(command, data)
+
     def _pull_chain(self):
-        with create_client_socket(self.port) as s:
-            version = Version(len(blockchain), "")
-            print(f"Checking chain state from the mining node..")
-            send_data('pull chain', pickle.dumps(version), s)
-            _, data = recv_data(s)
-            if data:
-                data = pickle.loads(data)
-                for block in data:
-                    # print(block)
-                    blockchain.add_block(block)
-                print(f"Receiving {len(data)} block(s)")
-            print("Chain state updated.")
+        from bitcoin_in_python.block import blockchain
+        from bitcoin_in_python.sync import sync_chain
+
+        print(f"Checking chain state from the mining node..")
+        peers = self._peers()
+        download = peers.download_blocks if len(peers.peers) > 1 else None
+        received = sync_chain(self._request, blockchain, download=download)
+        if received:
+            print(f"Receiving {received} block(s)")
+        print("Chain state updated.")
 
     def send(self, args):
+        from bitcoin_in_python.block import blockchain
+        from bitcoin_in_python.serialization import decode_proof, encode_transactions
+        from bitcoin_in_python.transaction import Transaction
+        from bitcoin_in_python.wallet import Wallet
+
         self._pull_chain()
 
         wallet = Wallet.read_wallet(args.wallet)
-        to_wallet = Wallet.read_wallet(args.to)
         tx = Transaction.new_transaction(
-            wallet, to_wallet.get_address(), args.amount, blockchain
+            wallet, self._address(args.to), args.amount, blockchain, args.coin_selection
         )
+
+        command, data = self._request('send', encode_transactions([tx]))
+        if command == 'error':
+            raise BitcoinException(f"Transaction rejected: {data.decode()}")
+        print(f"Transaction id: {tx.id}")
+        # 节点已经接受了交易, 先在本地记下, 之后的交易可以花费它的找零
         blockchain.update_unspent_txs_set(tx)
+        if not args.wait:
+            print("Transaction submitted. The mining node will include it in a later block.")
+            return
 
-        with create_client_socket(self.port) as s:
-            send_data('send', pickle.dumps([tx]), s)
-            command, data = recv_data(s)
-            if command == 'empty':
-                print(
-                    "Transaction submitted. "
-                    "Waiting for the miner to process our transaction.."
-                )
-            else:
-                block = pickle.loads(data)
-                blockchain.add_block(block)
-                print(f"Transaction done. " f"It is included in block {block}")
+        print("Waiting for the transaction to be included in a block..")
+        command, data = self._request('waittx', tx.id.encode())
+        while command == 'pending':
+            command, data = self._request('waittx', tx.id.encode())
+        if command == 'error':
+            raise BitcoinException(data.decode())
+        header, _ = decode_proof(data)
+        self._pull_chain()
+        print(
+            f"Transaction done. It is included in block {header.hash} at height {header.height}"
+        )
 
     def print_chain(self, args):
+        from pprint import pp
+
+        from bitcoin_in_python.block import BlockChain
+        from bitcoin_in_python.storage import utxo_db
+        from bitcoin_in_python.wallet import Wallets
+
         self._pull_chain()
 
         for block in BlockChain():
             pp(block)
 
-        print("Unspent transactions set:")
-        for tx in unspent_txs_db.values():
-            pp(tx)
+        wallets = Wallets.load()
+        print("Unspent outputs set:")
+        for key, output in utxo_db.items():
+            owner = wallets.find_by_address(output.pubkey_hash)
+            print(f"{key}: {output}" + (f" ({owner})" if owner else ""))
 
     def get_balance(self, args):
-        self._pull_chain()
+        from bitcoin_in_python.block import blockchain
 
-        wallet = Wallet.read_wallet(args.wallet)
-        balance = 0
-        for tx in unspent_txs_db.values():
-            for output in tx.vout:
-                if not output.is_spent and output.can_be_unlocked_with(wallet.get_address()):
-                    balance += output.value
+        self._pull_chain()
 
+        balance = blockchain.get_balance(self._address(args.wallet))
         print(f"Balance of {args.wallet}: {balance:.2f}")
 
+    def _address(self, name: str) -> str:
+        """钱包文件中保存了地址, 不需要解析私钥."""
+        from bitcoin_in_python.wallet import Wallet, Wallets
+
+        wallets = Wallets.load()
+        if name in wallets:
+            return wallets.address_of(name)
+        return Wallet.read_wallet(name).get_address()
+
     def create_wallet(self, args):
-        wallet = Wallet.new_wallet()
-        wallet.save_wallet(args.name)
+        from bitcoin_in_python.wallet import Wallets
+
+        wallets = Wallets.load()
+        wallet = wallets.create(args.name)
+        wallets.save()
         print(
             f"Your new address is {wallet.get_address()}, "
-            f"private key saved to {args.name}.txt"
+            f"private key saved to {wallets.path.name}"
         )
 
+    def list_wallets(self, args):
+        from bitcoin_in_python.wallet import Wallets
+
+        wallets = Wallets.load()
+        for name in wallets.names():
+            print(f"{name}: {wallets.address_of(name)}")
+
     def create_chain(self, args):
-        wallet = Wallet.read_wallet(args.wallet)
-        BlockChain.new_block_chain(wallet.get_address())
+        from bitcoin_in_python.block import BlockChain
+
+        BlockChain.new_block_chain(self._address(args.wallet))
+
+    def verify_tx(self, args):
+        from bitcoin_in_python.block import MIN_TARGET_BITS
+        from bitcoin_in_python.serialization import decode_proof
+        from bitcoin_in_python.storage import height_db
+
+        command, data = self._request('getproof', args.txid.encode())
+        if command == 'error':
+            raise BitcoinException(data.decode())
+        header, proof = decode_proof(data)
+        if header.target_bits < MIN_TARGET_BITS or not header.validate():
+            raise BitcoinException(f"Invalid proof of work in block {header.hash}")
+        if proof.txid != args.txid or not proof.verify(header.tx_hash):
+            raise BitcoinException(f"Invalid merkle proof for transaction {args.txid}")
+        local_hash = height_db.get(str(header.height))
+        if local_hash is not None and local_hash != header.hash:
+            raise BitcoinException(
+                f"Block {header.hash} is not in our chain at height {header.height}"
+            )
+        print(
+            f"Transaction {args.txid} is included in block {header.hash} "
+            f"at height {header.height} (proof: {len(data)} bytes)"
+        )
+
+    def show_mempool(self, args):
+        _, data = self._request('mempool', b'')
+        stats = json.loads(data)
+        print(f"Pending transactions: {stats['count']}")
+        print(f"Total size: {stats['bytes']} bytes")
+        print(f"Oldest entry: {stats['oldest_age']:.1f} seconds ago")
+
+    def show_stats(self, args):
+        _, data = self._request('stats', b'')
+        stats = json.loads(data)
+        if args.json:
+            print(json.dumps(stats, indent=2))
+            return
+        if not stats["enabled"]:
+            print("Metrics are disabled on this node.")
+            return
+        for name, value in {**stats["counters"], **stats["gauges"]}.items():
+            print(f"{name}: {value:g}")
+        for name, h in stats["histograms"].items():
+            print(
+                f"{name}: count={h['count']} mean={h['mean'] * 1000:.3f}ms "
+                f"p50={h['p50'] * 1000:.3f}ms p99={h['p99'] * 1000:.3f}ms "
+                f"max={h['max'] * 1000:.3f}ms"
+            )
+
+    def reindex(self, args):
+        import time
+
+        from bitcoin_in_python.block import blockchain
+
+        start = time.perf_counter()
+
+        def progress(done: int, total: int):
+            print(f"Reindexed {done}/{total} blocks ({time.perf_counter() - start:.1f}s)")
+
+        blockchain.reindex(args.batch, progress)
+        print("Reindex done.")
+
+    def disconnect(self, args):
+        from bitcoin_in_python.block import blockchain
+
+        for _ in range(args.blocks):
+            block = blockchain.disconnect_tip()
+            print(f"Disconnected block {block.hash} at height {block.height}")
+
+    def import_blocks(self, args):
+        from bitcoin_in_python.storage import import_sqlite_blocks
+
+        print(f"Imported {import_sqlite_blocks()} block(s).")
+
+    def dump_utxo(self, args):
+        import time
+        from pathlib import Path
+
+        from bitcoin_in_python.snapshot import dump_utxo
+
+        start = time.perf_counter()
+        count = dump_utxo(Path(args.file))
+        print(
+            f"Wrote {count} unspent outputs to {args.file} in {time.perf_counter() - start:.2f}s"
+        )
+
+    def load_utxo(self, args):
+        import time
+        from pathlib import Path
+
+        from bitcoin_in_python.snapshot import load_utxo
+
+        start = time.perf_counter()
+        tip_hash, tip_height, count = load_utxo(Path(args.file))
+        print(
+            f"Loaded {count} unspent outputs in {time.perf_counter() - start:.2f}s, "
+            f"chain tip is {tip_hash} at height {tip_height}"
+        )
 
     def start_server(self, args):
+        from bitcoin_in_python import metrics
+        from bitcoin_in_python.mempool import Mempool
+        from bitcoin_in_python.server import create_server
+        from bitcoin_in_python.wallet import Wallet
+
+        metrics.enable(args.metrics)
         wallet = Wallet.read_wallet(args.wallet)
-        create_server(self.port, wallet)
+        options = dict(
+            min_block_txs=args.min_block_txs,
+            max_block_txs=args.max_block_txs,
+            max_block_bytes=args.max_block_bytes,
+        )
+        if args.mempool_txs:
+            options["mempool"] = Mempool(max_count=args.mempool_txs)
+        create_server(args.port, wallet, args.workers, **options)
 
 
 if __name__ == "__main__":
@@ -1,14 +1,67 @@
 import hashlib
-import time
 from dataclasses import asdict, dataclass
 from datetime import datetime
 from pprint import pprint
+from typing import Callable, Iterable, Optional
 
+from bitcoin_in_python import metrics
+from bitcoin_in_python.coinselect import select_coins, units
 from bitcoin_in_python.exception import BitcoinException
-from bitcoin_in_python.storage import chain_db, misc_db, unspent_txs_db
-from bitcoin_in_python.transaction import Transaction, TXOutput
+from bitcoin_in_python.merkle import MerkleProof, MerkleTree
+from bitcoin_in_python.miner import mine, target_bytes
+from bitcoin_in_python.sigverify import verify_transactions
+from bitcoin_in_python.storage import (
+    address_index_db,
+    chain_db,
+    db,
+    height_db,
+    local_spent_db,
+    misc_db,
+    tx_index_db,
+    undo_db,
+    utxo_db,
+)
+from bitcoin_in_python.transaction import SUBSIDY, Transaction, TXOutput
+
+MIN_TARGET_BITS = 8 * 2  # 从其他节点收到的区块至少要满足这个难度
+READ_AHEAD = 64  # 遍历链时每次读取的区块数
+REINDEX_BATCH = 500  # 重建 UTXO 集合时每个事务处理的区块数
+
+_mined_blocks = metrics.counter("mining.blocks")
+_hashes = metrics.counter("mining.hashes")
+_mining_seconds = metrics.histogram("mining.block_seconds")
+_hashrate = metrics.gauge("mining.hashrate")
+_add_block_seconds = metrics.histogram("chain.add_block_seconds")
+_height = metrics.gauge("chain.height")
 
-MAX_NONCE = 1 << 64  # 防止 nonce 溢出
+
+@dataclass
+class BlockHeader:
+    """
+    区块头, 包含计算区块哈希所需的全部字段, 不需要交易本身就可以验证工作量证明.
+    """
+
+    timestamp: int
+    prev_block_hash: str
+    tx_hash: str  # Block.hash_transactions() 的结果
+    nonce: int
+    hash: str
+    target_bits: int
+    height: int
+
+    def prepare_data(self) -> str:
+        return (
+            self.prev_block_hash
+            + self.tx_hash
+            + str(self.timestamp)
+            + str(self.target_bits)
+            + str(self.nonce)
+        )
+
+    def validate(self) -> bool:
+        """哈希与区块头内容一致, 并且满足难度要求."""
+        h = hashlib.sha256(self.prepare_data().encode())
+        return h.hexdigest() == self.hash and h.digest() < target_bytes(self.target_bits)
 
 
 @dataclass
@@ -18,46 +71,52 @@ class Block:
     prev_block_hash: str
     nonce: int = 0
     hash: str = ""
-    target_bits: int = 8 * 2  # hash 的前缀 0 个数, 即挖矿难度, 需要为 8 的倍数
+    target_bits: int = MIN_TARGET_BITS  # hash 的前缀 0 个数, 即挖矿难度, 需要为 8 的倍数
+    height: int = 0  # 创世区块的高度为 0, 不参与哈希计算
 
-    def prepare_data(self, nonce) -> str:
+    def prepare_prefix(self) -> str:
+        """区块头中除 nonce 以外的部分, 挖矿过程中保持不变."""
         return (
             self.prev_block_hash
             + self.hash_transactions()
             + str(self.timestamp)
             + str(self.target_bits)
-            + str(nonce)
         )
 
-    def proof_of_work(self) -> tuple[int, str]:
-        target = 1 << (256 - self.target_bits)
+    def prepare_data(self, nonce) -> str:
+        return self.prepare_prefix() + str(nonce)
 
+    def proof_of_work(self, workers: int = 1, stop=None) -> Optional[tuple[int, str]]:
+        """stop 为一个 Event, 被 set 后挖矿中止并返回 None."""
         pprint(f"Mining block containing transactions: {self.transactions}")
-        start = time.time()
-        for nonce in range(MAX_NONCE):
-            data = self.prepare_data(nonce).encode()
-            h = hashlib.sha256(data)
-            hash_int = int.from_bytes(h.digest(), byteorder="big")
-            if hash_int < target:
-                print(
-                    f"Mining done, result hash is {h.hexdigest()}\n"
-                    f"Time cost: {time.time() - start:.2f}s\n"
-                )
-                return nonce, h.hexdigest()
-            else:
-                continue
-
-        raise BitcoinException("Reached MAX_NONCE, mining aborted.")
+        result = mine(self.prepare_prefix(), self.target_bits, workers, stop)
+        if result is None:
+            print("Mining cancelled")
+            return None
+        _mined_blocks.inc()
+        _hashes.inc(result.hashes)
+        _mining_seconds.observe(result.elapsed)
+        _hashrate.set(result.hashrate)
+        print(
+            f"Mining done, result hash is {result.hash}\n"
+            f"Time cost: {result.elapsed:.2f}s, "
+            f"hashrate: {result.hashrate / 1000:.1f} kH/s ({workers} worker(s))\n"
+        )
+        return result.nonce, result.hash
 
     def validate(self) -> bool:
-        data = self.prepare_data(self.nonce).encode()
-        h = hashlib.sha256(data).digest()
-        assert self.target_bits % 8 == 0
-        target_bytes = self.target_bits // 8
-        if h[:target_bytes] == b"\x00" * target_bytes:
-            return True
-        else:
-            return False
+        return self.header().validate()
+
+    def header(self) -> BlockHeader:
+        return BlockHeader(
+            self.timestamp,
+            self.prev_block_hash,
+            self.hash_transactions(),
+            self.nonce,
+            self.hash,
+            self.target_bits,
+            self.height,
+        )
 
     def to_dict(self):
         block_dict = asdict(self)
@@ -68,11 +127,17 @@ class Block:
     def insert_to_db(self):
         chain_db[self.hash] = self
 
+    def merkle_tree(self) -> MerkleTree:
+        """交易的 Merkle 树, 交易列表不变时复用已经算好的各层."""
+        txids = [tx.id for tx in self.transactions]
+        cached = getattr(self, "_merkle_tree", None)
+        if cached is None or cached[0] != txids:
+            cached = (txids, MerkleTree.from_txids(txids))
+            self._merkle_tree = cached
+        return cached[1]
+
     def hash_transactions(self):
-        tx_hashes = ""
-        for tx in self.transactions:
-            tx_hashes += tx.id
-        return hashlib.sha256(tx_hashes.encode()).hexdigest()
+        return self.merkle_tree().root
 
     @classmethod
     def from_dict(cls, d: dict):
@@ -82,19 +147,20 @@ class Block:
         return cls(**d, transactions=txs)
 
     @classmethod
-    def new_block(cls, transactions: list[Transaction], prev_block_hash: str):
+    def new_block(
+        cls, transactions: list[Transaction], prev_block_hash: str, workers: int = 1, stop=None
+    ):
+        """挖出一个新区块. 挖矿被 stop 中止时返回 None."""
         block = Block(int(datetime.now().timestamp()), transactions, prev_block_hash)
 
-        # 验证每个交易的签名
-        for tx in transactions:
-            # coinbase 交易不需要验证
-            if tx.is_coinbase():
-                continue
-
-            if not tx.verify():
-                raise BitcoinException("Signature verification failed.")
+        # 验证每个交易的签名, coinbase 交易不需要验证
+        if not verify_transactions(transactions, workers):
+            raise BitcoinException("Signature verification failed.")
 
-        block.nonce, block.hash = block.proof_of_work()
+        found = block.proof_of_work(workers, stop)
+        if found is None:
+            return None
+        block.nonce, block.hash = found
         return block
 
     def __repr__(self):
@@ -102,6 +168,7 @@ class Block:
         for tx in self.transactions:
             txs += f"{tx}\n"
         return (
+            f"height: {self.height}\n"
             f"prev hash: {self.prev_block_hash}\n"
             f"transactions:\n {txs}"
             f"hash: {self.hash}\n"
@@ -109,57 +176,161 @@ class Block:
         )
 
     @classmethod
-    def new_genesis_block(cls, coinbase: Transaction):
-        return cls.new_block([coinbase], "0" * 64)
+    def new_genesis_block(cls, coinbase: Transaction, workers: int = 1):
+        return cls.new_block([coinbase], "0" * 64, workers)
 
 
 @dataclass
 class BlockChain:
-    def create_block(self, txs: list[Transaction], address: str) -> Block:
+    def create_block(self, txs: list[Transaction], address: str, workers: int = 1) -> Block:
         coinbase_tx = Transaction.new_coinbase_transaction(address)
-        new_block = Block.new_block([coinbase_tx] + txs, misc_db['last_block_hash'])
-        new_block.insert_to_db()
-
-        # update unspent transactions set
-        for tx in new_block.transactions:
-            self.update_unspent_txs_set(tx)
-
-        misc_db['last_block_hash'] = new_block.hash
-
+        new_block = Block.new_block([coinbase_tx] + txs, misc_db['last_block_hash'], workers)
+        self.add_block(new_block)
         return new_block
 
     def add_block(self, block: Block):
-        block.insert_to_db()
+        """
+        区块, UTXO 和链顶的所有改动在同一个事务中提交, 中途失败则全部回滚.
+        同步多个区块时可以在外层再包一个 db.transaction(), 一次提交整批区块.
+        区块必须接在链顶之后, 其中的交易经过 _apply_transaction 的检查.
+        签名和工作量证明与链的状态无关, 由调用者事先检查 (见 sync.check_blocks).
+        """
+        start = metrics.now()
+        with db.transaction():
+            if block.hash in chain_db:
+                return  # 已经在链上了
+            tip = misc_db.get('last_block_hash', "0" * 64)
+            if block.prev_block_hash != tip:
+                raise BitcoinException(f"Block {block.hash} does not extend the tip {tip}")
+            block.height = len(self)
+            block.insert_to_db()
+            self._connect(block)
+            self._set_tip(block)
+        _add_block_seconds.observe_since(start)
+
+    def _connect(self, block: Block):
+        """把区块中的交易应用到 UTXO 集合, 同时写入交易索引和撤销记录."""
+        if not block.transactions or not block.transactions[0].is_coinbase():
+            raise BitcoinException(f"Block {block.hash} does not start with a coinbase")
+        undo = []
+        for position, tx in enumerate(block.transactions):
+            if position and tx.is_coinbase():
+                raise BitcoinException(f"Block {block.hash} has more than one coinbase")
+            if tx.id in local_spent_db:
+                # 客户端提交后已经在本地处理过, 花费的输出在当时记下了
+                spent = local_spent_db.pop(tx.id)
+            else:
+                spent = self._apply_transaction(tx)
+            undo.append(spent)
+            tx_index_db[tx.id] = (block.hash, position)
+        undo_db[block.hash] = undo
 
-        for tx in block.transactions:
-            self.update_unspent_txs_set(tx)
+    def disconnect_tip(self) -> Block:
+        """
+        撤销链顶的区块: 删除它的交易产生的输出, 按撤销记录恢复它花费的输出.
+        只需要读取这个区块和它的撤销记录, 与链的长度无关. 返回被撤销的区块.
+        """
+        with db.transaction():
+            height = len(self) - 1
+            if height <= 0:
+                raise BitcoinException("Cannot disconnect the genesis block")
+            if height < self.base_height():
+                raise BitcoinException("Cannot disconnect blocks below the UTXO snapshot")
+            block = self.block_at(height)
+            if block.hash not in undo_db:
+                raise BitcoinException(
+                    f"No undo record for block {block.hash}, run reindex first"
+                )
+            undo = undo_db.pop(block.hash)
+            # 倒序处理, 这样同一区块中被后面的交易花费的输出也能正确恢复
+            for tx, spent in zip(reversed(block.transactions), reversed(undo)):
+                for index in range(len(tx.vout)):
+                    key = outpoint(tx.id, index)
+                    if key in utxo_db:
+                        self._remove_utxo(key)
+                for key, output in spent:
+                    self._add_utxo(key, output)
+                del tx_index_db[tx.id]
+            del chain_db[block.hash]
+            del height_db[str(height)]
+            misc_db['tip_height'] = height - 1
+            misc_db['last_block_hash'] = block.prev_block_hash
+            _height.set(height - 1)
+        return block
 
+    def reindex(
+        self,
+        batch: int = REINDEX_BATCH,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> int:
+        """
+        从 chain_db 按高度顺序重放整条链, 重建 UTXO 集合, 地址索引, 交易索引和撤销记录.
+        区块按 batch 个一批读取, 每批在一个事务中提交, 之后调用 progress(已处理的区块数, 总数).
+        中途退出时索引是不完整的, 需要重新运行. 返回处理的区块数.
+        """
+        if self.base_height():
+            raise BitcoinException("Blocks below the UTXO snapshot are not stored locally")
+        length = len(self)
+        with db.transaction():
+            for table in (utxo_db, address_index_db, tx_index_db, undo_db, local_spent_db):
+                table.clear()
+        for start in range(0, length, batch):
+            heights = range(start, min(start + batch, length))
+            with db.transaction():
+                for block in self.blocks_at(heights):
+                    self._connect(block)
+            if progress:
+                progress(heights.stop, length)
+        return length
+
+    def _set_tip(self, block: Block):
+        height_db[str(block.height)] = block.hash
+        misc_db['tip_height'] = block.height
         misc_db['last_block_hash'] = block.hash
+        _height.set(block.height)
 
     def update_unspent_txs_set(self, tx: Transaction):
-        if tx.id in unspent_txs_db:
-            # 如果已经处理过这笔交易了就直接返回
-            return
-
-        unspent_txs_db[tx.id] = tx
+        """
+        节点接受了交易但还没有打包时, 先在本地处理, 之后的交易可以花费它的输出.
+        同时记下它花费的输出, 包含它的区块上链时不必再处理一次.
+        """
+        with db.transaction():
+            if tx.id not in local_spent_db:
+                local_spent_db[tx.id] = self._apply_transaction(tx)
 
-        # coinbase 交易不用检查 inputs
+    def _apply_transaction(self, tx: Transaction) -> list[tuple[str, TXOutput]]:
+        """
+        检查交易并应用到 UTXO 集合, 返回交易花费的输出. 检查失败时抛出 BitcoinException,
+        应当在事务中调用, 失败时已经做的改动随事务回滚.
+        花费的输出必须在 UTXO 集合中 (同一个区块中前面的交易产生的也可以), 由 input 的公钥解锁,
+        输出总额不超过花费的总额; coinbase 交易不超过区块奖励.
+        """
+        spent_outputs = []
         if tx.is_coinbase():
-            return
-
-        for input in tx.vin:
-            input_tx = unspent_txs_db[input.txid]
-            input_tx.vout[input.vout_index].is_spent = True
-            unspent_txs_db[input.txid] = input_tx  # update db
-
-            all_spent = 1
-            for output in input_tx.vout:
-                if not output.is_spent:
-                    all_spent = 0
-                    break
-
-            if all_spent:
-                unspent_txs_db.pop(input_tx.id)
+            tx.check_values(units(SUBSIDY))
+        else:
+            for vin in tx.vin:
+                key = outpoint(vin.txid, vin.vout_index)
+                if key not in utxo_db:
+                    raise BitcoinException(f"Transaction {tx.id} spends unknown output {key}")
+                spent_outputs.append((key, self._remove_utxo(key)))
+            tx.check_spends([output for _, output in spent_outputs])
+
+        for index, output in enumerate(tx.vout):
+            key = outpoint(tx.id, index)
+            if key in utxo_db:
+                raise BitcoinException(f"Transaction {tx.id} is already in the chain")
+            self._add_utxo(key, output)
+        return spent_outputs
+
+    def _add_utxo(self, key: str, output: TXOutput):
+        utxo_db[key] = output
+        address_index_db[address_key(output.pubkey_hash, key)] = None
+
+    def _remove_utxo(self, key: str) -> TXOutput:
+        output = utxo_db.pop(key)
+        del address_index_db[address_key(output.pubkey_hash, key)]
+        return output
 
     @classmethod
     def new_block_chain(cls, address: str):
@@ -169,76 +340,132 @@ class BlockChain:
         except KeyError:
             coinbase_transaction = Transaction.new_coinbase_transaction(address)
             genesis_block = Block.new_genesis_block(coinbase_transaction)
-            genesis_block.insert_to_db()
-            for tx in genesis_block.transactions:
-                unspent_txs_db[tx.id] = tx
-            last_block_hash = genesis_block.hash
-            misc_db['last_block_hash'] = last_block_hash
+            cls().add_block(genesis_block)
         return cls()
 
     def __iter__(self):
         """
-        从尾到头迭代一条链
+        从尾到头迭代一条链. 按高度索引每次批量读取 READ_AHEAD 个区块.
         """
-        current_block_hash = misc_db['last_block_hash']
-        try:
-            while block := chain_db[current_block_hash]:
-                current_block_hash = block.prev_block_hash
-                yield block
-        except KeyError:
+        if 'tip_height' not in misc_db:
+            yield from self._walk()
             return
+        base = self.base_height()
+        for top in range(misc_db['tip_height'], base - 1, -READ_AHEAD):
+            yield from reversed(
+                self.blocks_at(range(max(top - READ_AHEAD + 1, base), top + 1))
+            )
+
+    def _walk(self):
+        """
+        沿着 prev_block_hash 逐个读取区块, 用于还没有高度索引的旧数据库.
+        旧数据库的区块在 blockchain 表中, 需要先用 importblocks 复制到 BlockStore.
+        """
+        current_block_hash = misc_db.get('last_block_hash', "0" * 64)
+        while current_block_hash != "0" * 64:
+            try:
+                block = chain_db[current_block_hash]
+            except KeyError:
+                raise BitcoinException(
+                    f"Block {current_block_hash} not found, "
+                    "blocks saved by older versions can be copied with importblocks"
+                )
+            current_block_hash = block.prev_block_hash
+            yield block
 
     def __len__(self):
-        # FIXME: 性能问题
         try:
-            current_block_hash = misc_db['last_block_hash']
+            return misc_db['tip_height'] + 1
         except KeyError:
+            pass
+        if 'last_block_hash' not in misc_db:
             return 0
-        cnt = 0
-        try:
-            while block := chain_db[current_block_hash]:
-                current_block_hash = block.prev_block_hash
-                cnt += 1
-        except KeyError:
-            return cnt
-
-    def top_n_blocks(self, n: int):
-        if n > len(self):
+        # 旧版本的数据库没有高度索引, 需要先遍历一遍整条链来建立
+        return self._build_height_index() + 1
+
+    def _build_height_index(self) -> int:
+        blocks = list(self._walk())
+        with db.transaction():
+            for height, block in enumerate(reversed(blocks)):
+                block.height = height
+                chain_db[block.hash] = block
+                height_db[str(height)] = block.hash
+            misc_db['tip_height'] = len(blocks) - 1
+        return len(blocks) - 1
+
+    def base_height(self) -> int:
+        """本地保存的最低区块高度. 从 UTXO 快照启动的节点没有快照之前的区块, 见 snapshot."""
+        return misc_db.get('base_height', 0)
+
+    def block_at(self, height: int) -> Block:
+        return chain_db[height_db[str(height)]]
+
+    def blocks_at(self, heights: Iterable[int]) -> list[Block]:
+        """用两次批量查询读取多个高度的区块, 按 heights 的顺序返回."""
+        keys = [str(height) for height in heights]
+        hashes = height_db.get_many(keys)
+        if len(hashes) != len(keys):
+            missing = next(key for key in keys if key not in hashes)
+            raise BitcoinException(f"Block at height {missing} is not stored locally")
+        blocks = chain_db.get_many(hashes.values())
+        return [blocks[hashes[key]] for key in keys]
+
+    def top_n_blocks(self, n: int) -> list[Block]:
+        length = len(self)
+        if n > length:
             raise BitcoinException(
-                f"Trying to read {n} blocks when current chain height is { len(self)}"
+                f"Trying to read {n} blocks when current chain height is {length}"
             )
-        current_block_hash = misc_db['last_block_hash']
-        cnt = 0
-        blocks = []
-        while block := chain_db[current_block_hash]:
-            current_block_hash = block.prev_block_hash
-            blocks.append(block)
-            cnt += 1
-            if cnt == n:
-                return blocks[::-1]
-
-    def find_spendable_transactions(
-        self, amount: int, address: str
-    ) -> tuple[list[Transaction], int]:
+        return self.blocks_at(range(length - n, length))
+
+    def blocks_since(self, height: int) -> list[Block]:
+        """返回高度不小于 height 的所有区块, 按高度升序排列."""
+        return self.top_n_blocks(max(len(self) - height, 0))
+
+    def find_transaction(self, txid: str) -> tuple[Block, int]:
+        """返回包含该交易的区块以及交易在区块中的位置."""
+        if txid not in tx_index_db:
+            raise BitcoinException(f"Transaction {txid} is not in the chain")
+        block_hash, position = tx_index_db[txid]
+        return chain_db[block_hash], position
+
+    def prove_transaction(self, txid: str) -> tuple[BlockHeader, MerkleProof]:
+        """交易所在的区块头以及交易的包含证明."""
+        block, position = self.find_transaction(txid)
+        return block.header(), block.merkle_tree().proof(position)
+
+    def find_utxos(self, pubkey_hash: str) -> list[tuple[str, int, TXOutput]]:
+        """返回锁定到 pubkey_hash 的所有 UTXO, 形如 (txid, vout_index, output)."""
+        keys = [
+            key.split(":", 1)[1]
+            for key in address_index_db.keys_with_prefix(pubkey_hash + ":")
+        ]
+        outputs = utxo_db.get_many(keys)
+        utxos = []
+        for key in keys:
+            txid, index = key.rsplit(":", 1)
+            utxos.append((txid, int(index), outputs[key]))
+        return utxos
+
+    def get_balance(self, pubkey_hash: str) -> float:
+        return sum(output.value for _, _, output in self.find_utxos(pubkey_hash))
+
+    def find_spendable_outputs(
+        self, amount: float, address: str, strategy: str = "default"
+    ) -> tuple[list[tuple[str, int, TXOutput]], float]:
         """
-        寻找满足给定金额的最小交易集合.
+        用 strategy 从 address 的 UTXO 中选出满足给定金额的一组, 见 coinselect.
         """
-        accumulated = 0
-        rtn = []
+        return select_coins(self.find_utxos(address), amount, strategy)
+
 
-        for tx in unspent_txs_db.values():
-            should_be_added = 0
-            for output in tx.vout:
-                if not output.is_spent and output.can_be_unlocked_with(address):
-                    accumulated += output.value
-                    should_be_added = 1
-            if should_be_added:
-                rtn.append(tx)
+def outpoint(txid: str, vout_index: int) -> str:
+    return f"{txid}:{vout_index}"
 
-            if accumulated > amount:
-                return rtn, accumulated
 
-        raise BitcoinException(f"Not enough funds in address {address}")
+def address_key(pubkey_hash: str, key: str) -> str:
+    """地址索引中的键, key 为 outpoint."""
+    return f"{pubkey_hash}:{key}"
 
 
 blockchain = BlockChain()
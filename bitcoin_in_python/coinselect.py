@@ -0,0 +1,138 @@
+"""
+选币: 从钱包的 UTXO 中挑出用来支付某个金额的输入.
+
+每个输入都要单独签名和验证, 所以输入越少交易越小, 签名和验证也越快.
+策略是一个函数 (coins, target) -> 选中的 coins 或 None, 在 STRATEGIES 中按名字注册:
+
+- first-fit: 按 UTXO 原来的顺序累加, 直到够付 (以前的做法, 留作对比)
+- largest-first: 从大到小累加, 输入数量最少
+- bnb: 分支定界搜索恰好等于金额的组合, 这样不需要找零输出
+- default: 输入数量不超过 largest-first 的前提下, 优先用恰好相等的组合
+
+金额可以是小数, 比较前统一换算成整数 (COIN 分之一), 避免浮点误差.
+"""
+
+from typing import TYPE_CHECKING, Callable, Optional
+
+from bitcoin_in_python.exception import BitcoinException
+
+if TYPE_CHECKING:
+    # transaction 在模块级导入了 units
+    from bitcoin_in_python.transaction import TXOutput
+
+COIN = 10**8  # 金额的最小单位
+BNB_MAX_TRIES = 100_000  # 分支定界最多访问的节点数
+
+Coin = tuple[str, int, "TXOutput"]  # (txid, vout_index, output)
+Strategy = Callable[[list[Coin], int], Optional[list[Coin]]]
+
+
+def units(value: float) -> int:
+    return round(value * COIN)
+
+
+def _value(coin: Coin) -> int:
+    return units(coin[2].value)
+
+
+def _descending(coins: list[Coin]) -> list[Coin]:
+    # 同样大小的 UTXO 按 outpoint 排序, 使结果和 UTXO 的存储顺序无关
+    return sorted(coins, key=lambda coin: (-_value(coin), coin[0], coin[1]))
+
+
+def first_fit(coins: list[Coin], target: int) -> Optional[list[Coin]]:
+    selected = []
+    total = 0
+    for coin in coins:
+        selected.append(coin)
+        total += _value(coin)
+        if total >= target:
+            return selected
+    return None
+
+
+def largest_first(coins: list[Coin], target: int) -> Optional[list[Coin]]:
+    """
+    取最大的 k 个 UTXO 刚好够付, 任何更少的组合都不够. 最后一个换成剩下的 UTXO 中
+    够付余额的最小的那个, 输入数量不变, 但少动用大额的 UTXO.
+    """
+    coins = _descending(coins)
+    total = 0
+    for k, coin in enumerate(coins):
+        if total + _value(coin) >= target:
+            rest = target - total
+            last = min((c for c in coins[k:] if _value(c) >= rest), key=lambda c: _value(c))
+            return coins[:k] + [last]
+        total += _value(coin)
+    return None
+
+
+def branch_and_bound(
+    coins: list[Coin],
+    target: int,
+    max_inputs: Optional[int] = None,
+    max_tries: int = BNB_MAX_TRIES,
+) -> Optional[list[Coin]]:
+    """
+    深度优先搜索总额恰好等于 target 的组合, 最多 max_inputs 个输入, 返回输入数量最少的一个.
+    UTXO 从大到小排列, 剩下的全加上也不够或者已经超过时剪枝, 访问 max_tries 个节点后停止.
+    """
+    coins = _descending(coins)
+    values = [_value(coin) for coin in coins]
+    # remaining[i] 是 values[i:] 的和
+    remaining = [0] * (len(values) + 1)
+    for i in range(len(values) - 1, -1, -1):
+        remaining[i] = remaining[i + 1] + values[i]
+
+    best: Optional[list[int]] = None
+    limit = len(values) if max_inputs is None else max_inputs  # 还能接受的最多输入数
+    tries = 0
+    # 栈中的元素: (下一个考虑的下标, 已选的下标, 已选的总额)
+    stack: list[tuple[int, list[int], int]] = [(0, [], 0)]
+    while stack and tries < max_tries:
+        tries += 1
+        i, chosen, total = stack.pop()
+        if total == target:
+            best = chosen
+            limit = len(chosen) - 1
+            continue
+        if i == len(values) or total + remaining[i] < target or len(chosen) >= limit:
+            continue
+        # 后压入的先搜索, 所以先尝试选上 values[i]
+        stack.append((i + 1, chosen, total))
+        if total + values[i] <= target:
+            stack.append((i + 1, chosen + [i], total + values[i]))
+
+    if best is None:
+        return None
+    return [coins[i] for i in best]
+
+
+def exact_or_largest(coins: list[Coin], target: int) -> Optional[list[Coin]]:
+    largest = largest_first(coins, target)
+    if largest is None:
+        return None
+    return branch_and_bound(coins, target, len(largest)) or largest
+
+
+STRATEGIES: dict[str, Strategy] = {
+    "first-fit": first_fit,
+    "largest-first": largest_first,
+    "bnb": branch_and_bound,
+    "default": exact_or_largest,
+}
+
+
+def select_coins(
+    coins: list[Coin], amount: float, strategy: str = "default"
+) -> tuple[list[Coin], float]:
+    """按 strategy 选出支付 amount 的 UTXO, 返回选中的 UTXO 和它们的总额."""
+    if strategy not in STRATEGIES:
+        raise BitcoinException(f"Unknown coin selection strategy {strategy}")
+    target = units(amount)
+    if target <= 0:
+        raise BitcoinException("Amount must be positive")
+    selected = STRATEGIES[strategy](coins, target)
+    if selected is None:
+        raise BitcoinException(f"Not enough funds to pay {amount} ({strategy} coin selection)")
+    return selected, sum(coin[2].value for coin in selected)
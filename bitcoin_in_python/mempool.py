@@ -0,0 +1,178 @@
+"""
+内存交易池.
+
+交易按 txid 和它花费的 outpoint 建立索引, 检查双花只需要一次字典查找.
+交易在进入交易池时就完成验证: 花费的输出必须在 UTXO 集合或交易池的其他交易中,
+不能与交易池中已有的交易冲突, 公钥要与输出的地址一致, 签名要有效.
+交易池超出数量或字节数上限时, 从最早进入的交易开始淘汰, 连同花费它的输出的交易一起.
+"""
+
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from bitcoin_in_python import metrics
+from bitcoin_in_python.block import Block, outpoint
+from bitcoin_in_python.exception import BitcoinException
+from bitcoin_in_python.serialization import encode_transaction
+from bitcoin_in_python.storage import utxo_db
+from bitcoin_in_python.transaction import Transaction, TXOutput
+
+MAX_MEMPOOL_TXS = 5000
+MAX_MEMPOOL_BYTES = 32 * 1024 * 1024
+
+_accepted = metrics.counter("mempool.accepted")
+_rejected = metrics.counter("mempool.rejected")
+_evicted = metrics.counter("mempool.evicted")
+
+
+@dataclass
+class MempoolEntry:
+    tx: Transaction
+    size: int  # 序列化后的字节数
+    added: float  # 进入交易池的时间
+
+
+@dataclass
+class Mempool:
+    max_count: int = MAX_MEMPOOL_TXS
+    max_bytes: int = MAX_MEMPOOL_BYTES
+    entries: dict[str, MempoolEntry] = field(default_factory=dict)  # 按进入的先后排序
+    spent: dict[str, str] = field(default_factory=dict)  # outpoint -> 花费它的 txid
+    bytes: int = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, txid: str):
+        return txid in self.entries
+
+    def find_output(self, key: str) -> Optional[TXOutput]:
+        """在 UTXO 集合和交易池中查找尚未被区块花费的输出."""
+        output = utxo_db.get(key)
+        if output is None:
+            txid, index = key.rsplit(":", 1)
+            entry = self.entries.get(txid)
+            if entry is not None and int(index) < len(entry.tx.vout):
+                output = entry.tx.vout[int(index)]
+        return output
+
+    def check(self, tx: Transaction, verify: bool = True) -> None:
+        if tx.is_coinbase():
+            raise BitcoinException(f"Coinbase transaction {tx.id} cannot enter the mempool")
+        if tx.compute_id() != tx.id:
+            raise BitcoinException(f"Transaction {tx.id} is malformed")
+
+        keys = set()
+        spent = []
+        for vin in tx.vin:
+            key = outpoint(vin.txid, vin.vout_index)
+            if key in keys:
+                raise BitcoinException(f"Transaction {tx.id} spends {key} twice")
+            keys.add(key)
+            if key in self.spent:
+                raise BitcoinException(
+                    f"Transaction {tx.id} conflicts with {self.spent[key]} in the mempool"
+                )
+            output = self.find_output(key)
+            if output is None:
+                raise BitcoinException(f"Transaction {tx.id} spends unknown output {key}")
+            spent.append(output)
+        tx.check_spends(spent)
+
+        if verify and not tx.verify():
+            raise BitcoinException(f"Transaction {tx.id} has an invalid signature")
+
+    def add(self, tx: Transaction, verify: bool = True) -> bool:
+        """
+        验证并加入交易池, 验证失败时抛出 BitcoinException.
+        交易已经在交易池中, 或者加入后马上被淘汰时返回 False.
+        签名已经由调用者验证过时 verify 传入 False.
+        """
+        if tx.id in self.entries:
+            return False
+        try:
+            self.check(tx, verify)
+        except BitcoinException:
+            _rejected.inc()
+            raise
+        entry = MempoolEntry(tx, len(encode_transaction(tx)), time.time())
+        if entry.size > self.max_bytes:
+            _rejected.inc()
+            raise BitcoinException(f"Transaction {tx.id} is larger than the mempool")
+
+        self.entries[tx.id] = entry
+        for vin in tx.vin:
+            self.spent[outpoint(vin.txid, vin.vout_index)] = tx.id
+        self.bytes += entry.size
+        _accepted.inc()
+
+        while len(self.entries) > self.max_count or self.bytes > self.max_bytes:
+            oldest = next(iter(self.entries))
+            print(f"Mempool full, evicting transaction {oldest}")
+            _evicted.inc()
+            self.remove(oldest)
+        return tx.id in self.entries
+
+    def _pop(self, txid: str) -> Optional[MempoolEntry]:
+        entry = self.entries.pop(txid, None)
+        if entry is not None:
+            self.bytes -= entry.size
+            for vin in entry.tx.vin:
+                self.spent.pop(outpoint(vin.txid, vin.vout_index), None)
+        return entry
+
+    def remove(self, txid: str) -> None:
+        """移除交易以及所有 (直接或间接) 花费它的输出的交易."""
+        stack = [txid]
+        while stack:
+            entry = self._pop(stack.pop())
+            if entry is None:
+                continue
+            for index in range(len(entry.tx.vout)):
+                child = self.spent.get(outpoint(entry.tx.id, index))
+                if child is not None:
+                    stack.append(child)
+
+    def remove_block(self, block: Block) -> None:
+        """
+        区块上链后调用. 区块中的交易直接移出交易池, 花费它们的交易仍然有效;
+        与区块中的交易冲突的交易则连同其后代一起移除.
+        """
+        for tx in block.transactions:
+            if tx.is_coinbase():
+                continue
+            if self._pop(tx.id) is not None:
+                continue
+            for vin in tx.vin:
+                conflict = self.spent.get(outpoint(vin.txid, vin.vout_index))
+                if conflict is not None:
+                    self.remove(conflict)
+
+    def block_template(self, max_count: int, max_bytes: int) -> list[Transaction]:
+        """
+        按进入交易池的先后选择交易, 至多 max_count 笔, 总共至多 max_bytes 字节.
+        父交易总是比子交易先进入交易池, 所以父交易没有被选中时跳过子交易即可.
+        """
+        chosen: dict[str, Transaction] = {}
+        size = 0
+        for txid, entry in self.entries.items():
+            if len(chosen) >= max_count:
+                break
+            if size + entry.size > max_bytes:
+                continue
+            if any(
+                vin.txid in self.entries and vin.txid not in chosen for vin in entry.tx.vin
+            ):
+                continue
+            chosen[txid] = entry.tx
+            size += entry.size
+        return list(chosen.values())
+
+    def stats(self) -> dict:
+        oldest = next(iter(self.entries.values()), None)
+        return {
+            "count": len(self.entries),
+            "bytes": self.bytes,
+            "oldest_age": time.time() - oldest.added if oldest else 0.0,
+        }
@@ -0,0 +1,61 @@
+"""
+交易的 Merkle 树.
+
+叶子是交易哈希, 每个父节点是两个子节点拼接后的双重 SHA-256, 某一层节点数为奇数时复制最后一个.
+树的每一层都保存下来, 生成某笔交易的包含证明只需要取出每一层的兄弟节点,
+证明的长度是 O(log n), 只凭证明和区块头中的根就可以验证交易在区块中.
+"""
+
+from dataclasses import dataclass
+from hashlib import sha256
+
+
+def merkle_parent(left: bytes, right: bytes) -> bytes:
+    return sha256(sha256(left + right).digest()).digest()
+
+
+@dataclass
+class MerkleProof:
+    txid: str
+    index: int  # 交易在区块中的位置
+    siblings: list[bytes]  # 从叶子到根, 每一层的兄弟节点
+
+    def root(self) -> str:
+        h = bytes.fromhex(self.txid)
+        index = self.index
+        for sibling in self.siblings:
+            h = merkle_parent(sibling, h) if index & 1 else merkle_parent(h, sibling)
+            index >>= 1
+        return h.hex()
+
+    def verify(self, root: str) -> bool:
+        return self.root() == root
+
+
+@dataclass
+class MerkleTree:
+    levels: list[list[bytes]]  # levels[0] 是叶子, levels[-1] 只有根
+
+    @classmethod
+    def from_txids(cls, txids: list[str]) -> "MerkleTree":
+        level = [bytes.fromhex(txid) for txid in txids] or [bytes(32)]
+        levels = [level]
+        while len(level) > 1:
+            if len(level) % 2:
+                level = level + level[-1:]
+            level = [merkle_parent(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+            levels.append(level)
+        return cls(levels)
+
+    @property
+    def root(self) -> str:
+        return self.levels[-1][0].hex()
+
+    def proof(self, index: int) -> MerkleProof:
+        siblings = []
+        i = index
+        for level in self.levels[:-1]:
+            # 奇数个节点时最后一个节点和自己配对
+            siblings.append(level[i ^ 1] if i ^ 1 < len(level) else level[i])
+            i >>= 1
+        return MerkleProof(self.levels[0][index].hex(), index, siblings)
@@ -0,0 +1,182 @@
+"""
+轻量的指标收集: 计数器, 数值 (gauge) 和耗时直方图.
+
+指标对象在模块导入时创建一次, 热点路径上只多一次方法调用和一个判断.
+默认关闭, 关闭时 inc / set / observe 什么都不做, now() 不读取时钟.
+计时的写法是:
+
+    start = metrics.now()
+    ...
+    histogram.observe_since(start)
+
+挖矿在单独的进程中进行, 用 call_with_metrics 运行, 子进程中记录的指标随结果一起返回,
+再由 merge 合并到当前进程.
+"""
+
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Union
+
+# 直方图的桶上界 (秒), 从 1 微秒开始每次翻倍, 最后一个桶约 134 秒
+BUCKETS = [1e-6 * 2**i for i in range(28)]
+
+
+_enabled = False
+
+
+class Counter:
+    def __init__(self, name: str):
+        self.name = name
+        self.value = 0
+
+    def inc(self, n: int = 1) -> None:
+        if _enabled:
+            self.value += n
+
+
+class Gauge:
+    def __init__(self, name: str):
+        self.name = name
+        self.value: Union[int, float] = 0
+
+    def set(self, value: Union[int, float]) -> None:
+        if _enabled:
+            self.value = value
+
+
+class Histogram:
+    def __init__(self, name: str):
+        self.name = name
+        self.counts = [0] * (len(BUCKETS) + 1)  # 最后一个桶存放超过上界的值
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        if _enabled:
+            self.counts[bisect_left(BUCKETS, value)] += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def observe_since(self, start: float) -> None:
+        if _enabled:
+            self.observe(time.perf_counter() - start)
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def percentile(self, q: float) -> float:
+        """由桶估计分位数, 返回所在桶的上界."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        count = self.count
+        return {
+            "count": count,
+            "sum": self.sum,
+            "mean": self.sum / count if count else 0.0,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+        }
+
+
+_counters: dict[str, Counter] = {}
+_gauges: dict[str, Gauge] = {}
+_histograms: dict[str, Histogram] = {}
+
+
+def counter(name: str) -> Counter:
+    if name not in _counters:
+        _counters[name] = Counter(name)
+    return _counters[name]
+
+
+def gauge(name: str) -> Gauge:
+    if name not in _gauges:
+        _gauges[name] = Gauge(name)
+    return _gauges[name]
+
+
+def histogram(name: str) -> Histogram:
+    if name not in _histograms:
+        _histograms[name] = Histogram(name)
+    return _histograms[name]
+
+
+def enable(enabled: bool = True) -> None:
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def now() -> float:
+    return time.perf_counter() if _enabled else 0.0
+
+
+def reset() -> None:
+    for c in _counters.values():
+        c.value = 0
+    for g in _gauges.values():
+        g.value = 0
+    for h in _histograms.values():
+        h.counts = [0] * len(h.counts)
+        h.sum = h.max = 0.0
+
+
+def snapshot() -> dict:
+    """所有指标的当前值, 可以直接转为 JSON."""
+    return {
+        "counters": {name: c.value for name, c in sorted(_counters.items()) if c.value},
+        "gauges": {name: g.value for name, g in sorted(_gauges.items())},
+        "histograms": {
+            name: h.summary() for name, h in sorted(_histograms.items()) if h.count
+        },
+    }
+
+
+def dump() -> dict:
+    """可以由 merge 合并的原始数据."""
+    return {
+        "counters": {name: c.value for name, c in _counters.items() if c.value},
+        "gauges": {name: g.value for name, g in _gauges.items() if g.value},
+        "histograms": {
+            name: (h.counts, h.sum, h.max) for name, h in _histograms.items() if h.count
+        },
+    }
+
+
+def merge(data: dict) -> None:
+    """合并另一个进程的 dump(). 计数器和直方图相加, gauge 取对方的值."""
+    if not _enabled:
+        return
+    for name, value in data["counters"].items():
+        counter(name).value += value
+    for name, value in data["gauges"].items():
+        gauge(name).value = value
+    for name, (counts, total, maximum) in data["histograms"].items():
+        h = histogram(name)
+        h.counts = [a + b for a, b in zip(h.counts, counts)]
+        h.sum += total
+        h.max = max(h.max, maximum)
+
+
+def call_with_metrics(enabled: bool, func: Callable, *args) -> tuple[Any, dict]:
+    """
+    在子进程中调用 func, 返回结果和这次调用记录的指标.
+    enabled 为父进程的 is_enabled(), 父进程关闭了指标时子进程也不记录.
+    """
+    enable(enabled)
+    reset()
+    return func(*args), dump()
@@ -0,0 +1,134 @@
+"""
+多进程挖矿. 把 nonce 空间切成若干块, 由各个 worker 进程轮流认领,
+任意一个 worker 找到合法的哈希后通知其他 worker 停止.
+"""
+
+import hashlib
+import multiprocessing
+import queue
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from bitcoin_in_python.exception import BitcoinException
+
+MAX_NONCE = 1 << 64  # 防止 nonce 溢出
+CHUNK_SIZE = 1 << 14  # 每个 worker 每次检查的 nonce 数量, 检查完一块后才会查看停止信号
+
+
+@dataclass
+class MiningResult:
+    nonce: int
+    hash: str
+    hashes: int  # 所有 worker 一共尝试过的 nonce 数量
+    elapsed: float
+
+    @property
+    def hashrate(self) -> float:
+        return self.hashes / self.elapsed if self.elapsed > 0 else 0.0
+
+
+def target_bytes(target_bits: int) -> bytes:
+    """难度对应的上界, 以 32 字节大端序表示. 等长的字节串按字典序比较即为数值比较."""
+    target = min(1 << (256 - target_bits), (1 << 256) - 1)
+    return target.to_bytes(32, byteorder="big")
+
+
+def search_chunk(midstate, target: bytes, start: int, end: int) -> Optional[tuple[int, str]]:
+    """
+    在 [start, end) 中寻找满足难度的 nonce.
+    midstate 是已经喂入区块头前缀的 sha256 对象, 每个 nonce 只需复制它再补上 nonce.
+    """
+    copy = midstate.copy
+    for nonce in range(start, end):
+        h = copy()
+        h.update(b"%d" % nonce)
+        if h.digest() < target:
+            return nonce, h.hexdigest()
+    return None
+
+
+def _worker(prefix: bytes, target: bytes, index: int, workers: int, stop, results) -> None:
+    midstate = hashlib.sha256(prefix)
+    tried = 0
+    for start in range(index * CHUNK_SIZE, MAX_NONCE, workers * CHUNK_SIZE):
+        if stop.is_set():
+            break
+        end = min(start + CHUNK_SIZE, MAX_NONCE)
+        found = search_chunk(midstate, target, start, end)
+        if found:
+            tried += found[0] - start + 1
+            results.put(("found", found, tried))
+            return
+        tried += end - start
+    results.put(("stopped", None, tried))
+
+
+def mine(prefix: str, target_bits: int, workers: int = 1, stop=None) -> Optional[MiningResult]:
+    """
+    寻找 nonce 使得 sha256(prefix + str(nonce)) < 2 ** (256 - target_bits).
+    stop 为一个 Event, 被 set 后挖矿中止并返回 None.
+    """
+    prefix_bytes = prefix.encode()
+    target = target_bytes(target_bits)
+    start_time = time.time()
+
+    if workers <= 1:
+        midstate = hashlib.sha256(prefix_bytes)
+        tried = 0
+        for start in range(0, MAX_NONCE, CHUNK_SIZE):
+            if stop is not None and stop.is_set():
+                return None
+            end = min(start + CHUNK_SIZE, MAX_NONCE)
+            chunk = search_chunk(midstate, target, start, end)
+            if chunk is not None:
+                nonce, hash_hex = chunk
+                tried += nonce - start + 1
+                return MiningResult(nonce, hash_hex, tried, time.time() - start_time)
+            tried += end - start
+        raise BitcoinException("Reached MAX_NONCE, mining aborted.")
+
+    ctx = multiprocessing.get_context()
+    worker_stop = ctx.Event()
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(
+            target=_worker,
+            args=(prefix_bytes, target, i, workers, worker_stop, results),
+            daemon=True,
+        )
+        for i in range(workers)
+    ]
+    for p in processes:
+        p.start()
+
+    winner: Optional[tuple[int, str]] = None
+    tried = 0
+    pending = workers
+    try:
+        while pending:
+            try:
+                kind, result, n = results.get(timeout=0.1)
+            except queue.Empty:
+                if stop is not None and stop.is_set():
+                    worker_stop.set()
+                if not any(p.is_alive() for p in processes) and results.empty():
+                    break  # worker 异常退出
+                continue
+            pending -= 1
+            tried += n
+            # 只采用第一个找到的结果, 然后让其他 worker 停下来汇报各自的计数
+            if kind == "found" and winner is None:
+                winner = result
+                worker_stop.set()
+    finally:
+        worker_stop.set()
+        for p in processes:
+            p.join()
+
+    if winner is None:
+        if stop is not None and stop.is_set():
+            return None
+        raise BitcoinException("Reached MAX_NONCE, mining aborted.")
+    nonce, hash_hex = winner
+    return MiningResult(nonce, hash_hex, tried, time.time() - start_time)
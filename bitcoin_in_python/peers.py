@@ -0,0 +1,235 @@
+"""
+与多个节点的连接.
+
+每个节点保持一个长连接, 断开后在下一次请求时重新连接.
+同步区块时各个节点分别下载不同的批 (互不重叠的高度区间), 按高度顺序交给 sync.
+每个节点记录每个区块的平均下载时间, 出错或明显比最快的节点慢的节点不再参与本次下载,
+它没有完成的批交给其他节点重新下载.
+"""
+
+import heapq
+import socket
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+from bitcoin_in_python import metrics
+from bitcoin_in_python.exception import BitcoinException
+from bitcoin_in_python.protocol import recv_data, send_data
+from bitcoin_in_python.serialization import Reader
+
+DEFAULT_PORT = 4000
+PEER_TIMEOUT = 30  # 秒, 超时的请求算作一次失败
+MAX_FAILURES = 3  # 连续失败这么多次后不再使用该节点
+# 每个区块的下载时间超过最快节点的 SLOW_FACTOR 倍, 并且至少多 SLOW_MARGIN 秒时, 停止向它请求.
+# 本地节点每个区块只需要零点几毫秒, 差几倍只是噪声
+SLOW_FACTOR = 4
+SLOW_MARGIN = 0.01
+MIN_SAMPLES = 3  # 至少下载过这么多批之后才比较快慢
+BATCHES_PER_PEER = 2  # 每个节点同时领取的批数, 限制乱序到达后等待写入的数据量
+EWMA_WEIGHT = 0.3
+
+_peer_failures = metrics.counter("network.peer_failures")
+_peers_dropped = metrics.counter("network.peers_dropped")
+
+
+def parse_peer(address: str) -> tuple[str, int]:
+    """ "host:port", "host" 或 "port"."""
+    host, _, port = address.rpartition(":")
+    if not host:
+        if port.isdigit():
+            return "localhost", int(port)
+        return port, DEFAULT_PORT
+    if not port.isdigit():
+        raise BitcoinException(f"Invalid peer address {address}")
+    return host, int(port)
+
+
+@dataclass
+class Peer:
+    host: str
+    port: int
+    conn: Optional[socket.socket] = field(default=None, repr=False)
+    failures: int = 0  # 连续失败的次数
+    batches: int = 0  # 成功下载的批数
+    seconds_per_block: Optional[float] = None  # 平均值 (EWMA)
+    dropped: bool = False
+
+    def __post_init__(self):
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return f"{self.host}:{self.port}"
+
+    def request(self, command: str, data: bytes) -> tuple[str, bytes]:
+        with self.lock:
+            try:
+                if self.conn is None:
+                    self.conn = socket.create_connection((self.host, self.port), PEER_TIMEOUT)
+                send_data(command, data, self.conn)
+                return recv_data(self.conn)
+            except (OSError, BitcoinException):
+                # 连接已经不可用 (可能还有没读完的数据), 下次请求时重新连接
+                self.close()
+                raise
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def record(self, blocks: int, seconds: float) -> None:
+        self.failures = 0
+        self.batches += 1
+        sample = seconds / max(blocks, 1)
+        if self.seconds_per_block is None:
+            self.seconds_per_block = sample
+        else:
+            self.seconds_per_block += EWMA_WEIGHT * (sample - self.seconds_per_block)
+
+    def fail(self, reason: str) -> None:
+        _peer_failures.inc()
+        self.failures += 1
+        print(f"Request to peer {self} failed: {reason}")
+        if self.failures >= MAX_FAILURES:
+            self.drop(f"{self.failures} failures in a row")
+
+    def drop(self, reason: str) -> None:
+        if not self.dropped:
+            _peers_dropped.inc()
+            print(f"Dropping peer {self}: {reason}")
+        self.dropped = True
+        self.close()
+
+
+@dataclass
+class _Download:
+    """download_blocks 中各个线程共享的状态, 由 cond 保护."""
+
+    remaining: int  # 还没有下载成功的批数
+    next: int = 0  # 下一个要产生的批
+    error: Optional[BitcoinException] = None
+
+
+class PeerManager:
+    """
+    request 把命令发给第一个可用的节点 (按配置的顺序), 失败时换下一个.
+    download_blocks 用所有节点并行下载区块, 可以作为 sync_chain 的 download 参数.
+    """
+
+    def __init__(self, addresses: list[str]):
+        if not addresses:
+            raise BitcoinException("No peers configured")
+        self.peers = [Peer(*parse_peer(address)) for address in addresses]
+
+    def active(self) -> list[Peer]:
+        return [peer for peer in self.peers if not peer.dropped]
+
+    def request(self, command: str, data: bytes) -> tuple[str, bytes]:
+        for peer in self.active():
+            try:
+                return peer.request(command, data)
+            except (OSError, BitcoinException) as e:
+                peer.fail(str(e))
+        raise BitcoinException("No peer is reachable")
+
+    def close(self) -> None:
+        for peer in self.peers:
+            peer.close()
+
+    def _check_speed(self, peer: Peer) -> None:
+        """和最快的节点比较, 太慢则不再向它请求. 只剩一个节点时总是保留."""
+        seconds = peer.seconds_per_block
+        if not seconds or peer.batches < MIN_SAMPLES or len(self.active()) <= 1:
+            return
+        fastest = seconds
+        for p in self.active():
+            if p.batches >= MIN_SAMPLES and p.seconds_per_block:
+                fastest = min(fastest, p.seconds_per_block)
+        if seconds > max(SLOW_FACTOR * fastest, fastest + SLOW_MARGIN):
+            peer.drop(
+                f"{seconds * 1000:.1f} ms per block, "
+                f"the fastest peer takes {fastest * 1000:.1f} ms"
+            )
+
+    def download_blocks(self, batches: list, stop: threading.Event) -> Iterator[bytes]:
+        """
+        按顺序产生每一批区块编码后的数据, batches 中的每一项是一批区块头.
+        每个节点一个下载线程, 从还没有下载的批中领取高度最低的一批.
+        领取的批至多比下一个要产生的批超前 BATCHES_PER_PEER * 节点数 批.
+        """
+        from bitcoin_in_python.sync import encode_range
+
+        peers = self.active()
+        if not peers:
+            raise BitcoinException("No peer is reachable")
+        window = BATCHES_PER_PEER * len(peers)
+        todo = list(range(len(batches)))  # 最小堆, 失败后放回的批会先被领取
+        done: dict[int, bytes] = {}
+        state = _Download(len(batches))
+        cond = threading.Condition()
+
+        def claim(peer: Peer) -> Optional[int]:
+            with cond:
+                while True:
+                    # 没有可以领取的批时也要等待: 其他节点失败后会把它的批放回来
+                    if stop.is_set() or peer.dropped or not state.remaining:
+                        return None
+                    if todo and todo[0] < state.next + window:
+                        return heapq.heappop(todo)
+                    cond.wait(0.1)  # stop 是从外部设置的, 不会通知 cond
+
+        def worker(peer: Peer) -> None:
+            while (i := claim(peer)) is not None:
+                batch = batches[i]
+                start = time.perf_counter()
+                try:
+                    command, data = peer.request(
+                        'getblocks', encode_range(batch[0].height, len(batch))
+                    )
+                    if command != 'blocks':
+                        raise BitcoinException(f"unexpected reply {command}")
+                    r = Reader(data)
+                    r.version()
+                    if r.varint() != len(batch):
+                        # 对方的链比区块头短, 例如它还没有同步到这里
+                        raise BitcoinException(f"missing blocks from height {batch[0].height}")
+                except (OSError, BitcoinException) as e:
+                    with cond:
+                        peer.fail(str(e))
+                        heapq.heappush(todo, i)
+                        if not any(not p.dropped for p in peers):
+                            state.error = BitcoinException("All peers failed")
+                        cond.notify_all()
+                    continue
+                with cond:
+                    peer.record(len(batch), time.perf_counter() - start)
+                    self._check_speed(peer)
+                    done[i] = data
+                    state.remaining -= 1
+                    cond.notify_all()
+
+        threads = [
+            threading.Thread(target=worker, args=(peer,), name=f"peer-{peer}", daemon=True)
+            for peer in peers
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for i in range(len(batches)):
+                with cond:
+                    while i not in done and state.error is None:
+                        if stop.is_set():
+                            return
+                        cond.wait(0.1)
+                    if i not in done and state.error is not None:
+                        raise state.error
+                    data = done.pop(i)
+                    state.next = i + 1
+                    cond.notify_all()
+                yield data
+        finally:
+            with cond:
+                stop.set()
+                cond.notify_all()
@@ -0,0 +1,135 @@
+"""
+节点之间的通信协议: 前 4 字节为长度, 接 12 字节为命令名称, 接下来为数据.
+
+读取时先分配好整个 payload 的缓冲区, 再用 recv_into 直接写入其中,
+总开销与 payload 长度成线性关系. 也可以用 FrameReader.iter_payload 分块读取,
+处理很大的 payload 时不需要把它完整地放在内存中.
+"""
+
+import socket
+from typing import TYPE_CHECKING, Iterator
+
+from bitcoin_in_python import metrics
+from bitcoin_in_python.exception import BitcoinException
+
+if TYPE_CHECKING:
+    # 客户端不需要 asyncio, 省去导入它的时间
+    import asyncio
+
+HEADER_SIZE = 16  # 4 字节长度 + 12 字节命令名称
+MAX_FRAME_SIZE = 32 * 1024 * 1024  # 超过此长度的 frame 直接拒绝, 防止对方让我们分配过多内存
+CHUNK_SIZE = 64 * 1024
+_COALESCE_LIMIT = 64 * 1024  # 比这小的 payload 和头部拼在一起发送, 避免两次小的 send
+
+_frames_in = metrics.counter("network.frames_in")
+_frames_out = metrics.counter("network.frames_out")
+_bytes_in = metrics.counter("network.bytes_in")
+_bytes_out = metrics.counter("network.bytes_out")
+
+
+def _count_out(length: int) -> None:
+    _frames_out.inc()
+    _bytes_out.inc(HEADER_SIZE + length)
+
+
+def _count_in(length: int) -> None:
+    _frames_in.inc()
+    _bytes_in.inc(HEADER_SIZE + length)
+
+
+def pack_header(command: str, length: int) -> bytes:
+    assert len(command) <= 12
+    return length.to_bytes(4, byteorder='big') + command.ljust(12).encode()
+
+
+def decode_text(data: bytes) -> str:
+    """对方发来的文本 (命令名称, txid 等), 不是合法的 UTF-8 时抛出 BitcoinException."""
+    try:
+        return bytes(data).decode()
+    except UnicodeDecodeError:
+        raise BitcoinException(f"Invalid text {bytes(data)!r} in frame")
+
+
+def unpack_header(header: bytes, max_frame_size: int = MAX_FRAME_SIZE) -> tuple[str, int]:
+    length = int.from_bytes(header[:4], byteorder='big')
+    command = decode_text(header[4:]).strip()  # may contain padding
+    if length > max_frame_size:
+        raise BitcoinException(
+            f"Frame '{command}' of {length} bytes exceeds the limit of {max_frame_size} bytes"
+        )
+    return command, length
+
+
+def send_data(command: str, data: bytes, conn: socket.socket) -> None:
+    header = pack_header(command, len(data))
+    if len(data) < _COALESCE_LIMIT:
+        conn.sendall(header + data)
+    else:
+        conn.sendall(header)
+        conn.sendall(data)
+    _count_out(len(data))
+
+
+class FrameReader:
+    """从阻塞的 socket 中读取 frame."""
+
+    def __init__(self, conn: socket.socket, max_frame_size: int = MAX_FRAME_SIZE):
+        self.conn = conn
+        self.max_frame_size = max_frame_size
+        self._header = bytearray(HEADER_SIZE)
+
+    def _recv_into(self, view: memoryview) -> None:
+        """填满 view, 对方提前关闭连接时报错."""
+        while view:
+            n = self.conn.recv_into(view)
+            if n == 0:
+                raise BitcoinException("Connection closed in the middle of a frame")
+            view = view[n:]
+
+    def read_header(self) -> tuple[str, int]:
+        self._recv_into(memoryview(self._header))
+        command, length = unpack_header(self._header, self.max_frame_size)
+        _count_in(length)
+        return command, length
+
+    def read_payload(self, length: int) -> bytearray:
+        payload = bytearray(length)
+        self._recv_into(memoryview(payload))
+        return payload
+
+    def iter_payload(self, length: int, chunk_size: int = CHUNK_SIZE) -> Iterator[memoryview]:
+        """
+        分块读取 payload, 每一块都写在同一个缓冲区中,
+        所以拿到的 memoryview 在读取下一块之前必须用完.
+        """
+        buf = memoryview(bytearray(min(length, chunk_size)))
+        remaining = length
+        while remaining:
+            view = buf[: min(remaining, chunk_size)]
+            self._recv_into(view)
+            remaining -= len(view)
+            yield view
+
+    def read_frame(self) -> tuple[str, bytearray]:
+        command, length = self.read_header()
+        return command, self.read_payload(length)
+
+
+def recv_data(conn: socket.socket) -> tuple[str, bytearray]:
+    return FrameReader(conn).read_frame()
+
+
+async def read_frame(
+    reader: 'asyncio.StreamReader', max_frame_size: int = MAX_FRAME_SIZE
+) -> tuple[str, bytes]:
+    command, length = unpack_header(await reader.readexactly(HEADER_SIZE), max_frame_size)
+    data = await reader.readexactly(length)
+    _count_in(length)
+    return command, data
+
+
+async def write_frame(command: str, data: bytes, writer: 'asyncio.StreamWriter') -> None:
+    writer.write(pack_header(command, len(data)))
+    writer.write(data)
+    _count_out(len(data))
+    await writer.drain()
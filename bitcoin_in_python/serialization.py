@@ -0,0 +1,340 @@
+"""
+Block 和 Transaction 的二进制编码, 用于存储和网络传输, 取代 pickle.
+
+每条顶层记录以 1 字节的格式版本号开头. 整数使用 LEB128 变长编码,
+变长字段 (哈希, 签名, 公钥, 字符串) 以长度为前缀:
+- 哈希从十六进制字符串转为原始字节, 32 字节 (空哈希为 0 字节)
+- 公钥从 PEM 转为压缩的 SEC1 格式, 33 字节
+- 金额以 1 字节类型标记开头, 整数接变长编码, 浮点数接 8 字节 IEEE 754,
+  这样解码后的 str(value) 与编码前一致, 交易哈希不变
+
+解码器直接在 memoryview 上移动偏移量, 不会复制输入.
+"""
+
+import struct
+from functools import lru_cache
+from typing import Union
+
+from Crypto.PublicKey import ECC
+
+from bitcoin_in_python.block import Block, BlockHeader
+from bitcoin_in_python.exception import BitcoinException
+from bitcoin_in_python.merkle import MerkleProof
+from bitcoin_in_python.transaction import Transaction, TXInput, TXOutput
+
+FORMAT_VERSION = 1
+
+_AMOUNT_INT = 0
+_AMOUNT_FLOAT = 1
+_DOUBLE = struct.Struct(">d")
+# 几乎所有的输入都是: 32 字节 txid, 1 字节的 vout_index, 64 字节签名, 33 字节压缩公钥.
+# 长度都符合时用一次 unpack_from 读出整个输入, 省去逐个字段的方法调用
+_INPUT = struct.Struct(">B32sBB64sB33s")
+
+# NIST P-256 曲线参数, 用于从压缩公钥恢复 y 坐标
+_P256_P = 0xFFFFFFFF00000001000000000000000000000000FFFFFFFFFFFFFFFFFFFFFFFF
+_P256_B = 0x5AC635D8AA3A93E7B3EBBD55769886BC651D06B0CC53B0F63BCE3C3E27D2604B
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class Writer:
+    def __init__(self):
+        self.buf = bytearray()
+
+    def varint(self, n: int) -> None:
+        if n < 0:
+            raise BitcoinException(f"Cannot encode negative integer {n}")
+        while n >= 0x80:
+            self.buf.append((n & 0x7F) | 0x80)
+            n >>= 7
+        self.buf.append(n)
+
+    def raw(self, data: Buffer) -> None:
+        self.buf += data
+
+    def varbytes(self, data: Buffer) -> None:
+        self.varint(len(data))
+        self.buf += data
+
+    def string(self, s: str) -> None:
+        self.varbytes(s.encode())
+
+    def hash(self, h: str) -> None:
+        self.varbytes(bytes.fromhex(h))
+
+    def amount(self, value: Union[int, float]) -> None:
+        if isinstance(value, float):
+            self.buf.append(_AMOUNT_FLOAT)
+            self.buf += _DOUBLE.pack(value)
+        else:
+            self.buf.append(_AMOUNT_INT)
+            self.varint(value)
+
+    def getvalue(self) -> bytes:
+        return bytes(self.buf)
+
+
+class Reader:
+    def __init__(self, data: Buffer):
+        self.view = memoryview(data)
+        self.pos = 0
+
+    def _take(self, n: int) -> memoryview:
+        start = self.pos
+        end = start + n
+        if end > len(self.view):
+            raise BitcoinException("Truncated record.")
+        self.pos = end
+        return self.view[start:end]
+
+    def byte(self) -> int:
+        try:
+            b = self.view[self.pos]
+        except IndexError:
+            raise BitcoinException("Truncated record.")
+        self.pos += 1
+        return b
+
+    def varint(self) -> int:
+        pos = self.pos
+        if pos < len(self.view):
+            b = self.view[pos]
+            if b < 0x80:  # 绝大多数整数只占 1 字节
+                self.pos = pos + 1
+                return b
+        n = 0
+        shift = 0
+        while True:
+            b = self.byte()
+            n |= (b & 0x7F) << shift
+            if b < 0x80:
+                return n
+            shift += 7
+
+    def varbytes(self) -> memoryview:
+        # 每个字段都要调用, 长度只占 1 字节时不经过 varint 和 _take
+        view = self.view
+        start = self.pos
+        if start < len(view) and view[start] < 0x80:
+            end = start + 1 + view[start]
+            start += 1
+        else:
+            n = self.varint()
+            start = self.pos
+            end = start + n
+        if end > len(view):
+            raise BitcoinException("Truncated record.")
+        self.pos = end
+        return view[start:end]
+
+    def string(self) -> str:
+        try:
+            return str(self.varbytes(), "utf-8")
+        except UnicodeDecodeError:
+            raise BitcoinException("Invalid UTF-8 string in record.")
+
+    def hash(self) -> str:
+        return self.varbytes().hex()
+
+    def amount(self) -> Union[int, float]:
+        kind = self.byte()
+        if kind == _AMOUNT_INT:
+            return self.varint()
+        if kind == _AMOUNT_FLOAT:
+            return _DOUBLE.unpack(self._take(_DOUBLE.size))[0]
+        raise BitcoinException(f"Unknown amount type {kind}")
+
+    def version(self) -> None:
+        version = self.byte()
+        if version != FORMAT_VERSION:
+            raise BitcoinException(f"Unsupported record version {version}")
+
+    def done(self) -> bool:
+        return self.pos == len(self.view)
+
+
+@lru_cache(maxsize=1024)
+def compress_public_key(pem: str) -> bytes:
+    if not pem:
+        return b""
+    point = ECC.import_key(pem).pointQ
+    prefix = b"\x03" if int(point.y) & 1 else b"\x02"
+    return prefix + int(point.x).to_bytes(32, byteorder="big")
+
+
+@lru_cache(maxsize=1024)
+def decompress_public_key(data: bytes) -> str:
+    if not data:
+        return ""
+    if len(data) != 33 or data[0] not in (2, 3):
+        raise BitcoinException("Invalid compressed public key.")
+    x = int.from_bytes(data[1:], byteorder="big")
+    y = pow((x * x * x - 3 * x + _P256_B) % _P256_P, (_P256_P + 1) // 4, _P256_P)
+    if y & 1 != data[0] & 1:
+        y = _P256_P - y
+    try:
+        key = ECC.construct(curve="P-256", point_x=x, point_y=y)
+    except ValueError:
+        raise BitcoinException("Invalid compressed public key.")
+    return key.export_key(format="PEM")
+
+
+def write_output(w: Writer, output: TXOutput) -> None:
+    w.amount(output.value)
+    w.string(output.pubkey_hash)
+
+
+def read_output(r: Reader) -> TXOutput:
+    return TXOutput(r.amount(), r.string())
+
+
+def write_input(w: Writer, input: TXInput) -> None:
+    w.hash(input.txid)
+    w.varint(input.vout_index)
+    w.varbytes(input.signature)
+    w.varbytes(compress_public_key(input.pubkey))
+
+
+def read_input(r: Reader) -> TXInput:
+    pos = r.pos
+    if pos + _INPUT.size <= len(r.view):
+        n_txid, txid_bytes, vout_index, n_sig, signature, n_key, key = _INPUT.unpack_from(
+            r.view, pos
+        )
+        if n_txid == 32 and vout_index < 0x80 and n_sig == 64 and n_key == 33:
+            r.pos = pos + _INPUT.size
+            return TXInput(txid_bytes.hex(), vout_index, signature, decompress_public_key(key))
+    txid = r.hash()
+    vout_index = r.varint()
+    signature = bytes(r.varbytes())
+    pubkey = decompress_public_key(bytes(r.varbytes()))
+    return TXInput(txid, vout_index, signature, pubkey)
+
+
+def write_transaction(w: Writer, tx: Transaction) -> None:
+    w.hash(tx.id)
+    w.varint(len(tx.vin))
+    for input in tx.vin:
+        write_input(w, input)
+    w.varint(len(tx.vout))
+    for output in tx.vout:
+        write_output(w, output)
+
+
+def read_transaction(r: Reader) -> Transaction:
+    txid = r.hash()
+    vin = [read_input(r) for _ in range(r.varint())]
+    vout = [read_output(r) for _ in range(r.varint())]
+    return Transaction(txid, vin, vout)
+
+
+def write_block(w: Writer, block: Block) -> None:
+    w.varint(block.timestamp)
+    w.hash(block.prev_block_hash)
+    w.hash(block.hash)
+    w.varint(block.nonce)
+    w.varint(block.target_bits)
+    w.varint(block.height)
+    w.varint(len(block.transactions))
+    for tx in block.transactions:
+        write_transaction(w, tx)
+
+
+def read_block(r: Reader) -> Block:
+    timestamp = r.varint()
+    prev_block_hash = r.hash()
+    block_hash = r.hash()
+    nonce = r.varint()
+    target_bits = r.varint()
+    height = r.varint()
+    txs = [read_transaction(r) for _ in range(r.varint())]
+    return Block(timestamp, txs, prev_block_hash, nonce, block_hash, target_bits, height)
+
+
+def write_header(w: Writer, header: BlockHeader) -> None:
+    w.varint(header.timestamp)
+    w.hash(header.prev_block_hash)
+    w.hash(header.tx_hash)
+    w.varint(header.nonce)
+    w.hash(header.hash)
+    w.varint(header.target_bits)
+    w.varint(header.height)
+
+
+def read_header(r: Reader) -> BlockHeader:
+    return BlockHeader(
+        r.varint(), r.hash(), r.hash(), r.varint(), r.hash(), r.varint(), r.varint()
+    )
+
+
+def write_proof(w: Writer, proof: tuple[BlockHeader, MerkleProof]) -> None:
+    header, merkle_proof = proof
+    write_header(w, header)
+    w.hash(merkle_proof.txid)
+    w.varint(merkle_proof.index)
+    w.varint(len(merkle_proof.siblings))
+    for sibling in merkle_proof.siblings:
+        w.varbytes(sibling)
+
+
+def read_proof(r: Reader) -> tuple[BlockHeader, MerkleProof]:
+    header = read_header(r)
+    txid = r.hash()
+    index = r.varint()
+    siblings = [bytes(r.varbytes()) for _ in range(r.varint())]
+    return header, MerkleProof(txid, index, siblings)
+
+
+def _encoder(write):
+    def encode(obj) -> bytes:
+        w = Writer()
+        w.buf.append(FORMAT_VERSION)
+        write(w, obj)
+        return w.getvalue()
+
+    return encode
+
+
+def _decoder(read):
+    def decode(data: Buffer):
+        r = Reader(data)
+        r.version()
+        obj = read(r)
+        if not r.done():
+            raise BitcoinException("Trailing data after record.")
+        return obj
+
+    return decode
+
+
+def _write_list(write):
+    def write_list(w: Writer, objs: list) -> None:
+        w.varint(len(objs))
+        for obj in objs:
+            write(w, obj)
+
+    return write_list
+
+
+def _read_list(read):
+    def read_list(r: Reader) -> list:
+        return [read(r) for _ in range(r.varint())]
+
+    return read_list
+
+
+encode_output = _encoder(write_output)
+decode_output = _decoder(read_output)
+encode_transaction = _encoder(write_transaction)
+decode_transaction = _decoder(read_transaction)
+encode_block = _encoder(write_block)
+decode_block = _decoder(read_block)
+encode_transactions = _encoder(_write_list(write_transaction))
+decode_transactions = _decoder(_read_list(read_transaction))
+encode_headers = _encoder(_write_list(write_header))
+decode_headers = _decoder(_read_list(read_header))
+encode_blocks = _encoder(_write_list(write_block))
+decode_blocks = _decoder(_read_list(read_block))
+encode_proof = _encoder(write_proof)
+decode_proof = _decoder(read_proof)
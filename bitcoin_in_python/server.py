@@ -1,86 +1,405 @@
-import pickle
-import socket
-from dataclasses import dataclass
+import asyncio
+import json
+import multiprocessing
+import signal
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
 
-from bitcoin_in_python.block import blockchain
+from bitcoin_in_python import metrics
+from bitcoin_in_python.block import Block, blockchain
+from bitcoin_in_python.exception import BitcoinException
+from bitcoin_in_python.mempool import Mempool
+from bitcoin_in_python.protocol import decode_text, read_frame, write_frame
+from bitcoin_in_python.serialization import (
+    decode_block,
+    decode_transactions,
+    encode_blocks,
+    encode_headers,
+    encode_proof,
+)
+from bitcoin_in_python.sigverify import verify_transactions
+from bitcoin_in_python.storage import misc_db
+from bitcoin_in_python.sync import (
+    BLOCKS_PER_REQUEST,
+    GENESIS_PREV_HASH,
+    HEADERS_PER_REQUEST,
+    check_block,
+    check_headers,
+    decode_range,
+)
 from bitcoin_in_python.transaction import Transaction
 from bitcoin_in_python.wallet import Wallet
 
+COMMANDS = (
+    'getheaders',
+    'getblocks',
+    'send',
+    'waittx',
+    'block',
+    'getproof',
+    'mempool',
+    'stats',
+)
+WAIT_SECONDS = 10  # waittx 至多等待这么久, 之后回复 pending, 客户端再发一次
+RESTART_DELAY = 0.2  # 任务被取消后稍等再生成新模板, 让同时到达的一批交易一起进入区块
+# 任务至少运行这么久才会因为更好的模板被取消. 交易不断到达时, 每个任务仍然有机会挖出区块
+MIN_JOB_SECONDS = 1
 
-@dataclass
-class Version:
-    height: int
-    address_from: str
+_command_seconds = {
+    command: metrics.histogram(f"network.command.{command}_seconds") for command in COMMANDS
+}
+_mempool_transactions = metrics.gauge("mempool.transactions")
+_mempool_bytes = metrics.gauge("mempool.bytes")
+_jobs_started = metrics.counter("mining.jobs_started")
+_jobs_cancelled = metrics.counter("mining.jobs_cancelled")
+_stale_blocks = metrics.counter("mining.stale_blocks")
+_mining_errors = metrics.counter("mining.errors")
+
+_stop = None  # 挖矿进程中的停止信号, 在创建进程时传入
 
 
-def send_data(command: str, data: bytes, conn: socket.socket) -> None:
-    assert len(command) <= 12
-    length = len(data)
-    data = length.to_bytes(4, byteorder='big') + command.ljust(12).encode() + data
-    conn.sendall(data)
+def _init_mining_process(stop) -> None:
+    global _stop
+    _stop = stop
 
 
-def recv_data(conn: socket.socket) -> tuple[str, bytes]:
-    metadata = conn.recv(16)
-    length = int.from_bytes(metadata[:4], byteorder='big')
-    command = metadata[4:].decode().strip()  # may contain padding
-    received = 0
-    data = b''
-    while received < length:
-        data += conn.recv(4096)
-        received += len(data)
-    return command, data
+def _mine_block(txs: list[Transaction], prev_block_hash: str, workers: int) -> Optional[Block]:
+    """在挖矿进程中运行, 节点 set 停止信号后返回 None."""
+    return Block.new_block(txs, prev_block_hash, workers, _stop)
 
 
-pending_transactions = []
+@dataclass
+class MiningJob:
+    txids: set[str]
+    prev_block_hash: str
+    started: float = field(default_factory=time.monotonic)
+    restarting: bool = False  # 已经安排了取消
+
 
+@dataclass
+class Node:
+    """
+    基于 asyncio 的挖矿节点, 可以同时服务多个连接, 每个连接可以连续发送多条命令.
+    收到的交易验证后放入交易池就立即回复, 由后台的 mining_loop 打包:
+    交易池中至少有 min_block_txs 笔交易时开始挖矿,
+    每个区块至多包含 max_block_txs 笔, 共 max_block_bytes 字节的交易.
+    挖矿和收到的交易, 区块的签名验证都在单独的进程中进行, 不会阻塞事件循环.
+    有了更好的模板 (更多交易) 或者收到其他节点的区块时, 取消当前任务重新开始.
+    """
 
-def command_handler(command: str, data: bytes, conn: socket.socket, wallet: Wallet):
-    print(f"Received command {command}")
-    if command == 'pull chain':
-        # Receiving Version object
-        version = pickle.loads(data)
-        if len(blockchain) > version.height:
-            blocks = blockchain.top_n_blocks(len(blockchain) - version.height)
+    port: int
+    wallet: Wallet
+    workers: int = 1
+    min_block_txs: int = 2
+    max_block_txs: int = 1000
+    max_block_bytes: int = 1024 * 1024
+    mempool: Mempool = field(default_factory=Mempool)
+
+    def __post_init__(self):
+        # 用 spawn 而不是 fork 创建挖矿进程: fork 出的子进程会继承监听 socket 和客户端连接,
+        # 节点被 kill 后它会一直占用端口
+        ctx = multiprocessing.get_context("spawn")
+        self.mining_stop = ctx.Event()
+        self.mining_executor = self.new_mining_executor()
+        # 签名验证与链的状态无关, 交给另一个进程池, 不用排在挖矿任务后面
+        self.verify_executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+        self.job: Optional[MiningJob] = None
+        # txid -> 等待它被确认的 waittx 请求
+        self.waiters: dict[str, list[asyncio.Future]] = {}
+
+    def new_mining_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_mining_process,
+            initargs=(self.mining_stop,),
+        )
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        print('Connected by', writer.get_extra_info('peername'))
+        try:
+            while True:
+                try:
+                    command, data = await read_frame(reader)
+                except asyncio.IncompleteReadError:
+                    break  # 对方关闭了连接
+                start = metrics.now()
+                await self.handle_command(command, data, writer)
+                if command in _command_seconds:
+                    _command_seconds[command].observe_since(start)
+        except BitcoinException as e:
+            # 例如 frame 过长, 之后的数据已经无法解析, 只能断开连接
+            print(f"Dropping connection: {e}")
+            await write_frame('error', str(e).encode(), writer)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_command(
+        self, command: str, data: bytes, writer: asyncio.StreamWriter
+    ) -> None:
+        print(f"Received command {command}")
+        if command == 'getheaders':
+            start, count = decode_range(data)
+            blocks = self.read_blocks(start, min(count, HEADERS_PER_REQUEST))
+            await write_frame('headers', encode_headers([b.header() for b in blocks]), writer)
+        elif command == 'getblocks':
+            start, count = decode_range(data)
+            blocks = self.read_blocks(start, min(count, BLOCKS_PER_REQUEST))
             print(f"Sending {len(blocks)} block(s)")
-            send_data('reply', pickle.dumps(blocks), conn)
-    if command == 'send':
-        global pending_transactions
-        # Receiving a list of transactions
-        txs: list[Transaction] = pickle.loads(data)
-        print(f"Receiving {len(txs)} transaction(s).")
-        pending_transactions += txs
-        if len(pending_transactions) >= 2:
-            print("Mining a new block..")
-            block = blockchain.create_block(pending_transactions, wallet.get_address())
-            pending_transactions.clear()
-
-            # Return the new block
-            print(f"Sending a new block..")
-            send_data('reply', pickle.dumps(block), conn)
+            await write_frame('blocks', encode_blocks(blocks), writer)
+        elif command == 'send':
+            # Receiving a list of transactions
+            txs: list[Transaction] = decode_transactions(data)
+            print(f"Receiving {len(txs)} transaction(s).")
+            try:
+                await self.submit(txs)
+            except BitcoinException as e:
+                print(f"Rejecting transaction: {e}")
+                await write_frame('error', str(e).encode(), writer)
+                return
+            # 不等待挖矿, 客户端可以用 waittx 等待交易被确认
+            print(f"{len(self.mempool)} pending transaction(s)")
+            await write_frame('accepted', b'', writer)
+        elif command == 'waittx':
+            try:
+                txid = decode_text(data)
+            except BitcoinException as e:
+                await write_frame('error', str(e).encode(), writer)
+                return
+            if txid in self.mempool:
+                confirmed = await self.wait_for_transaction(txid, WAIT_SECONDS)
+                if confirmed is None:
+                    await write_frame('pending', b'', writer)
+                    return
+                if not confirmed:
+                    message = f"Transaction {txid} was dropped from the mempool"
+                    await write_frame('error', message.encode(), writer)
+                    return
+            try:
+                proof = blockchain.prove_transaction(txid)
+            except BitcoinException as e:
+                await write_frame('error', str(e).encode(), writer)
+            else:
+                await write_frame('confirmed', encode_proof(proof), writer)
+        elif command == 'block':
+            try:
+                await self.receive_block(decode_block(data))
+            except BitcoinException as e:
+                print(f"Rejecting block: {e}")
+                await write_frame('error', str(e).encode(), writer)
+            else:
+                await write_frame('accepted', b'', writer)
+        elif command == 'getproof':
+            try:
+                proof = blockchain.prove_transaction(decode_text(data))
+            except BitcoinException as e:
+                await write_frame('error', str(e).encode(), writer)
+            else:
+                await write_frame('proof', encode_proof(proof), writer)
+        elif command == 'mempool':
+            await write_frame('mempool', json.dumps(self.mempool.stats()).encode(), writer)
+        elif command == 'stats':
+            _mempool_transactions.set(len(self.mempool))
+            _mempool_bytes.set(self.mempool.bytes)
+            snapshot = metrics.snapshot()
+            snapshot["enabled"] = metrics.is_enabled()
+            await write_frame('stats', json.dumps(snapshot).encode(), writer)
         else:
-            print("Only one pending transaction, waiting for another..")
-            send_data('empty', b'', conn)
+            await write_frame('error', f"Unknown command {command}".encode(), writer)
+
+    def tip(self) -> str:
+        """链顶的区块哈希. 还没有链时为 GENESIS_PREV_HASH, 收到或挖出的区块就是创世区块."""
+        return misc_db.get('last_block_hash', GENESIS_PREV_HASH)
 
+    def read_blocks(self, start: int, count: int) -> list[Block]:
+        # 超出链顶的部分返回空, 对方据此知道已经同步完成
+        end = min(start + count, len(blockchain))
+        return blockchain.blocks_at(range(start, end))
 
-def create_client_socket(port: int):
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.connect(('localhost', port))
-    return s
+    async def verify_signatures(self, txs: list[Transaction]) -> bool:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.verify_executor, verify_transactions, txs, 1)
 
+    async def submit(self, txs: list[Transaction]) -> None:
+        """
+        验证交易并加入交易池, 失败时抛出 BitcoinException.
+        有无效签名时整批都不加入; 其他检查失败时, 之前的交易仍然留在交易池中.
+        """
+        if not await self.verify_signatures(txs):
+            raise BitcoinException("Invalid signature in the submitted transactions")
+        try:
+            for tx in txs:
+                self.mempool.add(tx, verify=False)
+        finally:
+            self.settle_waiters(set())  # 加入交易时可能淘汰了其他交易
+            self.schedule()
 
-def create_server(port: int, wallet: Wallet):
+    def schedule(self) -> None:
+        """
+        交易池变化后调用. 新模板比正在挖的区块包含更多交易时, 取消当前任务,
+        但任务至少运行 MIN_JOB_SECONDS 秒, 在那之前到达的交易等到那时一起处理.
+        """
+        self.new_work.set()
+        job = self.job
+        if job is None or job.restarting or self.mining_stop.is_set():
+            return
+        txs = self.mempool.block_template(self.max_block_txs, self.max_block_bytes)
+        if len(txs) <= len(job.txids):
+            return
+        job.restarting = True
+        delay = job.started + MIN_JOB_SECONDS - time.monotonic()
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self.restart_job, job)
+        else:
+            self.restart_job(job)
+
+    def restart_job(self, job: MiningJob) -> None:
+        if self.job is job and not self.mining_stop.is_set():
+            print("Restarting mining with a better template..")
+            _jobs_cancelled.inc()
+            self.mining_stop.set()
+
+    async def receive_block(self, block: Block) -> None:
+        """
+        其他节点挖出的区块. 和同步到的区块一样先检查区块头和签名,
+        再由 add_block 对照链状态检查 (输出未被花费, 所有者, 金额, 接在链顶之后).
+        加入链中之后才取消当前任务.
+        """
+        header = block.header()
+        check_headers([header], self.tip(), len(blockchain))
+        check_block(block, header)
+        if not await self.verify_signatures(block.transactions):
+            raise BitcoinException(f"Invalid signature in block {block.hash}")
+        self.connect_block(block)
+        if self.job is not None:
+            _jobs_cancelled.inc()
+            self.mining_stop.set()
+
+    def connect_block(self, block: Block) -> None:
+        blockchain.add_block(block)
+        self.mempool.remove_block(block)
+        self.settle_waiters({tx.id for tx in block.transactions})
+        self.new_work.set()
+
+    def settle_waiters(self, confirmed: set[str]) -> None:
+        """通知等待确认的请求: 交易在 confirmed 中时结果为 True, 不在交易池中了为 False."""
+        for txid in list(self.waiters):
+            if txid in confirmed:
+                result = True
+            elif txid not in self.mempool:
+                result = False  # 被淘汰, 或者与区块中的交易冲突
+            else:
+                continue
+            for future in self.waiters.pop(txid):
+                if not future.done():
+                    future.set_result(result)
+
+    async def wait_for_transaction(self, txid: str, timeout: float) -> Optional[bool]:
+        """交易被确认时返回 True, 被移出交易池时返回 False, 超时返回 None."""
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(txid, []).append(future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            futures = self.waiters.get(txid, [])
+            if future in futures:
+                futures.remove(future)
+                if not futures:
+                    del self.waiters[txid]
+
+    async def mining_loop(self) -> None:
+        """
+        同一时间只有一个挖矿任务. 每次从交易池生成模板, 挖出的区块仍然接在链顶之后时加入链中.
+        交易池或链顶变化时 new_work 被 set.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.new_work.wait()
+            self.new_work.clear()
+            txs = self.mempool.block_template(self.max_block_txs, self.max_block_bytes)
+            if len(txs) < self.min_block_txs:
+                continue
+            prev_block_hash = self.tip()
+            self.job = MiningJob({tx.id for tx in txs}, prev_block_hash)
+            self.mining_stop.clear()
+            _jobs_started.inc()
+            print(f"Mining a new block with {len(txs)} transaction(s)..")
+            coinbase_tx = Transaction.new_coinbase_transaction(self.wallet.get_address())
+            try:
+                # 挖矿进程中记录的指标 (哈希数, 签名验证等) 随区块一起返回
+                block, mining_metrics = await loop.run_in_executor(
+                    self.mining_executor,
+                    metrics.call_with_metrics,
+                    metrics.is_enabled(),
+                    _mine_block,
+                    [coinbase_tx] + txs,
+                    prev_block_hash,
+                    self.workers,
+                )
+            except BitcoinException as e:
+                print(f"Mining failed: {e}")
+                continue
+            except Exception:
+                # 例如挖矿进程被杀死 (BrokenProcessPool). 换一个进程池, 稍后重新开始
+                traceback.print_exc()
+                _mining_errors.inc()
+                self.mining_executor.shutdown(wait=False, cancel_futures=True)
+                self.mining_executor = self.new_mining_executor()
+                await asyncio.sleep(RESTART_DELAY)
+                self.new_work.set()
+                continue
+            finally:
+                self.job = None
+            metrics.merge(mining_metrics)
+
+            if block is None:
+                await asyncio.sleep(RESTART_DELAY)
+                self.new_work.set()
+            elif block.prev_block_hash != self.tip():
+                # 挖矿期间链顶已经变了 (例如收到了其他节点的区块)
+                print(f"Discarding stale block {block.hash}")
+                _stale_blocks.inc()
+                self.new_work.set()
+            else:
+                print(f"Mined block {block.hash}")
+                try:
+                    self.connect_block(block)
+                except BitcoinException as e:
+                    print(f"Mined block rejected: {e}")
+
+    async def serve(self) -> None:
+        # 需要在事件循环中创建 (Python 3.9 的 Event 会绑定到创建时的事件循环)
+        self.new_work = asyncio.Event()
+        self.verify_executor.submit(int)  # 提前启动验证进程, 第一笔交易不用等它启动
+        self.mining_task = asyncio.create_task(self.mining_loop())
+        server = await asyncio.start_server(self.handle_connection, 'localhost', self.port)
+        print(f"Starting node at localhost:{self.port} with {self.workers} mining worker(s)")
+        async with server:
+            await server.serve_forever()
+
+
+def create_server(port: int, wallet: Wallet, workers: int = 1, **options):
     """
     自定义一种协议, 前 4 字节为长度, 接 12 字节为命令名称, 接下来为数据.
-    每个 socket 在通信一次后即关闭 (和 HTTP 类似)
+    每个连接可以发送多条命令, 每条命令都会收到一条回复.
     """
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind(('localhost', port))
-        print(f"Starting node at localhost:{port}")
-        s.listen(5)
-        while True:
-            conn, addr = s.accept()
-            with conn:
-                print('Connected by', addr)
-                command, data = recv_data(conn)
-                command_handler(command, data, conn, wallet)
+    node = Node(port, wallet, workers, **options)
+    # 收到 SIGTERM 时和 Ctrl-C 一样退出, 以便关闭挖矿进程
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(node.serve())
+    except KeyboardInterrupt:
+        print("Shutting down node..")
+    finally:
+        node.mining_stop.set()
+        node.mining_executor.shutdown(wait=False, cancel_futures=True)
+        node.verify_executor.shutdown(wait=False, cancel_futures=True)
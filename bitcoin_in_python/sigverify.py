@@ -0,0 +1,122 @@
+"""
+批量验证交易签名.
+
+每个公钥只解析一次 (LRU 缓存), 签名检查被分成若干组, 在进程池中并行执行,
+任意一组失败后取消其余尚未开始的组.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import lru_cache
+from typing import TYPE_CHECKING, Iterable, Optional
+
+from Crypto.PublicKey import ECC
+from Crypto.Signature import DSS
+
+from bitcoin_in_python import metrics
+
+if TYPE_CHECKING:
+    from bitcoin_in_python.transaction import Transaction
+
+# (签名摘要, 签名, PEM 格式的公钥)
+SignatureCheck = tuple[bytes, bytes, str]
+
+PARALLEL_THRESHOLD = 64  # 签名数量少于此值时直接在当前进程中验证, 省去进程间通信
+CHUNKS_PER_WORKER = 4
+
+_checked = metrics.counter("validation.signatures")
+_failures = metrics.counter("validation.failures")
+_verify_seconds = metrics.histogram("validation.verify_seconds")
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+
+
+class Prehashed:
+    """
+    DSS 要求传入一个哈希对象, 但实际只会用到 oid 和 digest().
+    用它包装已经算好的 SHA-256 摘要, 避免再哈希一次.
+    """
+
+    oid = "2.16.840.1.101.3.4.2.1"  # SHA-256
+    digest_size = 32
+
+    def __init__(self, digest: bytes):
+        self._digest = digest
+
+    def digest(self) -> bytes:
+        return self._digest
+
+
+@lru_cache(maxsize=4096)
+def import_public_key(pem: str) -> ECC.EccKey:
+    return ECC.import_key(pem)
+
+
+def verify_signature(sighash: bytes, signature: bytes, pubkey: str) -> bool:
+    try:
+        verifier = DSS.new(import_public_key(pubkey), "fips-186-3")
+        verifier.verify(Prehashed(sighash), signature)
+    except ValueError:
+        return False
+    return True
+
+
+def _verify_chunk(checks: list[SignatureCheck]) -> bool:
+    return all(verify_signature(*check) for check in checks)
+
+
+def get_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    验证用的进程池, 在各次验证之间复用. sync 也用它并行检查整批区块.
+    用 spawn 创建进程: 创建时可能已经有下载线程和打开的 sqlite 连接, fork 它们并不安全.
+    """
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        _pool_workers = workers
+    return _pool
+
+
+def verify_checks(checks: list[SignatureCheck], workers: Optional[int] = None) -> bool:
+    """所有签名都有效时返回 True. workers 默认为 CPU 数量."""
+    start = metrics.now()
+    _checked.inc(len(checks))
+    valid = _verify_parallel(checks, workers or os.cpu_count() or 1)
+    if not valid:
+        _failures.inc()
+    _verify_seconds.observe_since(start)
+    return valid
+
+
+def _verify_parallel(checks: list[SignatureCheck], workers: int) -> bool:
+    if workers <= 1 or len(checks) < PARALLEL_THRESHOLD:
+        return _verify_chunk(checks)
+
+    n_chunks = workers * CHUNKS_PER_WORKER
+    size = -(-len(checks) // n_chunks)
+    pool = get_pool(workers)
+    pending = {
+        pool.submit(_verify_chunk, checks[i : i + size]) for i in range(0, len(checks), size)
+    }
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        if not all(future.result() for future in done):
+            for future in pending:
+                future.cancel()
+            return False
+    return True
+
+
+def verify_transactions(txs: Iterable["Transaction"], workers: Optional[int] = None) -> bool:
+    """验证一批交易中所有 input 的签名, coinbase 交易不需要验证."""
+    checks = []
+    for tx in txs:
+        if not tx.is_coinbase():
+            checks += tx.signature_checks()
+    return verify_checks(checks, workers)
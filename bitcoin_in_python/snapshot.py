@@ -0,0 +1,175 @@
+"""
+UTXO 快照: 把 UTXO 集合和链顶写到一个文件中, 新节点加载后只需要同步快照之后的区块.
+
+文件格式, 长度都是 4 字节大端整数:
+
+    MAGIC
+    长度 + 头部记录: 格式版本, 链顶哈希, 链顶高度, UTXO 个数
+    长度 + 一批 UTXO: 每个是 txid, vout_index, 编码后的输出 (与 utxo_db 中存的相同)
+    ...
+    0 (结束标记)
+    前面所有字节的 SHA-256
+
+读写都是分批的流式 I/O, 内存中只保留一批 UTXO. 加载前先校验整个文件, 加载在一个事务中进行.
+加载快照的节点没有快照之前的区块, misc_db['base_height'] 记录本地保存的最低区块高度.
+"""
+
+import struct
+from hashlib import sha256
+from pathlib import Path
+from typing import BinaryIO
+
+from bitcoin_in_python.block import BlockChain, address_key, outpoint
+from bitcoin_in_python.exception import BitcoinException
+from bitcoin_in_python.serialization import (
+    FORMAT_VERSION,
+    Reader,
+    Writer,
+    decode_output,
+)
+from bitcoin_in_python.storage import (
+    address_index_db,
+    db,
+    height_db,
+    local_spent_db,
+    misc_db,
+    tx_index_db,
+    undo_db,
+    utxo_db,
+)
+
+MAGIC = b"BTCUTXO\n"
+BATCH = 10_000  # 每批的 UTXO 个数
+CHUNK_BYTES = 1024 * 1024  # 校验文件时每次读取的字节数
+_LENGTH = struct.Struct(">I")
+
+
+class _HashingFile:
+    """写入时同时计算校验和."""
+
+    def __init__(self, f: BinaryIO):
+        self.f = f
+        self.sha = sha256()
+
+    def write(self, data: bytes) -> None:
+        self.sha.update(data)
+        self.f.write(data)
+
+    def write_record(self, data: bytes) -> None:
+        self.write(_LENGTH.pack(len(data)))
+        self.write(data)
+
+
+def _read(f: BinaryIO, n: int) -> bytes:
+    data = f.read(n)
+    if len(data) != n:
+        raise BitcoinException("Snapshot file is truncated")
+    return data
+
+
+def _read_record(f: BinaryIO) -> bytes:
+    (length,) = _LENGTH.unpack(_read(f, _LENGTH.size))
+    return _read(f, length)
+
+
+def _verify_checksum(path: Path) -> None:
+    size = path.stat().st_size - sha256().digest_size
+    if size < len(MAGIC):
+        raise BitcoinException(f"{path} is not a UTXO snapshot")
+    sha = sha256()
+    with open(path, "rb") as f:
+        while size:
+            chunk = f.read(min(size, CHUNK_BYTES))
+            sha.update(chunk)
+            size -= len(chunk)
+        if f.read() != sha.digest():
+            raise BitcoinException("Snapshot checksum mismatch")
+
+
+def _flush(out: _HashingFile, w: Writer) -> Writer:
+    out.write_record(w.getvalue())
+    return Writer()
+
+
+def dump_utxo(path: Path, batch: int = BATCH) -> int:
+    """把 UTXO 集合和链顶写到 path, 返回 UTXO 的个数."""
+    tmp = path.with_name(path.name + ".tmp")
+    # 在事务中读取, 保证 UTXO 集合和链顶是一致的
+    with db.transaction():
+        tip_height = len(BlockChain()) - 1
+        if tip_height < 0:
+            raise BitcoinException("No blockchain to snapshot")
+        with open(tmp, "wb") as f:
+            count = _write(f, misc_db['last_block_hash'], tip_height, batch)
+    tmp.replace(path)
+    return count
+
+
+def _write(f: BinaryIO, tip_hash: str, tip_height: int, batch: int) -> int:
+    count = len(utxo_db)
+    out = _HashingFile(f)
+    out.write(MAGIC)
+    header = Writer()
+    header.buf.append(FORMAT_VERSION)
+    header.hash(tip_hash)
+    header.varint(tip_height)
+    header.varint(count)
+    out.write_record(header.getvalue())
+
+    w = Writer()
+    n = 0
+    for key, value in utxo_db.raw_items(batch):
+        txid, index = key.rsplit(":", 1)
+        w.hash(txid)
+        w.varint(int(index))
+        w.varbytes(value)
+        n += 1
+        if n % batch == 0:
+            w = _flush(out, w)
+    if w.buf:
+        _flush(out, w)
+    out.write(_LENGTH.pack(0))
+    f.write(out.sha.digest())
+    return count
+
+
+def load_utxo(path: Path) -> tuple[str, int, int]:
+    """
+    在没有区块链的节点上加载快照, 返回 (链顶哈希, 链顶高度, UTXO 个数).
+    之后从快照的链顶开始同步.
+    """
+    _verify_checksum(path)
+    with db.transaction(), open(path, "rb") as f:
+        if len(BlockChain()):
+            raise BitcoinException("A blockchain already exists!")
+        if f.read(len(MAGIC)) != MAGIC:
+            raise BitcoinException(f"{path} is not a UTXO snapshot")
+        r = Reader(_read_record(f))
+        r.version()
+        tip_hash, tip_height, count = r.hash(), r.varint(), r.varint()
+
+        tables = (utxo_db, address_index_db, height_db, tx_index_db, undo_db, local_spent_db)
+        for table in tables:
+            table.clear()
+        empty = address_index_db.encode(None)
+        loaded = 0
+        while record := _read_record(f):
+            r = Reader(record)
+            utxos = []
+            index = []
+            while not r.done():
+                key = outpoint(r.hash(), r.varint())
+                value = bytes(r.varbytes())
+                utxos.append((key, value))
+                index.append((address_key(decode_output(value).pubkey_hash, key), empty))
+            utxo_db.put_many_raw(utxos)
+            address_index_db.put_many_raw(index)
+            loaded += len(utxos)
+
+        if loaded != count:
+            raise BitcoinException(f"Snapshot has {loaded} outputs, header says {count}")
+
+        misc_db['last_block_hash'] = tip_hash
+        misc_db['tip_height'] = tip_height
+        misc_db['base_height'] = tip_height + 1
+    return tip_hash, tip_height, count
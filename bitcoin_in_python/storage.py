@@ -1,24 +1,634 @@
+import mmap
 import os
+import pickle
+import sqlite3
+import struct
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator, Optional
 
-from sqlitedict import SqliteDict
+from bitcoin_in_python import metrics
+from bitcoin_in_python.exception import BitcoinException
 
 if TYPE_CHECKING:
-    from block import Block
-    from transaction import Transaction
+    from bitcoin_in_python.block import Block
+    from bitcoin_in_python.transaction import TXOutput
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 # BASE_DIR = Path(__file__).resolve().parent.parent / "data"
 BASE_DIR = Path(os.getcwd())
 
+BLOCK_CACHE_BYTES = 32 * 1024 * 1024  # 内存中缓存的区块, 按编码后的大小计算
+BLOCK_FILE_BYTES = 128 * 1024 * 1024  # 每个区块文件的大小上限, 超过后换一个新文件
+# 区块存储的后端: "files" 为 BlockStore, "sqlite" 为以前存在 blockchain 表中的做法
+BLOCK_STORE = os.environ.get("BITCOIN_BLOCK_STORE", "files")
+_MAX_VARIABLES = 500  # 一条 SQL 中参数的个数, 旧版本的 sqlite 限制为 999
+_CREATE_TABLE = 'CREATE TABLE IF NOT EXISTS "{}" (key TEXT PRIMARY KEY, value BLOB)'
+
+
+def _encode_block(block: 'Block') -> bytes:
+    from bitcoin_in_python.serialization import encode_block
+
+    return encode_block(block)
+
+
+def _decode_block(data: bytes) -> 'Block':
+    from bitcoin_in_python.serialization import decode_block
+
+    return decode_block(data)
+
+
+def _decode_legacy_block(data: bytes) -> 'Block':
+    """
+    blockchain 表中的区块. 更早的版本由 SqliteDict 用 pickle 保存, 之后为 serialization 的格式.
+    pickle 的数据以 PROTO 操作码 0x80 开头, 而二进制格式以版本号开头, 两者不会混淆.
+    """
+    if data[:1] == pickle.PROTO:
+        return _decode_pickle(data)
+    return _decode_block(data)
+
+
+def _encode_output(output: 'TXOutput') -> bytes:
+    from bitcoin_in_python.serialization import encode_output
+
+    return encode_output(output)
+
+
+def _decode_output(data: bytes) -> 'TXOutput':
+    from bitcoin_in_python.serialization import decode_output
+
+    return decode_output(data)
+
+
+def _encode_pickle(obj: Any) -> bytes:
+    return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _decode_pickle(data: bytes) -> Any:
+    return pickle.loads(data)
+
+
+class Database:
+    """
+    所有的表共用一个 sqlite 连接, 这样多张表的写入可以放在同一个事务中提交.
+    不在事务中时, 每次写入都会立即提交.
+    连接在第一次访问时才打开, 同时创建所有已注册的表, 不访问数据库的命令不会创建数据库文件.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._tables: list[str] = []
+        # 事务进行期间, 其他线程的读写需要等待
+        self.lock = threading.RLock()
+        self._depth = 0
+        self._commit_seconds = metrics.histogram("storage.commit_seconds")
+        self._rollbacks = metrics.counter("storage.rollbacks")
+        # 回滚后调用, 用于丢弃缓存中未提交的数据
+        self.rollback_hooks: list[Callable[[], None]] = []
+        # 提交前调用, 例如把索引指向的文件数据写入磁盘
+        self.precommit_hooks: list[Callable[[], None]] = []
+        # 提交后调用
+        self.commit_hooks: list[Callable[[], None]] = []
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            with self.lock:
+                if self._connection is None:
+                    # isolation_level=None: 由我们自己决定何时 BEGIN/COMMIT
+                    connection = sqlite3.connect(
+                        self.path, isolation_level=None, check_same_thread=False
+                    )
+                    # 每次 COMMIT 都等待数据写入磁盘, 断电后已提交的事务不会丢失.
+                    # 这是 sqlite 的默认值, 明确写出来, 区块文件的 fsync 依赖它
+                    connection.execute("PRAGMA synchronous = FULL")
+                    for name in self._tables:
+                        connection.execute(_CREATE_TABLE.format(name))
+                    self._connection = connection
+        return self._connection
+
+    def register_table(self, name: str) -> None:
+        self._tables.append(name)
+        if self._connection is not None:
+            self._connection.execute(_CREATE_TABLE.format(name))
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """
+        在 with 块中的所有写入会在退出时一次性提交, 出现异常则全部回滚.
+        可以嵌套, 只有最外层的事务会真正提交.
+        """
+        with self.lock:
+            if self._depth:
+                self._depth += 1
+                try:
+                    yield
+                finally:
+                    self._depth -= 1
+                return
+
+            self.connection.execute("BEGIN IMMEDIATE")
+            self._depth = 1
+            try:
+                yield
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                self._rollbacks.inc()
+                for hook in self.rollback_hooks:
+                    hook()
+                raise
+            else:
+                start = metrics.now()
+                for hook in self.precommit_hooks:
+                    hook()
+                self.connection.execute("COMMIT")
+                self._commit_seconds.observe_since(start)
+                for hook in self.commit_hooks:
+                    hook()
+            finally:
+                self._depth = 0
+
+    @property
+    def in_transaction(self) -> bool:
+        return self._depth > 0
+
+    def execute(self, sql: str, params=()) -> list[tuple]:
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+
+class Table:
+    """
+    类似 dict 的 sqlite 表, 表结构与 SqliteDict 相同: (key TEXT PRIMARY KEY, value BLOB).
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        name: str,
+        encode: Callable[[Any], bytes] = _encode_pickle,
+        decode: Callable[[bytes], Any] = _decode_pickle,
+    ):
+        self.db = db
+        self.name = name
+        self.encode = encode
+        self.decode = decode
+        self._reads = metrics.counter(f"storage.{name}.reads")
+        self._writes = metrics.counter(f"storage.{name}.writes")
+        # 不在事务中时, 写入的耗时包括提交
+        self._write_seconds = metrics.histogram(f"storage.{name}.write_seconds")
+        db.register_table(name)
+
+    def _read(self, key: str) -> bytes:
+        self._reads.inc()
+        rows = self.db.execute(f'SELECT value FROM "{self.name}" WHERE key = ?', (key,))
+        if not rows:
+            raise KeyError(key)
+        return rows[0][0]
+
+    def _read_many(self, keys: list[str]) -> Iterator[tuple[str, bytes]]:
+        for i in range(0, len(keys), _MAX_VARIABLES):
+            chunk = keys[i : i + _MAX_VARIABLES]
+            self._reads.inc(len(chunk))
+            placeholders = ", ".join("?" * len(chunk))
+            rows = self.db.execute(
+                f'SELECT key, value FROM "{self.name}" WHERE key IN ({placeholders})', chunk
+            )
+            for key, value in rows:
+                yield key, value
+
+    def _write(self, key: str, data: bytes) -> None:
+        start = metrics.now()
+        self.db.execute(f'REPLACE INTO "{self.name}" (key, value) VALUES (?, ?)', (key, data))
+        self._writes.inc()
+        self._write_seconds.observe_since(start)
+
+    def __getitem__(self, key: str) -> Any:
+        return self.decode(self._read(key))
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self._write(key, self.encode(value))
+
+    def __delitem__(self, key: str) -> None:
+        with self.db.lock:
+            if key not in self:
+                raise KeyError(key)
+            self.db.execute(f'DELETE FROM "{self.name}" WHERE key = ?', (key,))
+            self._writes.inc()
+
+    def __contains__(self, key: str) -> bool:
+        return bool(self.db.execute(f'SELECT 1 FROM "{self.name}" WHERE key = ?', (key,)))
+
+    def __len__(self) -> int:
+        return self.db.execute(f'SELECT COUNT(*) FROM "{self.name}"')[0][0]
+
+    def __iter__(self) -> Iterator[str]:
+        return self.keys()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key: str) -> Any:
+        with self.db.lock:
+            value = self[key]
+            self.db.execute(f'DELETE FROM "{self.name}" WHERE key = ?', (key,))
+            self._writes.inc()
+            return value
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, Any]:
+        """一次查询读取多个键, 不存在的键不会出现在结果中."""
+        return {key: self.decode(data) for key, data in self._read_many(list(keys))}
+
+    def raw_items(self, batch: int = 1000) -> Iterator[tuple[str, bytes]]:
+        """
+        按 rowid 分批读取未解码的键值对, 每次只在内存中保留 batch 行.
+        应当在事务中调用, 否则分批读取之间的写入可能被读到一半.
+        """
+        rowid = 0
+        while True:
+            rows = self.db.execute(
+                f'SELECT rowid, key, value FROM "{self.name}" '
+                'WHERE rowid > ? ORDER BY rowid LIMIT ?',
+                (rowid, batch),
+            )
+            if not rows:
+                return
+            self._reads.inc(len(rows))
+            for _, key, value in rows:
+                yield key, value
+            rowid = rows[-1][0]
+
+    def put_many_raw(self, items: list[tuple[str, bytes]]) -> None:
+        """一条 executemany 写入多个已经编码的值."""
+        with self.db.lock:
+            self.db.connection.executemany(
+                f'REPLACE INTO "{self.name}" (key, value) VALUES (?, ?)', items
+            )
+        self._writes.inc(len(items))
+
+    def keys(self) -> Iterator[str]:
+        for (key,) in self.db.execute(f'SELECT key FROM "{self.name}" ORDER BY rowid'):
+            yield key
+
+    def keys_with_prefix(self, prefix: str) -> list[str]:
+        """以 prefix 开头的所有键, 按键排序. 是主键上的范围查询, 不会扫描整张表."""
+        # 比所有以 prefix 开头的字符串都大的最小字符串
+        end = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        rows = self.db.execute(
+            f'SELECT key FROM "{self.name}" WHERE key >= ? AND key < ? ORDER BY key',
+            (prefix, end),
+        )
+        self._reads.inc(len(rows))
+        return [key for (key,) in rows]
+
+    def values(self) -> Iterator[Any]:
+        for (value,) in self.db.execute(f'SELECT value FROM "{self.name}" ORDER BY rowid'):
+            yield self.decode(value)
+
+    def items(self) -> Iterator[tuple[str, Any]]:
+        for key, value in self.db.execute(
+            f'SELECT key, value FROM "{self.name}" ORDER BY rowid'
+        ):
+            yield key, self.decode(value)
+
+    def clear(self) -> None:
+        self.db.execute(f'DELETE FROM "{self.name}"')
+
+
+class CachedTable(Table):
+    """
+    在 Table 前面加一层 LRU 缓存, 保存解码后的对象, 总大小 (按编码后的字节数计算) 不超过 max_bytes.
+    写入时同时更新缓存, 事务回滚时清空缓存, 以免留下没有提交的数据.
+    缓存中的对象是共享的, 取出后不要修改.
+    sync 的下载线程和 peers 的线程也会读取, 对缓存的每次操作都持有 _lock.
+    读写数据库时不持有 _lock, 以免与 db.lock 互相等待.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        name: str,
+        encode: Callable[[Any], bytes] = _encode_pickle,
+        decode: Callable[[bytes], Any] = _decode_pickle,
+        max_bytes: int = BLOCK_CACHE_BYTES,
+    ):
+        super().__init__(db, name, encode, decode)
+        self.max_bytes = max_bytes
+        self._cache: OrderedDict[str, tuple[Any, int]] = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+        self._hits = metrics.counter(f"storage.{name}.cache_hits")
+        self._misses = metrics.counter(f"storage.{name}.cache_misses")
+        db.rollback_hooks.append(self.clear_cache)
+
+    def _get_cached(self, key: str) -> Optional[tuple[Any, int]]:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+            return entry
+
+    def _put(self, key: str, value: Any, size: int) -> None:
+        with self._lock:
+            self._discard_locked(key)
+            if size > self.max_bytes:
+                return
+            self._cache[key] = (value, size)
+            self._cached_bytes += size
+            while self._cached_bytes > self.max_bytes:
+                _, (_, evicted) = self._cache.popitem(last=False)
+                self._cached_bytes -= evicted
+
+    def _discard(self, key: str) -> None:
+        with self._lock:
+            self._discard_locked(key)
+
+    def _discard_locked(self, key: str) -> None:
+        entry = self._cache.pop(key, None)
+        if entry is not None:
+            self._cached_bytes -= entry[1]
+
+    def clear_cache(self) -> None:
+        with self._lock:
+            self._cache.clear()
+            self._cached_bytes = 0
+
+    def __getitem__(self, key: str) -> Any:
+        entry = self._get_cached(key)
+        if entry is not None:
+            self._hits.inc()
+            return entry[0]
+        self._misses.inc()
+        data = self._read(key)
+        value = self.decode(data)
+        self._put(key, value, len(data))
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        data = self.encode(value)
+        self._write(key, data)
+        self._put(key, value, len(data))
+
+    def __delitem__(self, key: str) -> None:
+        self._discard(key)
+        super().__delitem__(key)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            if key in self._cache:
+                return True
+        return super().__contains__(key)
+
+    def pop(self, key: str) -> Any:
+        value = super().pop(key)
+        self._discard(key)
+        return value
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, Any]:
+        result = {}
+        missing = []
+        for key in keys:
+            entry = self._get_cached(key)
+            if entry is None:
+                missing.append(key)
+            else:
+                result[key] = entry[0]
+        self._hits.inc(len(result))
+        self._misses.inc(len(missing))
+        for key, data in self._read_many(missing):
+            value = self.decode(data)
+            self._put(key, value, len(data))
+            result[key] = value
+        return result
+
+    def clear(self) -> None:
+        self.clear_cache()
+        super().clear()
+
+
+class BlockStore(CachedTable):
+    """
+    区块追加写入平坦文件 blk00000.dat, blk00001.dat, ..., 每个文件不超过 max_file_bytes.
+    sqlite 表中只保存索引: 区块哈希 -> (文件编号, 偏移, 长度), 与其他表在同一个事务中提交.
+    读取时用 mmap 映射文件, 把 memoryview 切片直接交给解码器, 不经过 sqlite 也不复制数据.
+
+    文件只追加不修改: 删除区块只删除索引. 事务回滚时把文件截断到事务开始前的位置.
+    提交索引之前 fsync 写入过的文件, 每个事务一次, 断电后索引不会指向没有落盘的数据.
+    文件放在数据库旁边的 {数据库文件名}_blocks 目录中, 第一次写入时才创建.
+    """
+
+    _LOCATION = struct.Struct(">IQI")
+
+    def __init__(
+        self,
+        db: Database,
+        name: str,
+        encode: Callable[[Any], bytes] = _encode_pickle,
+        decode: Callable[[bytes], Any] = _decode_pickle,
+        max_bytes: int = BLOCK_CACHE_BYTES,
+        max_file_bytes: int = BLOCK_FILE_BYTES,
+    ):
+        super().__init__(db, name, encode, decode, max_bytes)
+        self.max_file_bytes = max_file_bytes
+        self._directory: Optional[Path] = None
+        self._file_no = 0
+        self._file: Optional[Any] = None  # 当前追加写入的文件
+        self._maps: dict[int, memoryview] = {}  # 文件编号 -> 整个文件的 mmap 的 memoryview
+        # 事务中第一次写入前的 (文件编号, 文件大小), 回滚时截断到这里
+        self._rollback_to: Optional[tuple[int, int]] = None
+        self._unsynced = False  # 当前文件有还没有 fsync 的数据
+        self._new_file = False  # 创建了新文件, 还要 fsync 目录
+        self._fsyncs = metrics.counter(f"storage.{name}.fsyncs")
+        db.precommit_hooks.append(self._sync)
+        db.rollback_hooks.append(self._truncate)
+        db.commit_hooks.append(self._committed)
+
+    @property
+    def directory(self) -> Path:
+        directory = self.db.path.with_name(self.db.path.stem + "_blocks")
+        if directory != self._directory:
+            # 切换到了另一个数据库
+            self._close()
+            self._directory = directory
+            files = sorted(directory.glob("blk*.dat"))
+            self._file_no = int(files[-1].stem[3:]) if files else 0
+        return directory
+
+    def _path(self, file_no: int) -> Path:
+        return self.directory / f"blk{file_no:05d}.dat"
+
+    def _close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        # 只在回滚或切换数据库时关闭, 数据不再需要
+        self._unsynced = self._new_file = False
+        self._maps.clear()  # 可能还有解码中的 memoryview 引用, 交给垃圾回收关闭
+        self._rollback_to = None
+
+    def _append(self, data: bytes) -> tuple[int, int]:
+        directory = self.directory  # 切换了数据库时会关闭之前的文件
+        if self._file is None:
+            directory.mkdir(exist_ok=True)
+            self._file = open(self._path(self._file_no), "ab")
+        # 其他进程 (例如共用数据库的节点) 可能也追加过, 所以每次都从文件末尾开始.
+        # 写入区块时持有 sqlite 的写锁, 不会有两个进程同时追加
+        offset = self._file.seek(0, os.SEEK_END)
+        if self._rollback_to is None and self.db.in_transaction:
+            self._rollback_to = (self._file_no, offset)
+        if offset and offset + len(data) > self.max_file_bytes:
+            self._sync()
+            self._file.close()
+            self._file_no += 1
+            self._file = open(self._path(self._file_no), "ab")
+            offset = 0
+        self._new_file |= offset == 0
+        self._file.write(data)
+        # 写入操作系统之后 mmap 才能读到
+        self._file.flush()
+        self._unsynced = True
+        if not self.db.in_transaction:
+            self._sync()  # 索引马上就会提交
+        return self._file_no, offset
+
+    def _sync(self) -> None:
+        if self._unsynced and self._file is not None:
+            os.fsync(self._file.fileno())
+            self._fsyncs.inc()
+        if self._new_file and self._directory is not None:
+            fd = os.open(self._directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        self._unsynced = self._new_file = False
+
+    def _committed(self) -> None:
+        self._rollback_to = None
+
+    def _truncate(self) -> None:
+        if self._rollback_to is None:
+            return
+        file_no, size = self._rollback_to
+        self._rollback_to = None
+        self._close()
+        for path in self.directory.glob("blk*.dat"):
+            if int(path.stem[3:]) > file_no:
+                path.unlink()
+        with open(self._path(file_no), "r+b") as f:
+            f.truncate(size)
+        self._file_no = file_no
+
+    def _slice(self, location: bytes) -> memoryview:
+        file_no, offset, length = self._LOCATION.unpack(location)
+        end = offset + length
+        view = self._maps.get(file_no)
+        if view is None or end > len(view):
+            # 当前文件在映射之后又追加了数据, 需要重新映射
+            with open(self._path(file_no), "rb") as f:
+                view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            self._maps[file_no] = view
+        return view[offset:end]
+
+    def _read(self, key: str) -> memoryview:
+        return self._slice(super()._read(key))
+
+    def _read_many(self, keys: list[str]) -> Iterator[tuple[str, memoryview]]:
+        for key, location in list(super()._read_many(keys)):
+            yield key, self._slice(location)
+
+    def _write(self, key: str, data: bytes) -> None:
+        with self.db.lock:
+            file_no, offset = self._append(data)
+            super()._write(key, self._LOCATION.pack(file_no, offset, len(data)))
+
+    def put_many_raw(self, items: list[tuple[str, bytes]]) -> None:
+        with self.db.lock:
+            locations = []
+            for key, data in items:
+                file_no, offset = self._append(data)
+                locations.append((key, self._LOCATION.pack(file_no, offset, len(data))))
+            super().put_many_raw(locations)
+
+    def values(self) -> Iterator[Any]:
+        for _, value in self.items():
+            yield value
+
+    def items(self) -> Iterator[tuple[str, Any]]:
+        for key, location in self.db.execute(
+            f'SELECT key, value FROM "{self.name}" ORDER BY rowid'
+        ):
+            yield key, self.decode(self._slice(location))
+
+    def raw_items(self, batch: int = 1000) -> Iterator[tuple[str, bytes]]:
+        for key, location in super().raw_items(batch):
+            yield key, bytes(self._slice(location))
+
+    def clear(self) -> None:
+        with self.db.lock:
+            super().clear()
+            directory = self.directory
+            self._close()
+            for path in directory.glob("blk*.dat"):
+                path.unlink()
+            self._file_no = 0
+
+
 # 数据库同时也是一个全局状态, 可以在各处被使用
 db_file = BASE_DIR / 'db.sqlite3'
-chain_db: dict[str, 'Block'] = SqliteDict(db_file, tablename='blockchain', autocommit=True)
-misc_db: dict[str, str] = SqliteDict(db_file, tablename='misc', autocommit=True)
-unspent_txs_db: dict[str, 'Transaction'] = SqliteDict(
-    db_file, tablename='unspent_txs', autocommit=True
-)
+db = Database(db_file)
+# 区块和 UTXO 使用 serialization 中的二进制格式, 其余的表仍使用 pickle
+if BLOCK_STORE == "sqlite":
+    chain_db: CachedTable = CachedTable(db, 'blockchain', _encode_block, _decode_legacy_block)
+else:
+    chain_db = BlockStore(db, 'block_index', _encode_block, _decode_block)
+misc_db: Table = Table(db, 'misc')
+# 未花费的输出 (UTXO), 键为 "txid:vout_index", 输出被花费后即删除
+utxo_db: Table = Table(db, 'utxo', _encode_output, _decode_output)
+# 地址索引, 每个 UTXO 一行, 键为 "pubkey_hash:txid:vout_index", 值为 None.
+# 用 keys_with_prefix 查询一个地址的 UTXO, 用于查询余额和选择输入.
+# 旧版本的 utxo_by_address 表每个地址存一个集合, 升级后需要运行 reindex 重建索引
+address_index_db: Table = Table(db, 'address_utxos')
+# 区块高度 -> 区块哈希. 键是字符串, 所以高度以 str 形式存储
+height_db: Table = Table(db, 'heights')
+# txid -> (区块哈希, 交易在区块中的位置), 用于生成交易的包含证明
+tx_index_db: Table = Table(db, 'tx_index')
+# 区块哈希 -> 区块中每笔交易花费的输出 [[(键, TXOutput), ...], ...], 用于撤销链顶的区块
+undo_db: Table = Table(db, 'undo')
+# txid -> 客户端提交后先在本地处理的交易花费的输出 [(键, TXOutput), ...],
+# 包含它的区块上链时用作这笔交易的撤销记录
+local_spent_db: Table = Table(db, 'local_spent')
+
+
+def import_sqlite_blocks(batch: int = 1000) -> int:
+    """
+    把旧版本存在 sqlite blockchain 表中的区块复制到 BlockStore, 返回复制的区块数.
+    二进制格式的区块直接复制, 更早的版本用 pickle 保存的区块需要解码后重新编码.
+    """
+    if not isinstance(chain_db, BlockStore):
+        raise BitcoinException("The block store backend is not enabled")
+    legacy = Table(db, 'blockchain')
+    copied = 0
+    with db.transaction():
+        rows: list[tuple[str, bytes]] = []
+        for key, data in legacy.raw_items(batch):
+            if key not in chain_db:
+                if data[:1] == pickle.PROTO:
+                    data = _encode_block(_decode_pickle(data))
+                rows.append((key, data))
+            if len(rows) == batch:
+                chain_db.put_many_raw(rows)
+                copied += len(rows)
+                rows = []
+        chain_db.put_many_raw(rows)
+        copied += len(rows)
+    return copied
 
 
 def save_str_to_file(s: str, name: str) -> None:
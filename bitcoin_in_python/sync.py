@@ -0,0 +1,218 @@
+"""
+先同步区块头, 再分批下载区块.
+
+1. 从本地链顶开始, 每次请求至多 HEADERS_PER_REQUEST 个区块头,
+   检查它们的高度, 前后哈希是否相连, 以及工作量证明.
+2. 对这批区块头, 每次下载至多 BLOCKS_PER_REQUEST 个区块, 经过三个阶段:
+   - 下载线程请求区块 (可以由 download 参数换成从多个节点并行下载), 主线程解码
+   - 进程池中做与链状态无关的检查: 区块与区块头一致 (包括重新计算交易哈希和 Merkle 根),
+     以及其中所有交易的签名
+   - 主线程按顺序把检查通过的一批区块在一个事务中写入数据库, 更新 UTXO 集合
+   三个阶段同时进行: 写入第 k 批时, 之后的几批正在检查, 再之后的一批正在下载.
+   同时在途的批数不超过 PIPELINE_DEPTH, 内存中的区块数与落后的区块数无关.
+
+每批区块提交后链顶随之前进, 中断后重新同步会从新的链顶继续.
+"""
+
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+from functools import partial
+from typing import Callable, Iterator, Optional
+
+from bitcoin_in_python import metrics
+from bitcoin_in_python.block import MIN_TARGET_BITS, Block, BlockChain, BlockHeader
+from bitcoin_in_python.exception import BitcoinException
+from bitcoin_in_python.serialization import (
+    Reader,
+    Writer,
+    decode_blocks,
+    decode_headers,
+)
+from bitcoin_in_python.sigverify import get_pool, verify_transactions
+from bitcoin_in_python.storage import db, misc_db
+
+HEADERS_PER_REQUEST = 500
+BLOCKS_PER_REQUEST = 50
+PIPELINE_DEPTH = 4  # 已经下载但还没有写入的批数
+GENESIS_PREV_HASH = "0" * 64
+
+_received_blocks = metrics.counter("sync.blocks_received")
+_validate_wait_seconds = metrics.histogram("sync.validate_wait_seconds")
+
+Request = Callable[[str, bytes], tuple[str, bytes]]
+# 给定各批区块头, 按顺序产生每批区块编码后的数据. 参数中的 Event 被设置后应尽快结束
+Download = Callable[[list[list[BlockHeader]], threading.Event], Iterator[bytes]]
+
+
+def encode_range(start: int, count: int) -> bytes:
+    w = Writer()
+    w.varint(start)
+    w.varint(count)
+    return w.getvalue()
+
+
+def decode_range(data: bytes) -> tuple[int, int]:
+    r = Reader(data)
+    return r.varint(), r.varint()
+
+
+def check_headers(headers: list[BlockHeader], prev_hash: str, height: int) -> None:
+    for header in headers:
+        if header.height != height:
+            raise BitcoinException(f"Expected header at height {height}, got {header.height}")
+        if header.prev_block_hash != prev_hash:
+            raise BitcoinException(f"Header at height {height} does not extend our chain")
+        if header.target_bits < MIN_TARGET_BITS or not header.validate():
+            raise BitcoinException(f"Invalid proof of work at height {height}")
+        prev_hash = header.hash
+        height += 1
+
+
+def check_block(block: Block, header: BlockHeader) -> None:
+    if block.hash != header.hash:
+        raise BitcoinException(f"Peer sent block {block.hash} instead of {header.hash}")
+    for tx in block.transactions:
+        if tx.compute_id() != tx.id:
+            raise BitcoinException(f"Transaction {tx.id} in block {block.hash} is malformed")
+    if block.header() != header:
+        raise BitcoinException(f"Block {block.hash} does not match its header")
+
+
+def check_blocks(blocks: list[Block], headers: list[BlockHeader], workers: int = 1) -> None:
+    """与链状态无关的检查, 失败时抛出 BitcoinException."""
+    if len(blocks) != len(headers):
+        raise BitcoinException(f"Expected {len(headers)} blocks, got {len(blocks)}")
+    for block, header in zip(blocks, headers):
+        check_block(block, header)
+    txs = [tx for block in blocks for tx in block.transactions]
+    if not verify_transactions(txs, workers):
+        raise BitcoinException(
+            f"Invalid signature in blocks {headers[0].height}..{headers[-1].height}"
+        )
+
+
+def validate_blocks(data: bytes, headers: list[BlockHeader]) -> None:
+    """在进程池中运行 check_blocks. 在子进程中重新解码, 这样只需要把编码后的数据传过去."""
+    check_blocks(decode_blocks(data), headers)
+
+
+def _check_inline(blocks: list[Block], headers: list[BlockHeader], workers: int) -> Future:
+    future: Future = Future()
+    try:
+        check_blocks(blocks, headers, workers)
+    except BaseException as e:
+        future.set_exception(e)
+    else:
+        future.set_result(None)
+    return future
+
+
+def sync_chain(
+    request: Request,
+    chain: BlockChain,
+    workers: Optional[int] = None,
+    download: Optional[Download] = None,
+) -> int:
+    """
+    从对方节点同步区块, 返回新增的区块数.
+    request 发送一条命令并返回对方的回复, 同步区块期间只在下载线程中调用.
+    workers 是检查区块的进程数, 默认为 CPU 数量.
+    download 默认用 request 逐批下载, 例如 PeerManager.download_blocks 从多个节点并行下载.
+    """
+    workers = workers or os.cpu_count() or 1
+    received = 0
+    while True:
+        height = len(chain)
+        prev_hash = misc_db.get('last_block_hash', GENESIS_PREV_HASH)
+        _, data = request('getheaders', encode_range(height, HEADERS_PER_REQUEST))
+        headers = decode_headers(data)
+        if not headers:
+            return received
+        check_headers(headers, prev_hash, height)
+        print(
+            f"Received headers {headers[0].height}..{headers[-1].height}, downloading blocks.."
+        )
+        received += _sync_blocks(
+            download or partial(_download_sequential, request), chain, headers, workers
+        )
+
+
+def _download_sequential(
+    request: Request, batches: list[list[BlockHeader]], stop: threading.Event
+) -> Iterator[bytes]:
+    for batch in batches:
+        if stop.is_set():
+            return
+        _, data = request('getblocks', encode_range(batch[0].height, len(batch)))
+        yield data
+
+
+def _sync_blocks(
+    download: Download, chain: BlockChain, headers: list[BlockHeader], workers: int
+) -> int:
+    batches = [
+        headers[i : i + BLOCKS_PER_REQUEST] for i in range(0, len(headers), BLOCKS_PER_REQUEST)
+    ]
+    # 只有一批时没有可以重叠的阶段, 直接在当前进程中检查, 省去启动进程池
+    pool = get_pool(workers) if workers > 1 and len(batches) > 1 else None
+
+    downloads: queue.Queue = queue.Queue(maxsize=1)
+    stop = threading.Event()
+
+    def run_download():
+        try:
+            for batch, data in zip(batches, download(batches, stop)):
+                downloads.put((batch, data))
+        except BaseException as e:
+            downloads.put(e)
+
+    thread = threading.Thread(target=run_download, name="sync-download", daemon=True)
+    thread.start()
+    # (区块头, 解码后的区块, 检查结果), 按高度排列
+    pending: deque[tuple[list[BlockHeader], list[Block], Future]] = deque()
+    received = 0
+    try:
+        for _ in batches:
+            item = downloads.get()
+            if isinstance(item, BaseException):
+                raise item
+            batch, data = item
+            blocks = decode_blocks(data)
+            if pool is None:
+                future = _check_inline(blocks, batch, workers)
+            else:
+                future = pool.submit(validate_blocks, data, batch)
+            pending.append((batch, blocks, future))
+            if len(pending) >= PIPELINE_DEPTH:
+                received += _commit(chain, *pending.popleft())
+        while pending:
+            received += _commit(chain, *pending.popleft())
+    finally:
+        stop.set()
+        for _, _, future in pending:
+            future.cancel()
+        # 下载线程可能正阻塞在放入队列上
+        while thread.is_alive():
+            try:
+                downloads.get(timeout=0.1)
+            except queue.Empty:
+                pass
+    return received
+
+
+def _commit(
+    chain: BlockChain, batch: list[BlockHeader], blocks: list[Block], future: Future
+) -> int:
+    start = metrics.now()
+    future.result()  # 检查失败时抛出异常
+    _validate_wait_seconds.observe_since(start)
+    # 整批区块在一个事务中提交, 中断后从已提交的链顶继续
+    with db.transaction():
+        for block in blocks:
+            chain.add_block(block)
+    _received_blocks.inc(len(blocks))
+    print(f"Synced to height {blocks[-1].height}")
+    return len(blocks)
@@ -2,25 +2,31 @@ import binascii
 import random
 from dataclasses import asdict, dataclass, field
 from hashlib import sha256
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Union
 
 import base58
-from Crypto.Hash import SHA256
-from Crypto.PublicKey import ECC
 from Crypto.Signature import DSS
 
+from bitcoin_in_python.coinselect import units
 from bitcoin_in_python.exception import BitcoinException
-from bitcoin_in_python.wallet import Wallet, hex_hash_pubkey
+from bitcoin_in_python.sigverify import (
+    Prehashed,
+    SignatureCheck,
+    import_public_key,
+    verify_checks,
+)
+from bitcoin_in_python.wallet import Wallet, hex_hash_pubkey, pubkey_to_address
 
 if TYPE_CHECKING:
-    from block import BlockChain
+    from bitcoin_in_python.block import BlockChain
+
+SUBSIDY = 1  # 挖出一个区块的奖励
 
 
 @dataclass
 class TXOutput:
-    value: int  # 交易的货币数量
+    value: Union[int, float]  # 交易的货币数量, 可以是小数
     pubkey_hash: str
-    is_spent: bool = False
 
     @classmethod
     def from_dict(cls, d: dict):
@@ -54,6 +60,14 @@ class TXInput:
         locking_hash = hex_hash_pubkey(self.pubkey)
         return locking_hash == pubkey_hash
 
+    def unlocks(self, output: TXOutput) -> bool:
+        """公钥对应的地址就是输出锁定的地址. 公钥无法解析时返回 False."""
+        try:
+            address = pubkey_to_address(import_public_key(self.pubkey))
+        except ValueError:
+            return False
+        return address == output.pubkey_hash
+
     def hash(self):
         return sha256(
             f"{self.txid}{self.vout_index}{self.signature}{self.pubkey}".encode()
@@ -74,7 +88,6 @@ class Transaction:
         """
         奖励矿工的交易, 不需要输出
         """
-        SUBSIDY = 1
         out = TXOutput(SUBSIDY, to)
 
         # 创建一个空的 input 的目的是为了让每次的哈希不同
@@ -85,29 +98,34 @@ class Transaction:
         return tx
 
     @classmethod
-    def new_transaction(cls, wallet: Wallet, to: str, amount: int, bc: "BlockChain"):
-        txs, accumulated = bc.find_spendable_transactions(amount, wallet.get_address())
+    def new_transaction(
+        cls,
+        wallet: Wallet,
+        to: str,
+        amount: float,
+        bc: "BlockChain",
+        strategy: str = "default",
+    ):
+        utxos, accumulated = bc.find_spendable_outputs(amount, wallet.get_address(), strategy)
 
         # build a list of inputs
         inputs = []
-        for tx in txs:
-            for index, output in enumerate(tx.vout):
-                if output.can_be_unlocked_with(wallet.get_address()):
-                    inputs.append(
-                        TXInput(
-                            tx.id,
-                            index,
-                            b"",
-                            wallet.export_public_key(),
-                        )
-                    )
+        for txid, index, _ in utxos:
+            inputs.append(
+                TXInput(
+                    txid,
+                    index,
+                    b"",
+                    wallet.export_public_key(),
+                )
+            )
 
         outputs = [TXOutput(amount, to)]
-        if accumulated > amount:  # 找零
+        if units(accumulated) > units(amount):  # 找零
             outputs.append(TXOutput(accumulated - amount, wallet.get_address()))
         tx = cls("", inputs, outputs)
-        tx.hash()
         tx.sign(wallet)
+        tx.hash()  # 交易哈希包含签名, 所以在签名之后计算
         return tx
 
     def trimmed_copy(self):
@@ -127,51 +145,84 @@ class Transaction:
     def __repr__(self):
         return f"Transaction:\n" f"id={self.id}\n" f"vin={self.vin}\n" f"vout={self.vout}\n"
 
-    def hash(self):
+    def compute_id(self) -> str:
         h = sha256()
         for input in self.vin:
             h.update(input.hash().encode())
         for output in self.vout:
             h.update(output.hash().encode())
-        self.id = h.hexdigest()
+        return h.hexdigest()
+
+    def hash(self):
+        self.id = self.compute_id()
         return self.id
 
     def is_coinbase(self):
         return len(self.vin) == 1 and self.vin[0].txid == "" and self.vin[0].pubkey == ""
 
+    def sighashes(self, pubkeys: list[str]) -> list[bytes]:
+        """
+        每个 input 的签名摘要. 第 i 个 input 的摘要是这样算的: 在 trimmed_copy 中
+        只把第 i 个 input 的公钥设为 pubkeys[i], 计算交易哈希, 再对其十六进制字符串做一次 SHA-256.
+
+        trimmed_copy 中各个 input 和 output 的哈希只计算一次, 拼成一个字节串.
+        第 i 个摘要从前 i 个 input 的 sha256 中间状态出发, 接上第 i 个 input 的哈希,
+        再通过 memoryview 直接喂入剩余部分, 不需要为每个 input 重新构造交易副本.
+        """
+        item = 64  # 每个 input/output 的哈希是 64 个十六进制字符
+        trimmed = [
+            sha256(f"{vin.txid}{vin.vout_index}".encode()).hexdigest().encode()
+            for vin in self.vin
+        ]
+        outputs = [output.hash().encode() for output in self.vout]
+        body = memoryview(b"".join(trimmed + outputs))
+
+        digests = []
+        prefix = sha256()
+        for index, (vin, pubkey) in enumerate(zip(self.vin, pubkeys)):
+            h = prefix.copy()
+            h.update(
+                sha256(f"{vin.txid}{vin.vout_index}{pubkey}".encode()).hexdigest().encode()
+            )
+            h.update(body[(index + 1) * item :])
+            digests.append(sha256(h.hexdigest().encode()).digest())
+            prefix.update(trimmed[index])
+        return digests
+
     def sign(self, wallet: Wallet) -> None:
         if self.is_coinbase():
             return
 
         signer = DSS.new(wallet.private_key, "fips-186-3")
+        digests = self.sighashes([wallet.export_public_key()] * len(self.vin))
+        for vin, digest in zip(self.vin, digests):
+            vin.signature = signer.sign(Prehashed(digest))
+
+    def signature_checks(self) -> list[SignatureCheck]:
+        digests = self.sighashes([vin.pubkey for vin in self.vin])
+        return [(digest, vin.signature, vin.pubkey) for vin, digest in zip(self.vin, digests)]
 
-        tx_copy = self.trimmed_copy()
-        for index, vin in enumerate(tx_copy.vin):
-            vin.pubkey = wallet.export_public_key()
-            tx_copy.id = tx_copy.hash()
-            vin.pubkey = ""
+    def check_spends(self, spent: list[TXOutput]) -> None:
+        """
+        检查交易与它花费的输出 (与 vin 一一对应): 每个 input 的公钥都能解锁对应的输出,
+        输出的金额不为负, 总额不超过花费的总额. 失败时抛出 BitcoinException.
+        签名另外检查, 这里确认了签名用的公钥就是输出的主人.
+        """
+        for vin, output in zip(self.vin, spent):
+            if not vin.unlocks(output):
+                raise BitcoinException(
+                    f"Transaction {self.id} cannot unlock output {vin.txid}:{vin.vout_index}"
+                )
+        self.check_values(sum(units(output.value) for output in spent))
 
-            # 由于 signer.sign 方法必须要传一个 Hash 对象, 所以又做了一遍哈希..
-            # FIXME: 可以考虑改进
-            self.vin[index].signature = signer.sign(SHA256.new(tx_copy.id.encode()))
+    def check_values(self, available: int) -> None:
+        """输出的金额不为负, 总额不超过 available (以 coinselect.units 为单位)."""
+        values = [units(output.value) for output in self.vout]
+        if any(value < 0 for value in values):
+            raise BitcoinException(f"Transaction {self.id} has a negative output")
+        if sum(values) > available:
+            raise BitcoinException(f"Transaction {self.id} spends more than its inputs")
 
     def verify(self) -> bool:
-        """验证一个 input 的签名"""
-        tx_copy = self.trimmed_copy()
-
-        for index, vin in enumerate(tx_copy.vin):
-            vin.pubkey = self.vin[index].pubkey
-            tx_copy.id = tx_copy.hash()
-            vin.pubkey = ""
-
-            pubkey = ECC.import_key(self.vin[index].pubkey)
-            verifier = DSS.new(pubkey, "fips-186-3")
-            try:
-                verifier.verify(
-                    # 此处同理, 见 sign 方法
-                    SHA256.new(tx_copy.id.encode()),
-                    self.vin[index].signature,
-                )
-            except ValueError:
-                return False
-        return True
+        """验证所有 input 的签名"""
+        return verify_checks(self.signature_checks(), workers=1)
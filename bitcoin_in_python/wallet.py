@@ -1,12 +1,20 @@
 import binascii
-from dataclasses import dataclass
+import json
+import os
+from dataclasses import dataclass, field
+from functools import cached_property
 from hashlib import sha256
+from pathlib import Path
+from typing import Optional
 
 import base58
 from Crypto.Hash import RIPEMD160
 from Crypto.PublicKey import ECC
 
-from bitcoin_in_python.storage import read_str_from_file, save_str_to_file
+from bitcoin_in_python.exception import BitcoinException
+from bitcoin_in_python.storage import BASE_DIR, read_str_from_file, save_str_to_file
+
+WALLETS_FILE = "wallets.json"
 
 
 def new_key_pair() -> tuple[ECC.EccKey, ECC.EccKey]:
@@ -22,11 +30,27 @@ def hash_pubkey(pub: ECC.EccKey) -> bytes:
 
 
 def hex_hash_pubkey(pub: str) -> str:
-    return binascii.hexlify(hash_pubkey(pub)).decode()
+    """pub 为 PEM 格式的公钥."""
+    return binascii.hexlify(hash_pubkey(ECC.import_key(pub))).decode()
+
+
+def pubkey_to_address(pub: ECC.EccKey) -> str:
+    hsh = hash_pubkey(pub)
+
+    prefix = b"\x00"  # P2PKH address
+
+    checksum = sha256(sha256(prefix + hsh).digest()).digest()[:4]
+
+    address = base58.b58encode(prefix + hsh + checksum).decode()
+    return address
 
 
 @dataclass
 class Wallet:
+    """
+    地址, 公钥哈希和导出的公钥只计算一次.
+    """
+
     private_key: ECC.EccKey
     public_key: ECC.EccKey
 
@@ -35,33 +59,131 @@ class Wallet:
         key, pub = new_key_pair()
         return cls(key, pub)
 
+    @classmethod
+    def from_private_key(cls, pem: str):
+        key = ECC.import_key(pem)
+        return cls(key, key.public_key())
+
+    @cached_property
+    def public_key_pem(self) -> str:
+        return self.public_key.export_key(format="PEM")
+
+    @cached_property
+    def pubkey_hash(self) -> str:
+        return binascii.hexlify(hash_pubkey(self.public_key)).decode()
+
+    @cached_property
+    def address(self) -> str:
+        return pubkey_to_address(self.public_key)
+
     def export_private_key(self) -> str:
         return self.private_key.export_key(format="PEM")
 
     def export_public_key(self) -> str:
-        return self.public_key.export_key(format="PEM")
+        return self.public_key_pem
 
     def save_wallet(self, name):
         save_str_to_file(self.export_private_key(), f"{name}.txt")
 
     @classmethod
     def read_wallet(cls, name):
-        key_str = read_str_from_file(f"{name}.txt")
-        key = ECC.import_key(key_str)
-        pub = key.public_key()
-        return cls(key, pub)
+        """先在钱包文件中查找, 找不到时读取旧的 {name}.txt."""
+        wallet = Wallets.load().get(name)
+        if wallet is None:
+            try:
+                wallet = cls.from_private_key(read_str_from_file(f"{name}.txt"))
+            except FileNotFoundError:
+                raise BitcoinException(f"Wallet {name} does not exist")
+        return wallet
 
     def get_address(self) -> str:
-        hsh = hash_pubkey(self.public_key)
-
-        prefix = b"\x00"  # P2PKH address
-
-        checksum = sha256(sha256(prefix + hsh).digest()).digest()[:4]
-
-        address = base58.b58encode(prefix + hsh + checksum).decode()
-        return address
+        return self.address
 
 
 @dataclass
 class Wallets:
-    wallets: dict[str, Wallet]
+    """
+    保存在同一个文件中的多个钱包, 文件内容为 name -> {私钥, 地址, 公钥哈希}.
+    地址和公钥哈希随私钥一起保存, 查找钱包不需要解析任何私钥;
+    私钥在第一次 get 时才解析, 之后缓存在内存中.
+    """
+
+    path: Path
+    records: dict[str, dict] = field(default_factory=dict)
+    _wallets: dict[str, Wallet] = field(default_factory=dict, repr=False)
+    _by_pubkey_hash: dict[str, str] = field(default_factory=dict, repr=False)
+    _by_address: dict[str, str] = field(default_factory=dict, repr=False)
+
+    def __post_init__(self):
+        for name, record in self.records.items():
+            self._index(name, record)
+
+    @classmethod
+    def load(cls, path: Optional[Path] = None) -> "Wallets":
+        path = path or BASE_DIR / WALLETS_FILE
+        try:
+            with open(path) as f:
+                records = json.load(f)
+        except FileNotFoundError:
+            records = {}
+        return cls(path, records)
+
+    def save(self) -> None:
+        # 先写临时文件再替换, 中途失败不会损坏已有的钱包
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.records, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def _index(self, name: str, record: dict) -> None:
+        self._by_pubkey_hash[record["pubkey_hash"]] = name
+        self._by_address[record["address"]] = name
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, name: str):
+        return name in self.records
+
+    def names(self) -> list[str]:
+        return list(self.records)
+
+    def add(self, name: str, wallet: Wallet) -> None:
+        if name in self.records:
+            raise BitcoinException(f"Wallet {name} already exists")
+        record = {
+            "private_key": wallet.export_private_key(),
+            "address": wallet.address,
+            "pubkey_hash": wallet.pubkey_hash,
+        }
+        self.records[name] = record
+        self._wallets[name] = wallet
+        self._index(name, record)
+
+    def create(self, name: str) -> Wallet:
+        wallet = Wallet.new_wallet()
+        self.add(name, wallet)
+        return wallet
+
+    def get(self, name: str) -> Optional[Wallet]:
+        if name not in self._wallets:
+            record = self.records.get(name)
+            if record is None:
+                return None
+            wallet = Wallet.from_private_key(record["private_key"])
+            # 已经保存在文件中了, 不需要再计算
+            wallet.__dict__.update(
+                address=record["address"], pubkey_hash=record["pubkey_hash"]
+            )
+            self._wallets[name] = wallet
+        return self._wallets[name]
+
+    def address_of(self, name: str) -> str:
+        return self.records[name]["address"]
+
+    def find_by_pubkey_hash(self, pubkey_hash: str) -> Optional[str]:
+        """返回持有该公钥哈希的钱包名称."""
+        return self._by_pubkey_hash.get(pubkey_hash)
+
+    def find_by_address(self, address: str) -> Optional[str]:
+        return self._by_address.get(address)
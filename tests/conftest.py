@@ -0,0 +1,20 @@
+import pytest
+
+from bitcoin_in_python.storage import chain_db, db
+
+
+@pytest.fixture
+def use_db(tmp_path, monkeypatch):
+    """切换到 tmp_path 下的另一个数据库. 连接是在第一次访问时打开的, 换掉路径即可."""
+
+    def use(name: str = "db.sqlite3"):
+        if db._connection is not None:
+            db._connection.close()
+        monkeypatch.setattr(db, "path", tmp_path / name)
+        monkeypatch.setattr(db, "_connection", None)
+        chain_db.clear_cache()
+
+    yield use
+    if db._connection is not None:
+        db._connection.close()
+    chain_db.clear_cache()
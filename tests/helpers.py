@@ -0,0 +1,44 @@
+"""测试中构造区块和交易的函数."""
+
+import time
+from typing import Optional
+
+from bitcoin_in_python.block import Block
+from bitcoin_in_python.miner import mine
+from bitcoin_in_python.sync import GENESIS_PREV_HASH
+from bitcoin_in_python.transaction import Transaction, TXInput, TXOutput
+from bitcoin_in_python.wallet import Wallet
+
+
+def make_block(txs: list[Transaction], prev_block_hash: str, target_bits: int = 0) -> Block:
+    """包含 txs 的区块, 默认难度为 0, 不需要真正挖矿."""
+    block = Block(int(time.time()), txs, prev_block_hash, target_bits=target_bits)
+    result = mine(block.prepare_prefix(), target_bits)
+    assert result is not None
+    block.nonce, block.hash = result.nonce, result.hash
+    return block
+
+
+def spend(
+    wallet: Wallet, tx: Transaction, index: int, to: str, value: Optional[float] = None
+) -> Transaction:
+    """wallet 花费 tx 的第 index 个输出, 全部转给 to. 输出不存在时需要给出 value."""
+    inputs = [TXInput(tx.id, index, b"", wallet.export_public_key())]
+    if value is None:
+        value = tx.vout[index].value
+    tx = Transaction("", inputs, [TXOutput(value, to)])
+    tx.sign(wallet)
+    tx.hash()
+    return tx
+
+
+def mined_chain(n: int) -> list[Block]:
+    """n 个满足最低难度的区块, 同步时会检查工作量证明."""
+    blocks = []
+    prev_hash = GENESIS_PREV_HASH
+    for height in range(n):
+        block = Block.new_block([Transaction.new_coinbase_transaction("a")], prev_hash)
+        block.height = height
+        blocks.append(block)
+        prev_hash = block.hash
+    return blocks
@@ -0,0 +1,81 @@
+import pytest
+
+from bitcoin_in_python.block import BlockChain, address_key, outpoint
+from bitcoin_in_python.exception import BitcoinException
+from bitcoin_in_python.storage import address_index_db, utxo_db
+from bitcoin_in_python.transaction import Transaction, TXInput, TXOutput
+from bitcoin_in_python.wallet import Wallet
+from tests.helpers import make_block, spend
+
+
+@pytest.fixture
+def chain(use_db):
+    use_db()
+    return BlockChain()
+
+
+def test_blocks_are_found_by_height(chain):
+    prev_hash = "0" * 64
+    blocks = []
+    for _ in range(5):
+        block = make_block([Transaction.new_coinbase_transaction("a")], prev_hash)
+        chain.add_block(block)
+        blocks.append(block)
+        prev_hash = block.hash
+    hashes = [block.hash for block in blocks]
+
+    assert len(chain) == 5
+    assert [block.height for block in blocks] == [0, 1, 2, 3, 4]
+    assert chain.block_at(2).hash == hashes[2]
+    assert [block.hash for block in chain.blocks_at([3, 0, 4])] == [
+        hashes[i] for i in (3, 0, 4)
+    ]
+    assert [block.hash for block in chain.top_n_blocks(2)] == hashes[3:]
+    assert [block.hash for block in chain.blocks_since(3)] == hashes[3:]
+    assert [block.hash for block in chain] == hashes[::-1]
+    with pytest.raises(BitcoinException):
+        chain.blocks_at([5])
+    with pytest.raises(BitcoinException):
+        chain.top_n_blocks(6)
+
+
+def indexed(address):
+    return set(address_index_db.keys_with_prefix(address + ":"))
+
+
+def test_address_index_follows_spends(chain):
+    a, b = Wallet.new_wallet(), Wallet.new_wallet()
+    genesis = make_block([Transaction.new_coinbase_transaction(a.get_address())], "0" * 64)
+    chain.add_block(genesis)
+    coin = outpoint(genesis.transactions[0].id, 0)
+    assert indexed(a.get_address()) == {address_key(a.get_address(), coin)}
+
+    # a 付给 b 0.4, 找零 0.6
+    inputs = [TXInput(genesis.transactions[0].id, 0, b"", a.export_public_key())]
+    payment = Transaction(
+        "", inputs, [TXOutput(0.4, b.get_address()), TXOutput(0.6, a.get_address())]
+    )
+    payment.sign(a)
+    payment.hash()
+    coinbase = Transaction.new_coinbase_transaction(b.get_address())
+    block = make_block([coinbase, payment], genesis.hash)
+    chain.add_block(block)
+
+    assert coin not in utxo_db
+    assert indexed(a.get_address()) == {address_key(a.get_address(), outpoint(payment.id, 1))}
+    assert indexed(b.get_address()) == {
+        address_key(b.get_address(), outpoint(coinbase.id, 0)),
+        address_key(b.get_address(), outpoint(payment.id, 0)),
+    }
+    assert chain.get_balance(a.get_address()) == 0.6
+    assert chain.get_balance(b.get_address()) == 1.4
+    assert [(txid, i) for txid, i, _ in chain.find_utxos(a.get_address())] == [(payment.id, 1)]
+
+    # a 花掉了所有的输出, 不再出现在索引中
+    change = spend(a, payment, 1, b.get_address())
+    chain.add_block(
+        make_block([Transaction.new_coinbase_transaction(b.get_address()), change], block.hash)
+    )
+    assert not indexed(a.get_address())
+    assert chain.get_balance(a.get_address()) == 0
+    assert chain.get_balance(b.get_address()) == 3
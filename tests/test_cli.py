@@ -0,0 +1,24 @@
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_help_does_not_load_crypto_or_database(tmp_path):
+    code = (
+        "import sys, runpy; sys.argv = ['bitcoin_in_python', '--help']\n"
+        "try:\n"
+        "    runpy.run_module('bitcoin_in_python', run_name='__main__')\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        "assert not any(m.startswith(('Crypto', 'asyncio', 'sqlite3')) for m in sys.modules)\n"
+    )
+    subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=tmp_path,
+        env={"PYTHONPATH": str(ROOT)},
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    assert not (tmp_path / "db.sqlite3").exists()
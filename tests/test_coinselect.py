@@ -0,0 +1,28 @@
+import pytest
+
+from bitcoin_in_python.coinselect import select_coins
+from bitcoin_in_python.exception import BitcoinException
+from bitcoin_in_python.transaction import TXOutput
+
+
+def coins(*values):
+    return [(f"{i:064x}", 0, TXOutput(value, "address")) for i, value in enumerate(values)]
+
+
+def test_strategies():
+    utxos = coins(0.1, 0.2, 0.3, 5, 0.7)
+    # 恰好相等时不需要找零, 金额是小数也一样
+    selected, total = select_coins(coins(0.1, 0.2, 0.3, 0.7), 1.0)
+    assert total == pytest.approx(1.0) and len(selected) == 2
+    assert select_coins(coins(5, 4, 3, 3), 6)[1] == 6
+    assert select_coins(coins(5, 4, 3, 3), 6, "largest-first")[1] == 8
+    # 一个输入够付时用够付的最小的那个
+    assert select_coins(utxos, 0.65) == ([utxos[4]], 0.7)
+    assert select_coins(utxos, 0.65, "first-fit")[0] == utxos[:3] + [utxos[3]]
+    # 恰好相等的组合比 largest-first 需要更多输入时不采用
+    assert select_coins(coins(3, 3, 2, 2, 2), 6)[0] == coins(3, 3, 2, 2, 2)[:2]
+
+    with pytest.raises(BitcoinException):
+        select_coins(utxos, 7)
+    with pytest.raises(BitcoinException):
+        select_coins(utxos, 0.65, "bnb")
@@ -0,0 +1,36 @@
+import pytest
+
+from bitcoin_in_python.block import outpoint
+from bitcoin_in_python.exception import BitcoinException
+from bitcoin_in_python.mempool import Mempool
+from bitcoin_in_python.storage import utxo_db
+from bitcoin_in_python.transaction import Transaction
+from bitcoin_in_python.wallet import Wallet
+from tests.helpers import spend
+
+
+def test_conflicts_chains_and_eviction(use_db):
+    use_db()
+    wallet = Wallet.new_wallet()
+    address = wallet.get_address()
+    funding = Transaction.new_coinbase_transaction(address)
+    utxo_db[outpoint(funding.id, 0)] = funding.vout[0]
+
+    mempool = Mempool(max_count=2)
+    parent = spend(wallet, funding, 0, address)
+    child = spend(wallet, parent, 0, address)
+    assert mempool.add(parent) and mempool.add(child)
+    assert mempool.block_template(10, 1 << 20) == [parent, child]
+    assert mempool.block_template(10, mempool.entries[parent.id].size) == [parent]
+
+    with pytest.raises(BitcoinException):
+        mempool.add(spend(wallet, funding, 0, address, value=0.5))  # 双花
+    with pytest.raises(BitcoinException):
+        mempool.add(spend(Wallet.new_wallet(), parent, 1, address, value=1))  # 不存在的输出
+
+    # 淘汰最早的交易时, 花费它的输出的交易也要一起移除
+    other = Transaction.new_coinbase_transaction(address)
+    utxo_db[outpoint(other.id, 0)] = other.vout[0]
+    assert mempool.add(spend(wallet, other, 0, address))
+    assert len(mempool) == 1 and parent.id not in mempool and child.id not in mempool
+    assert mempool.stats()["bytes"] == mempool.bytes
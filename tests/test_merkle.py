@@ -0,0 +1,17 @@
+from hashlib import sha256
+
+from bitcoin_in_python.merkle import MerkleTree
+
+
+def test_proofs_for_every_position():
+    for n in (1, 2, 3, 7, 8, 33):
+        txids = [sha256(str(i).encode()).hexdigest() for i in range(n)]
+        tree = MerkleTree.from_txids(txids)
+        for index, txid in enumerate(txids):
+            proof = tree.proof(index)
+            assert proof.txid == txid and proof.verify(tree.root)
+            assert len(proof.siblings) == len(tree.levels) - 1
+
+        proof = tree.proof(n - 1)
+        proof.txid = sha256(b"other").hexdigest()
+        assert not proof.verify(tree.root)
@@ -0,0 +1,38 @@
+from bitcoin_in_python import metrics
+
+
+def test_disabled_metrics_record_nothing_and_dumps_merge():
+    c = metrics.counter("test.counter")
+    h = metrics.histogram("test.seconds")
+    metrics.enable(False)
+    c.inc()
+    h.observe(1.0)
+    assert c.value == 0 and h.count == 0 and metrics.now() == 0.0
+
+    metrics.enable()
+    try:
+        c.inc(2)
+        for value in (0.001, 0.002, 0.5):
+            h.observe(value)
+        dump = metrics.dump()
+        metrics.merge(dump)
+        assert c.value == 4
+        summary = metrics.snapshot()["histograms"]["test.seconds"]
+        assert summary["count"] == 6 and summary["max"] == 0.5
+        assert 0.001 <= summary["p50"] <= 0.004
+    finally:
+        metrics.reset()
+        metrics.enable(False)
+
+
+def test_child_process_follows_the_parent_setting():
+    def count():
+        metrics.counter("test.child").inc()
+
+    try:
+        assert metrics.call_with_metrics(False, count)[1]["counters"] == {}
+        assert not metrics.is_enabled()
+        assert metrics.call_with_metrics(True, count)[1]["counters"] == {"test.child": 1}
+    finally:
+        metrics.reset()
+        metrics.enable(False)
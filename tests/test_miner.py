@@ -0,0 +1,20 @@
+import hashlib
+import multiprocessing
+
+from bitcoin_in_python.miner import mine, target_bytes
+
+
+def test_mining_with_several_workers():
+    result = mine("prefix", 12, workers=2)
+    digest = hashlib.sha256(f"prefix{result.nonce}".encode()).digest()
+    assert digest.hex() == result.hash
+    assert digest < target_bytes(12)
+    assert result.hashes > 0
+
+
+def test_mining_returns_none_when_already_stopped():
+    stop = multiprocessing.Event()
+    stop.set()
+    # 难度为 256 时不可能找到, 只能因为 stop 返回
+    assert mine("prefix", 256, workers=1, stop=stop) is None
+    assert mine("prefix", 256, workers=2, stop=stop) is None
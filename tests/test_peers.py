@@ -0,0 +1,72 @@
+import socketserver
+import threading
+import time
+
+from bitcoin_in_python import peers as peers_module
+from bitcoin_in_python import sync
+from bitcoin_in_python.block import BlockChain
+from bitcoin_in_python.peers import PeerManager, parse_peer
+from bitcoin_in_python.protocol import recv_data, send_data
+from bitcoin_in_python.serialization import encode_blocks, encode_headers
+from tests.helpers import mined_chain
+
+
+def start_node(blocks, served: list, broken: bool = False) -> socketserver.TCPServer:
+    """在本地的随机端口上启动一个只会回复 getheaders 和 getblocks 的节点."""
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            while True:
+                try:
+                    command, data = recv_data(self.request)
+                except Exception:
+                    return
+                start, count = sync.decode_range(data)
+                if command == 'getheaders':
+                    headers = [b.header() for b in blocks[start : start + count]]
+                    send_data('headers', encode_headers(headers), self.request)
+                elif broken:
+                    return  # 直接断开连接
+                else:
+                    served.append(start)
+                    time.sleep(0.02)  # 让另一个节点的下载线程有机会领取批
+                    send_data(
+                        'blocks', encode_blocks(blocks[start : start + count]), self.request
+                    )
+
+    server = socketserver.ThreadingTCPServer(('localhost', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_parse_peer():
+    assert parse_peer("example.com:4001") == ("example.com", 4001)
+    assert parse_peer("4002") == ("localhost", 4002)
+    assert parse_peer("example.com") == ("example.com", 4000)
+
+
+def test_blocks_are_downloaded_from_several_peers(use_db, monkeypatch):
+    use_db()
+    monkeypatch.setattr(sync, "BLOCKS_PER_REQUEST", 2)
+    # 本地节点的下载时间只有调度的噪声, 不按快慢丢弃节点
+    monkeypatch.setattr(peers_module, "SLOW_MARGIN", 60)
+    blocks = mined_chain(20)
+    served = [[], [], []]
+    nodes = [start_node(blocks, served[0]), start_node(blocks, served[1])]
+    nodes.append(start_node(blocks, served[2], broken=True))
+    peers = PeerManager([f"localhost:{node.server_address[1]}" for node in nodes])
+    try:
+        chain = BlockChain()
+        assert sync.sync_chain(peers.request, chain, 1, peers.download_blocks) == 20
+    finally:
+        peers.close()
+        for node in nodes:
+            node.shutdown()
+    assert len(chain) == 20
+    # 两个正常的节点各下载了一部分, 互不重叠; 断开连接的节点的批由它们重新下载.
+    # 它连续失败 MAX_FAILURES 次后才被丢弃, 在那之前下载可能已经完成了
+    assert served[0] and served[1]
+    assert sorted(served[0] + served[1]) == list(range(0, 20, 2))
+    assert [peer.dropped for peer in peers.peers[:2]] == [False, False]
+    assert peers.peers[2].batches == 0
@@ -0,0 +1,44 @@
+import socket
+import threading
+
+import pytest
+
+from bitcoin_in_python.exception import BitcoinException
+from bitcoin_in_python.protocol import (
+    FrameReader,
+    pack_header,
+    recv_data,
+    send_data,
+    unpack_header,
+)
+
+
+def test_large_frame_and_split_header():
+    a, b = socket.socketpair()
+    payload = bytes(range(256)) * 20000  # 约 5MB, 需要很多次 recv
+
+    def sender():
+        header = pack_header('reply', len(payload))
+        a.sendall(header[:3])  # 头部分两次到达
+        a.sendall(header[3:] + payload)
+        send_data('empty', b'', a)
+
+    t = threading.Thread(target=sender)
+    t.start()
+    assert recv_data(b) == ('reply', payload)
+    assert recv_data(b) == ('empty', b'')
+    t.join()
+
+
+def test_stream_and_size_limit():
+    a, b = socket.socketpair()
+    send_data('reply', b'x' * 1000, a)
+    reader = FrameReader(b)
+    command, length = reader.read_header()
+    assert sum(len(chunk) for chunk in reader.iter_payload(length, chunk_size=300)) == 1000
+
+    send_data('reply', b'x' * 1000, a)
+    with pytest.raises(BitcoinException):
+        FrameReader(b, max_frame_size=999).read_frame()
+    with pytest.raises(BitcoinException):
+        unpack_header(b"\x00\x00\x00\x00\xff" + b" " * 11)
@@ -0,0 +1,50 @@
+import pytest
+
+from bitcoin_in_python.block import Block
+from bitcoin_in_python.exception import BitcoinException
+from bitcoin_in_python.serialization import (
+    decode_block,
+    decode_output,
+    decode_transactions,
+    encode_block,
+    encode_transactions,
+)
+from bitcoin_in_python.transaction import Transaction, TXInput, TXOutput
+from bitcoin_in_python.wallet import Wallet
+
+
+def signed_transaction(wallet: Wallet) -> Transaction:
+    address = wallet.get_address()
+    inputs = [TXInput("ab" * 32, i, b"", wallet.export_public_key()) for i in range(2)]
+    tx = Transaction("", inputs, [TXOutput(0.5, address), TXOutput(3, address)])
+    tx.hash()
+    tx.sign(wallet)
+    return tx
+
+
+def test_block_round_trip():
+    wallet = Wallet.new_wallet()
+    coinbase = Transaction.new_coinbase_transaction(wallet.get_address())
+    block = Block(1700000000, [coinbase, signed_transaction(wallet)], "00" * 32, 1 << 40)
+    block.hash = "ff" * 32
+    block.height = 300
+
+    decoded = decode_block(encode_block(block))
+    assert decoded == block
+    # 交易哈希依赖金额的字符串形式, 必须保持 int/float 类型不变
+    assert [type(o.value) for o in decoded.transactions[1].vout] == [float, int]
+    assert decoded.transactions[1].verify()
+
+
+def test_transactions_round_trip_and_truncation():
+    txs = [signed_transaction(Wallet.new_wallet()) for _ in range(3)]
+    data = encode_transactions(txs)
+    assert decode_transactions(memoryview(data)) == txs
+
+    with pytest.raises(BitcoinException):
+        decode_transactions(data[:-1])
+    with pytest.raises(BitcoinException):
+        decode_transactions(b"\x02" + data[1:])
+    # 版本号, 整数金额 1, 长度为 2 的地址, 地址不是 UTF-8
+    with pytest.raises(BitcoinException):
+        decode_output(b"\x01\x00\x01\x02\xff\xfe")
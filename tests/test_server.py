@@ -0,0 +1,193 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from bitcoin_in_python import server
+from bitcoin_in_python.block import Block, BlockChain, blockchain
+from bitcoin_in_python.exception import BitcoinException
+from bitcoin_in_python.protocol import read_frame, write_frame
+from bitcoin_in_python.serialization import decode_headers
+from bitcoin_in_python.server import MiningJob, Node
+from bitcoin_in_python.sync import encode_range
+from bitcoin_in_python.transaction import Transaction
+from bitcoin_in_python.wallet import Wallet
+from tests.helpers import spend
+
+
+def test_new_block_returns_none_when_stopped():
+    stop = threading.Event()
+    stop.set()
+    assert (
+        Block.new_block([Transaction.new_coinbase_transaction("a")], "0" * 64, stop=stop)
+        is None
+    )
+
+
+def test_mining_restarts_with_a_better_template(use_db, monkeypatch):
+    use_db()
+    monkeypatch.setattr(server, "MIN_JOB_SECONDS", 0)
+    wallet = Wallet.new_wallet()
+    genesis = BlockChain.new_block_chain(wallet.get_address()).blocks_at([0])[0]
+    parent = spend(wallet, genesis.transactions[0], 0, wallet.get_address())
+    child = spend(wallet, parent, 0, "b")
+
+    async def scenario():
+        node = Node(0, wallet, min_block_txs=1)
+        node.new_work = asyncio.Event()
+        task = asyncio.create_task(node.mining_loop())
+        try:
+            await node.submit([parent])
+            await asyncio.sleep(0)
+            assert node.job.txids == {parent.id}
+            # 挖矿进程还在启动, 新交易让当前任务被取消, 重新开始的任务包含两笔交易
+            await node.submit([child])
+            assert node.mining_stop.is_set()
+            assert await node.wait_for_transaction(child.id, 60) is True
+        finally:
+            task.cancel()
+            node.mining_stop.set()
+            node.mining_executor.shutdown(cancel_futures=True)
+            node.verify_executor.shutdown()
+
+    asyncio.run(scenario())
+    block, _ = blockchain.find_transaction(parent.id)
+    assert [tx.id for tx in block.transactions[1:]] == [parent.id, child.id]
+    assert len(blockchain) == 2
+
+
+def test_jobs_run_for_a_minimum_time_before_restarting(use_db, monkeypatch):
+    use_db()
+    monkeypatch.setattr(server, "MIN_JOB_SECONDS", 1)
+    wallet = Wallet.new_wallet()
+    genesis = BlockChain.new_block_chain(wallet.get_address()).blocks_at([0])[0]
+    txs = [spend(wallet, genesis.transactions[0], 0, wallet.get_address())]
+    for _ in range(3):
+        txs.append(spend(wallet, txs[-1], 0, wallet.get_address()))
+
+    async def scenario():
+        node = Node(0, wallet)
+        node.new_work = asyncio.Event()
+        try:
+            await node.submit(txs[:1])
+            job = node.job = MiningJob({txs[0].id}, genesis.hash)
+            # 每笔交易都让模板更好, 但任务开始后 1 秒内不会被取消
+            for tx in txs[1:]:
+                await node.submit([tx])
+                await asyncio.sleep(0)
+                assert not node.mining_stop.is_set()
+            await asyncio.sleep(job.started + 1.1 - time.monotonic())
+            assert node.mining_stop.is_set()
+        finally:
+            node.mining_executor.shutdown()
+            node.verify_executor.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_received_blocks_are_checked_against_the_chain_state(use_db):
+    use_db()
+    owner, thief = Wallet.new_wallet(), Wallet.new_wallet()
+    genesis = BlockChain.new_block_chain(owner.get_address()).blocks_at([0])[0]
+    theft = spend(thief, genesis.transactions[0], 0, thief.get_address())
+    coinbase = Transaction.new_coinbase_transaction(thief.get_address())
+    block = Block.new_block([coinbase, theft], genesis.hash)
+    node = Node(0, owner)
+    try:
+        with pytest.raises(BitcoinException):
+            asyncio.run(node.receive_block(block))
+    finally:
+        node.mining_executor.shutdown()
+        node.verify_executor.shutdown()
+    assert len(blockchain) == 1 and blockchain.get_balance(thief.get_address()) == 0
+
+
+def test_mining_survives_a_killed_mining_process(use_db):
+    use_db()
+    wallet = Wallet.new_wallet()
+    genesis = BlockChain.new_block_chain(wallet.get_address()).blocks_at([0])[0]
+    tx = spend(wallet, genesis.transactions[0], 0, "b")
+
+    async def scenario():
+        node = Node(0, wallet, min_block_txs=1)
+        node.new_work = asyncio.Event()
+        task = asyncio.create_task(node.mining_loop())
+        try:
+            await node.submit([tx])
+            executor = node.mining_executor
+            while not executor._processes:
+                await asyncio.sleep(0.01)
+            for process in list(executor._processes.values()):
+                process.kill()
+            assert await node.wait_for_transaction(tx.id, 60) is True
+            assert node.mining_executor is not executor
+        finally:
+            task.cancel()
+            node.mining_stop.set()
+            node.mining_executor.shutdown(cancel_futures=True)
+            node.verify_executor.shutdown()
+
+    asyncio.run(scenario())
+    assert len(blockchain) == 2
+
+
+def test_commands_over_one_connection(use_db):
+    use_db()
+    wallet = Wallet.new_wallet()
+    genesis = BlockChain.new_block_chain(wallet.get_address()).blocks_at([0])[0]
+
+    async def scenario():
+        node = Node(0, wallet)
+        server = await asyncio.start_server(node.handle_connection, 'localhost', 0)
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+        try:
+            # 同一个连接上的多条命令, 每条都收到一条回复
+            await write_frame('getheaders', encode_range(0, 10), writer)
+            command, data = await read_frame(reader)
+            assert command == 'headers'
+            assert [h.hash for h in decode_headers(data)] == [genesis.hash]
+
+            await write_frame('mempool', b'', writer)
+            command, data = await read_frame(reader)
+            assert command == 'mempool' and json.loads(data)["count"] == 0
+
+            await write_frame('nosuchcmd', b'', writer)
+            assert (await read_frame(reader))[0] == 'error'
+
+            # 不是 UTF-8 的 txid 收到错误回复, 连接仍然可用
+            for command in ('waittx', 'getproof'):
+                await write_frame(command, b'\xff', writer)
+                assert (await read_frame(reader))[0] == 'error'
+            await write_frame('mempool', b'', writer)
+            assert (await read_frame(reader))[0] == 'mempool'
+        finally:
+            writer.close()
+            server.close()
+            await server.wait_closed()
+            node.mining_executor.shutdown()
+            node.verify_executor.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_node_without_a_chain_accepts_only_a_genesis_block(use_db):
+    use_db()
+    wallet = Wallet.new_wallet()
+    genesis = Block.new_block([Transaction.new_coinbase_transaction("a")], "0" * 64)
+    orphan = Block.new_block([Transaction.new_coinbase_transaction("a")], genesis.hash)
+    node = Node(0, wallet)
+
+    async def scenario():
+        node.new_work = asyncio.Event()
+        with pytest.raises(BitcoinException):
+            await node.receive_block(orphan)
+        await node.receive_block(genesis)
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        node.mining_executor.shutdown()
+        node.verify_executor.shutdown()
+    assert len(blockchain) == 1
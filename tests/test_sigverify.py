@@ -0,0 +1,33 @@
+from hashlib import sha256
+
+from bitcoin_in_python.sigverify import PARALLEL_THRESHOLD, verify_transactions
+from bitcoin_in_python.transaction import Transaction, TXInput, TXOutput
+from bitcoin_in_python.wallet import Wallet
+
+
+def test_batch_verification_finds_bad_signature():
+    wallet = Wallet.new_wallet()
+    txs = [Transaction.new_coinbase_transaction(wallet.get_address())]
+    for i in range(PARALLEL_THRESHOLD // 2 + 1):
+        inputs = [TXInput(f"{i:064x}", j, b"", wallet.export_public_key()) for j in range(2)]
+        tx = Transaction("", inputs, [TXOutput(1, wallet.get_address())])
+        tx.hash()
+        tx.sign(wallet)
+        txs.append(tx)
+
+    assert all(tx.verify() for tx in txs[1:])
+    assert verify_transactions(txs, workers=2)
+
+    txs[-1].vout[0].value = 2
+    assert not txs[-1].verify()
+    assert not verify_transactions(txs, workers=2)
+
+
+def test_sighashes_match_trimmed_copy():
+    inputs = [TXInput(f"{i:064x}", i, b"", f"pubkey{i}") for i in range(5)]
+    tx = Transaction("", inputs, [TXOutput(1, "a"), TXOutput(0.5, "b")])
+    tx.hash()
+    for index, digest in enumerate(tx.sighashes([vin.pubkey for vin in inputs])):
+        tx_copy = tx.trimmed_copy()
+        tx_copy.vin[index].pubkey = inputs[index].pubkey
+        assert digest == sha256(tx_copy.compute_id().encode()).digest()
@@ -0,0 +1,66 @@
+import pytest
+
+from bitcoin_in_python.block import Block, BlockChain
+from bitcoin_in_python.exception import BitcoinException
+from bitcoin_in_python.snapshot import dump_utxo, load_utxo
+from bitcoin_in_python.storage import address_index_db, misc_db, utxo_db
+from bitcoin_in_python.transaction import Transaction
+from bitcoin_in_python.wallet import Wallet
+from tests.helpers import make_block, spend
+
+
+def coinbase_block(address: str, prev_block_hash: str) -> Block:
+    return make_block([Transaction.new_coinbase_transaction(address)], prev_block_hash)
+
+
+def test_dump_and_load(tmp_path, use_db):
+    use_db("source.sqlite3")
+    chain = BlockChain()
+    prev_hash = "0" * 64
+    for i in range(5):
+        block = coinbase_block(f"address{i % 2}", prev_hash)
+        chain.add_block(block)
+        prev_hash = block.hash
+    utxos = dict(utxo_db.items())
+    index = dict(address_index_db.items())
+    dump_utxo(tmp_path / "utxo.snapshot", batch=2)
+
+    use_db("node.sqlite3")
+    assert load_utxo(tmp_path / "utxo.snapshot") == (prev_hash, 4, 5)
+    assert dict(utxo_db.items()) == utxos and dict(address_index_db.items()) == index
+    assert len(chain) == 5 and chain.get_balance("address0") == 3
+    # 只同步快照之后的区块, 本地没有之前的区块
+    chain.add_block(coinbase_block("address1", prev_hash))
+    assert len(chain) == 6 and chain.get_balance("address1") == 3
+    assert [block.height for block in chain] == [5]
+    with pytest.raises(BitcoinException):
+        load_utxo(tmp_path / "utxo.snapshot")
+
+    # 校验和不一致时不留下任何改动
+    data = bytearray((tmp_path / "utxo.snapshot").read_bytes())
+    data[-40] ^= 1
+    (tmp_path / "broken.snapshot").write_bytes(data)
+    use_db("broken.sqlite3")
+    with pytest.raises(BitcoinException):
+        load_utxo(tmp_path / "broken.snapshot")
+    assert len(utxo_db) == 0 and 'last_block_hash' not in misc_db
+
+
+def test_confirm_local_spend_of_snapshot_output(tmp_path, use_db):
+    use_db("source.sqlite3")
+    wallet = Wallet.new_wallet()
+    address = wallet.get_address()
+    chain = BlockChain()
+    genesis = coinbase_block(address, "0" * 64)
+    chain.add_block(genesis)
+    dump_utxo(tmp_path / "utxo.snapshot")
+
+    # 快照节点没有交易索引, 客户端先在本地处理的交易上链时要用当时记下的撤销记录
+    use_db("node.sqlite3")
+    load_utxo(tmp_path / "utxo.snapshot")
+    tx = spend(wallet, genesis.transactions[0], 0, "b")
+    chain.update_unspent_txs_set(tx)
+    chain.add_block(make_block([Transaction.new_coinbase_transaction("c"), tx], genesis.hash))
+    assert len(chain) == 2 and chain.get_balance("b") == 1
+    chain.disconnect_tip()
+    assert chain.get_balance(address) == 1 and chain.get_balance("b") == 0
@@ -0,0 +1,125 @@
+import threading
+
+import pytest
+
+from bitcoin_in_python import storage
+from bitcoin_in_python.block import BlockChain
+from bitcoin_in_python.exception import BitcoinException
+from bitcoin_in_python.storage import BlockStore, CachedTable, Database, Table
+from tests.helpers import mined_chain
+
+
+def test_transaction_rolls_back_every_table(tmp_path):
+    db = Database(tmp_path / "db.sqlite3")
+    blocks = Table(db, "blocks")
+    misc = Table(db, "misc")
+    misc["tip"] = "a"
+
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            blocks["b"] = 1
+            with db.transaction():
+                misc["tip"] = "b"
+            raise RuntimeError
+
+    assert "b" not in blocks
+    assert misc["tip"] == "a"
+
+    with db.transaction():
+        blocks["b"] = 1
+        misc["tip"] = "b"
+    reopened = Database(tmp_path / "db.sqlite3")
+    assert Table(reopened, "blocks")["b"] == 1
+    assert Table(reopened, "misc")["tip"] == "b"
+
+
+def test_cached_table_stays_consistent(tmp_path):
+    db = Database(tmp_path / "db.sqlite3")
+    table = CachedTable(db, "blocks", max_bytes=64)
+    for i in range(10):
+        table[str(i)] = "x" * 10
+    assert table.get_many(["1", "5", "missing"]) == {"1": "x" * 10, "5": "x" * 10}
+    assert table._cached_bytes <= 64
+
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            table["new"] = "y"
+            raise RuntimeError
+    assert "new" not in table
+
+    assert table.pop("5") == "x" * 10
+    assert "5" not in table and table.get_many(["5"]) == {}
+
+
+def test_cached_table_is_shared_between_threads(tmp_path):
+    db = Database(tmp_path / "db.sqlite3")
+    table = CachedTable(db, "blocks", max_bytes=200)
+    for i in range(50):
+        table[str(i)] = "x" * 10
+
+    def read():
+        for _ in range(20):
+            table.get_many(str(i) for i in range(50))
+
+    threads = [threading.Thread(target=read) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    sizes = [size for _, size in table._cache.values()]
+    assert table._cached_bytes == sum(sizes) <= 200
+
+
+def test_block_store_appends_rotates_and_rolls_back(tmp_path):
+    db = Database(tmp_path / "db.sqlite3")
+    store = BlockStore(db, "blocks", max_bytes=0, max_file_bytes=100)
+    for i in range(6):
+        store[str(i)] = "x" * 30  # 编码后约 45 字节, 每个文件放两个
+    assert len(list((tmp_path / "db_blocks").glob("blk*.dat"))) == 3
+    assert store.get_many(["0", "3", "missing"]) == {"0": "x" * 30, "3": "x" * 30}
+
+    sizes = {p.name: p.stat().st_size for p in (tmp_path / "db_blocks").iterdir()}
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            store["6"] = "y" * 30
+            store["7"] = "y" * 30
+            raise RuntimeError
+    assert "6" not in store and "7" not in store
+    assert {p.name: p.stat().st_size for p in (tmp_path / "db_blocks").iterdir()} == sizes
+
+    del store["2"]
+    store["8"] = "z"
+    reopened = BlockStore(Database(tmp_path / "db.sqlite3"), "blocks")
+    assert dict(reopened.items()) == {
+        **{str(i): "x" * 30 for i in (0, 1, 3, 4, 5)},
+        "8": "z",
+    }
+
+
+def test_block_store_fsyncs_once_before_commit(tmp_path, monkeypatch):
+    db = Database(tmp_path / "db.sqlite3")
+    store = BlockStore(db, "blocks")
+    store["0"] = "x"
+    events: list[str] = []
+    monkeypatch.setattr(storage.os, "fsync", lambda fd: events.append("fsync"))
+    db.connection.set_trace_callback(events.append)
+    with db.transaction():
+        for i in range(1, 4):
+            store[str(i)] = "x"
+    assert events.count("fsync") == 1
+    assert events[-2:] == ["fsync", "COMMIT"]
+
+
+def test_import_blocks_pickled_by_old_versions(use_db):
+    use_db()
+    block = mined_chain(1)[0]
+    # 旧版本的 SqliteDict 用 pickle 保存整个 Block 对象
+    Table(storage.db, 'blockchain')[block.hash] = block
+    storage.misc_db['last_block_hash'] = block.hash
+    with pytest.raises(BitcoinException):
+        len(BlockChain())  # 复制之前找不到区块
+    assert storage.import_sqlite_blocks() == 1
+    assert len(BlockChain()) == 1
+    imported = storage.chain_db[block.hash]
+    assert imported.hash == block.hash
+    assert [tx.id for tx in imported.transactions] == [tx.id for tx in block.transactions]
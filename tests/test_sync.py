@@ -0,0 +1,106 @@
+import pytest
+
+from bitcoin_in_python import sync
+from bitcoin_in_python.block import Block, BlockChain
+from bitcoin_in_python.exception import BitcoinException
+from bitcoin_in_python.serialization import encode_blocks, encode_headers
+from bitcoin_in_python.sync import GENESIS_PREV_HASH, check_block, check_headers
+from bitcoin_in_python.transaction import Transaction
+from bitcoin_in_python.wallet import Wallet
+from tests.helpers import make_block, mined_chain, spend
+
+
+def test_headers_and_blocks_are_checked():
+    blocks = mined_chain(3)
+    headers = [block.header() for block in blocks]
+    check_headers(headers, GENESIS_PREV_HASH, 0)
+    for block, header in zip(blocks, headers):
+        check_block(block, header)
+
+    with pytest.raises(BitcoinException):
+        check_headers(headers[1:], GENESIS_PREV_HASH, 1)  # 不与本地链相连
+
+    headers[2].nonce += 1
+    with pytest.raises(BitcoinException):
+        check_headers(headers, GENESIS_PREV_HASH, 0)
+
+    blocks[1].transactions[0].vout[0].value = 50
+    with pytest.raises(BitcoinException):
+        check_block(blocks[1], blocks[1].header())
+
+
+def test_pipeline_commits_batches_before_an_invalid_one(use_db, monkeypatch):
+    use_db()
+    monkeypatch.setattr(sync, "BLOCKS_PER_REQUEST", 2)
+    blocks = mined_chain(7)
+    headers = [block.header() for block in blocks]
+    blocks[5].transactions[0].vout[0].value = 50  # 第三批中的区块被篡改
+
+    def request(command: str, data: bytes) -> tuple[str, bytes]:
+        start, count = sync.decode_range(data)
+        if command == 'getheaders':
+            return 'headers', encode_headers(headers[start : start + count])
+        return 'blocks', encode_blocks(blocks[start : start + count])
+
+    chain = BlockChain()
+    with pytest.raises(BitcoinException):
+        sync.sync_chain(request, chain, workers=2)
+    # 前两批已经检查通过并提交
+    assert len(chain) == 4
+
+
+def test_blocks_are_checked_against_the_chain_state(use_db):
+    use_db()
+    owner, thief = Wallet.new_wallet(), Wallet.new_wallet()
+    genesis = Block.new_block(
+        [Transaction.new_coinbase_transaction(owner.get_address())], GENESIS_PREV_HASH
+    )
+    coin = genesis.transactions[0]
+    # 小偷用自己的公钥签名花费别人的输出, 并且凭空多造出 999 个币. 签名本身是有效的
+    theft = spend(thief, coin, 0, thief.get_address(), value=1000)
+    stolen = Block.new_block(
+        [Transaction.new_coinbase_transaction(thief.get_address()), theft], genesis.hash
+    )
+    stolen.height = 1
+    blocks = [genesis, stolen]
+
+    def request(command: str, data: bytes) -> tuple[str, bytes]:
+        start, count = sync.decode_range(data)
+        if command == 'getheaders':
+            return 'headers', encode_headers([b.header() for b in blocks[start:][:count]])
+        return 'blocks', encode_blocks(blocks[start:][:count])
+
+    chain = BlockChain()
+    with pytest.raises(BitcoinException):
+        sync.sync_chain(request, chain, workers=1)
+    # 两个区块在同一批中, 一起回滚
+    assert len(chain) == 0 and chain.get_balance(thief.get_address()) == 0
+    chain.add_block(genesis)
+
+    def block(*txs: Transaction, prev_block_hash: str) -> Block:
+        coinbase = Transaction.new_coinbase_transaction(owner.get_address())
+        return make_block([coinbase, *txs], prev_block_hash)
+
+    rejected = [
+        spend(thief, coin, 0, thief.get_address()),  # 不是输出的主人
+        spend(owner, coin, 0, thief.get_address(), value=2),  # 输出多于输入
+        spend(owner, coin, 0, thief.get_address(), value=-1),
+    ]
+    for tx in rejected:
+        with pytest.raises(BitcoinException):
+            chain.add_block(block(tx, prev_block_hash=genesis.hash))
+    with pytest.raises(BitcoinException):
+        chain.add_block(make_block([coin], genesis.hash))  # 重复的 coinbase
+
+    paid = block(spend(owner, coin, 0, thief.get_address()), prev_block_hash=genesis.hash)
+    chain.add_block(paid)
+    with pytest.raises(BitcoinException):
+        # 再次花费已经花掉的输出
+        chain.add_block(
+            block(spend(owner, coin, 0, owner.get_address()), prev_block_hash=paid.hash)
+        )
+    with pytest.raises(BitcoinException):
+        chain.add_block(block(prev_block_hash=genesis.hash))  # 不接在链顶之后
+    assert len(chain) == 2
+    assert chain.get_balance(owner.get_address()) == 1
+    assert chain.get_balance(thief.get_address()) == 1
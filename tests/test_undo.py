@@ -0,0 +1,50 @@
+import pytest
+
+from bitcoin_in_python.block import BlockChain
+from bitcoin_in_python.exception import BitcoinException
+from bitcoin_in_python.storage import (
+    address_index_db,
+    tx_index_db,
+    utxo_db,
+)
+from bitcoin_in_python.transaction import Transaction
+from bitcoin_in_python.wallet import Wallet
+from tests.helpers import make_block, spend
+
+
+@pytest.fixture
+def chain(use_db):
+    use_db()
+    return BlockChain()
+
+
+def state() -> tuple[dict, dict, dict]:
+    return dict(utxo_db.items()), dict(address_index_db.items()), dict(tx_index_db.items())
+
+
+def test_disconnect_and_reindex(chain):
+    a, b = Wallet.new_wallet(), Wallet.new_wallet()
+    genesis = make_block([Transaction.new_coinbase_transaction(a.get_address())], "0" * 64)
+    chain.add_block(genesis)
+    before = state()
+
+    # 同一区块中的第二笔交易花费第一笔交易的输出
+    first = spend(a, genesis.transactions[0], 0, b.get_address())
+    second = spend(b, first, 0, a.get_address())
+    coinbase = Transaction.new_coinbase_transaction(b.get_address())
+    block = make_block([coinbase, first, second], genesis.hash)
+    chain.add_block(block)
+    after = state()
+
+    assert chain.disconnect_tip().hash == block.hash
+    assert state() == before and len(chain) == 1
+    with pytest.raises(BitcoinException):
+        chain.disconnect_tip()
+
+    chain.add_block(block)
+    assert state() == after
+    progress = []
+    assert chain.reindex(batch=1, progress=lambda *p: progress.append(p)) == 2
+    assert progress == [(1, 2), (2, 2)]
+    assert state() == after
+    assert chain.disconnect_tip().hash == block.hash and state() == before
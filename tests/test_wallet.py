@@ -0,0 +1,19 @@
+from bitcoin_in_python.wallet import Wallets
+
+
+def test_wallets_round_trip_and_lookup(tmp_path):
+    wallets = Wallets.load(tmp_path / "wallets.json")
+    alice = wallets.create("alice")
+    wallets.create("bob")
+    wallets.save()
+
+    loaded = Wallets.load(tmp_path / "wallets.json")
+    assert loaded.names() == ["alice", "bob"]
+    assert loaded.find_by_address(alice.get_address()) == "alice"
+    assert loaded.find_by_pubkey_hash(alice.pubkey_hash) == "alice"
+    assert loaded._wallets == {}  # 查找不需要解析私钥
+
+    wallet = loaded.get("alice")
+    assert wallet.export_public_key() == alice.export_public_key()
+    assert wallet.get_address() == alice.get_address()
+    assert loaded.get("carol") is None